@@ -24,6 +24,7 @@ from Audex.utils.utils_audex  import Aimx
 parser = argparse.ArgumentParser(description = 'Inference service')
 
 parser.add_argument("-model_path", default=Aimx.MOST_RECENT_OUTPUT, type=Path, help='Path to the model to be loaded.')
+parser.add_argument("-jit",     action='store_true',                           help='XLA-compile the model, with a persistent compilation cache in the workdir from TensorFlow 2.12 on.')
 parser.add_argument("-example", action='store_true',                           help='Show a working example on how to call the script.')
 
 args = parser.parse_args()
@@ -63,7 +64,7 @@ def predict():
     af_received.save(local_temp_af_path)
 
     # instantiate keyword spotting service singleton and get prediction
-    asr = CreateAsrService(args.model_path)
+    asr = CreateAsrService(args.model_path, args.jit)
     
     asr.load_audiofile(local_temp_af_path, load_duration=1)
     if len(asr.af_signal) >= asr.af_sr: # process only signals of at least 1 sec
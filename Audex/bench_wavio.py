@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+from pathlib import Path
+import argparse
+import librosa
+import numpy as np
+import time
+import sys
+import os
+
+# Add this directory to path so that package is recognized.
+# Looks like a hack, but is ok for now to allow moving forward.
+# Source: https://stackoverflow.com/a/23891673/4973224
+# TODO: Replace with the idiomatic way.
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from Audex.utils.utils_common import *
+from Audex.utils.utils_wavio  import load_wav
+
+parser = argparse.ArgumentParser(description = 'This utility script benchmarks the fast native WAV decoder against librosa.load()'
+                                               ' on the audio files of a dataset (e.g. on 16 kHz speech_commands clips).')
+
+parser.add_argument("-dataset_path",  type = Path,                 help = 'Path to a dataset of sound files.')
+parser.add_argument("-num_files",     default =   500, type=int,   help = 'Number of files to benchmark on.')
+parser.add_argument("-sample_rate",   default = 22050, type=int,   help = 'Sample rate at which to read the audio files.')
+parser.add_argument("-load_duration", default =     1, type=float, help = 'Only load up to this much audio (in seconds).')
+parser.add_argument("-res_type",      default = "kaiser_best", type=str, help = 'Resampler used by librosa.load() (kaiser_best is the librosa 0.8 default).')
+parser.add_argument("-example",       action ='store_true',        help = 'Show a working example on how to call the script.')
+
+args = parser.parse_args()
+
+########################## Command Argument Handling & Verification #######################
+
+if args.example:
+    print_info(nameofthis(__file__) + " -dataset_path ../workdir/datasets/speech_commands_v001 -num_files 1000 -sample_rate 16000")
+    exit()
+
+if not provided(args.dataset_path) or not args.dataset_path.exists():
+    raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(args.dataset_path)))
+
+###########################################################################################
+
+print_script_start_preamble(nameofthis(__file__), vars(args))
+
+def librosa_load(af_path, sr, duration):
+    return librosa.load(af_path, sr = sr, duration = duration, res_type = args.res_type)
+
+def bench(load, af_paths):
+    signals = []
+    start_time = time.time()
+    for af_path in af_paths:
+        signals.append(load(af_path, sr = args.sample_rate, duration = args.load_duration)[0])
+    return signals, time.time() - start_time
+
+if __name__ == "__main__":
+
+    af_paths = []
+    for dirpath, _, afnames in os.walk(args.dataset_path):
+        af_paths += [os.path.join(dirpath, afname) for afname in afnames if afname.endswith(".wav")]
+        if len(af_paths) >= args.num_files:
+            break
+    af_paths = sorted(af_paths)[:args.num_files]
+
+    # warm up both loaders (imports, caches, etc.) so that only the decoding itself is measured
+    load_wav(af_paths[0], sr = args.sample_rate, duration = args.load_duration)
+    librosa_load(af_paths[0], sr = args.sample_rate, duration = args.load_duration)
+
+    librosa_signals, librosa_sec = bench(librosa_load, af_paths)
+    fastwav_signals, fastwav_sec = bench(load_wav,     af_paths)
+
+    # compare outputs: identical when no resampling is needed, otherwise the resamplers differ slightly
+    max_diffs = [np.abs(ls - fs).max() if len(ls) == len(fs) else np.inf for ls, fs in zip(librosa_signals, fastwav_signals)]
+    snrs      = [10 * np.log10(np.sum(ls**2) / max(np.sum((ls - fs)**2), 1e-20)) for ls, fs in zip(librosa_signals, fastwav_signals) if len(ls) == len(fs)]
+
+    print_info("Benchmarked on {} files at {} Hz".format(len(af_paths), args.sample_rate))
+    print_info("librosa.load: {:8.2f} ms/file".format(1000 * librosa_sec / len(af_paths)))
+    print_info("load_wav:     {:8.2f} ms/file".format(1000 * fastwav_sec / len(af_paths)))
+    print_info("Speedup:      {}".format(lightyellow("{:.1f}x".format(librosa_sec / max(fastwav_sec, 1e-9)))))
+    print_info("Max abs difference: {:.6f}, min SNR vs librosa: {:.1f} dB".format(max(max_diffs), min(snrs) if snrs else float('nan')))
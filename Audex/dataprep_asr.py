@@ -1,14 +1,10 @@
 #!/usr/bin/env python
 
-from itertools import islice
-from pathlib import PurePath
+from functools import partial
 from pathlib import Path
 from datetime import timedelta
 import time
 import argparse
-import librosa
-import json
-import math
 import sys
 import os
 
@@ -18,8 +14,9 @@ import os
 # TODO: Replace with the idiomatic way.
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from Audex.utils.utils_common import *
-from Audex.utils.utils_audex  import *
+from Audex.utils.utils_common   import *
+from Audex.utils.utils_audex    import *
+from Audex.utils.utils_dataprep import *
 
 # Download from https://ai.googleblog.com/2017/08/launching-speech-commands-dataset.html
 
@@ -38,151 +35,250 @@ parser = argparse.ArgumentParser(description = 'This utility script allows you t
 parser.add_argument("-dataset_view",   nargs='*',   default = DATASET_VIEW_DEFAULT, help = 'Specific directories (labels) to go through.')
 parser.add_argument("-dataset_path",   type = Path, default = DATASET_DIR_DEFAULT,  help = 'Path to a dataset of sound files.')
 parser.add_argument("-dataset_depth",  default =     5, type=int, help = 'Number of files to consider from each category.')
-parser.add_argument("-n_mfcc",         default =    13, type=int, help = 'Number of MFCC to extract.')
-parser.add_argument("-n_fft",          default =  2048, type=int, help = 'Length of the FFT window.   Measured in # of samples.')
-parser.add_argument("-hop_length",     default =   512, type=int, help = 'Sliding window for the FFT. Measured in # of samples.')
+parser.add_argument("-n_mfcc",         nargs='+',   default =  [13], type=int, help = 'Number of MFCC to extract.')
+parser.add_argument("-n_fft",          nargs='+',   default = [2048], type=int, help = 'Length of the FFT window.   Measured in # of samples.')
+parser.add_argument("-hop_length",     nargs='+',   default =  [512], type=int, help = 'Sliding window for the FFT. Measured in # of samples.')
 parser.add_argument("-num_segments",   default =     5, type=int, help = 'Number of segments we want to divide sample tracks into.')
 parser.add_argument("-sample_rate",    default = 22050, type=int, help = 'Sample rate at which to read the audio files.')
 parser.add_argument("-load_duration",  default =     1, type=int, help = 'Only load up to this much audio (in seconds).')
+parser.add_argument("-features",       nargs='+',   default = [Aimx.TrainData.MFCC], choices = FEATURE_TYPES,
+                                       help = 'Features to extract in one pass over a shared spectrogram, each saved as its own traindata section.')
+parser.add_argument("-n_mels",         nargs='+',   default =  [128], type=int, help = 'Number of mel bands of the log-mel spectrogram (the MFCCs are computed from).')
+parser.add_argument("-workers",        default =     1, type=int, help = 'Number of worker processes to extract MFCCs in parallel (0 = all cores).')
+parser.add_argument("-feature_cache_mb", default = 2048, type=int, help = 'Size cap of the on-disk per-file feature cache in Mb (0 = disable the cache).')
+parser.add_argument("-fast_mfcc",      action ='store_true',      help = 'Extract MFCCs in batches with the vectorized engine instead of librosa.')
+parser.add_argument("-fast_wav",       action ='store_true',      help = 'Decode WAV files with the fast native decoder instead of librosa.')
+parser.add_argument("-traindata_format", default = Aimx.TrainData.FORMAT_BINARY, choices = Aimx.TrainData.FORMATS,
+                                         help = 'Format of the traindata: binary (memory-mappable .npy arrays), legacy json or h5 (chunked HDF5 with random access).')
+parser.add_argument("-feature_dtype",  default = "float32", choices = FEATURE_DTYPES,
+                                       help = 'Store the features as float32, float16 (half the size) or int8 (a quarter, quantized per coefficient).')
+parser.add_argument("-h5_compression", default = "none", choices = H5_COMPRESSIONS, help = 'Compression of h5 traindata: none, gzip (smallest) or lzf (fastest).')
+parser.add_argument("-shard_size",     default = 10000, type=int, help = 'Minimum number of samples per shard written while processing, shards are cut between audio files (0 = one shard per label).')
+parser.add_argument("-use_index",      action ='store_true',      help = 'Pick the audio files from the dataset index (see dataset_index.py) instead of walking the dataset.')
+parser.add_argument("-pcm_store",      action ='store_true',      help = 'Read the decoded audio from the PCM store of the dataset (for this -sample_rate and -load_duration),'
+                                                                      ' decoding into it only the files not there yet. Parameter sweeps thus decode the audio only once.')
+parser.add_argument("-pcm_store_dtype", default = "float32", choices = PCM_STORE_DTYPES,
+                                        help = 'Sample type of the PCM store: float32 (same signals as decoded) or int16 (half the size, 16-bit quantized).')
+parser.add_argument("-restart",        action ='store_true',      help = 'Start over instead of resuming an interrupted run with the same arguments.')
+parser.add_argument("-recompute",      action ='store_true',      help = 'Make the traindata anew even if the artifact catalog has traindata made with the same arguments.')
 parser.add_argument("-cutname",        action ='store_true',      help = 'Generate a json name with no details (cut).')
 parser.add_argument("-verbose",        action ='store_true',      help = 'Print more detailed output messages.')
 parser.add_argument("-example",        action ='store_true',      help = 'Show a working example on how to call the script.')
 
-args = parser.parse_args()
-
-########################## Command Argument Handling & Verification #######################
-
-if args.example:
-    print_info(nameofthis(__file__) + " -dataset_path ../workdir/dataset -dataset_depth 5")
-    exit()
-
-if provided(args.dataset_path) and not args.dataset_path.exists():
-    raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(args.dataset_path)))
-
-if not provided(args.dataset_path) and not Path(DATASET_DIR_DEFAULT).exists():
-    raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain default dataset directory " + quote(pinkred(DATASET_DIR_DEFAULT_NAME)))
-
-if Aimx.Dataprep.ALL_DIR_LABELS in args.dataset_view: # special value ok for now, may need to be rewritten in a better way
-    args.dataset_view = get_all_dirnames_in(args.dataset_path)
-
-###########################################################################################
-
-print_script_start_preamble(nameofthis(__file__), vars(args))
-
-def preprocess_dataset(dataset_path, n_mfcc = 13, n_fft = 2048, hop_length = 512, num_segments = 5, sample_rate = 22050, load_duration = 30):
+def preprocess_dataset(dataset_path, label_afentries, configs, num_segments = 5, sample_rate = 22050, load_duration = 30, workers = 1):
     """
     Extracts MFCC from music dataset and saves them into a json file along witgh genre labels.
+    Several traindata are produced in the same pass, one for each feature extraction configuration.
         :param  dataset_path (str): Path to dataset.
-        :param        n_mfcc (int): Number of MFCC to extract.
-        :param         n_fft (int): Length of the FFT window.   Measured in # of samples.
-        :param    hop_length (int): Sliding window for the FFT. Measured in # of samples.
+        :param label_afentries (list): The audio files to process, label by label (see list_dataset_afentries()).
+        :param      configs (list): Feature extraction configurations (see FeatureConfig), i.e. n_mfcc, n_fft, hop_length and n_mels of each traindata.
         :param: num_segments (int): Number of segments we want to divide sample tracks into.
+        :param       workers (int): Number of worker processes to extract MFCCs in parallel.
+        :return (tuple): Lists of the traindata, of their ids and of their writers, one of each for every configuration.
     """
-    traindata_id = compose_traindata_id(args.dataset_depth, args.dataset_view, dataset_path,
-                                       n_mfcc, n_fft, hop_length, num_segments, sample_rate, load_duration)
+    traindata_ids = [compose_traindata_id(args.dataset_depth, args.dataset_view, dataset_path,
+                                          config.n_mfcc, config.n_fft, config.hop_length, num_segments, sample_rate, load_duration,
+                                          features = args.features, n_mels = config.n_mels, feature_dtype = args.feature_dtype) for config in configs]
 
-    # dictionary to store mapping, labels, and MFCC
-    traindata = {
+    # dictionary to store mapping, labels, and features
+    traindatas = [{
        Aimx.TIMESTAMP          : [],
        Aimx.DURATION           : [],
        Aimx.TrainData.MAPPING  : [],
        Aimx.TrainData.LABELS   : [],
        Aimx.TrainData.FILES    : [],
-       Aimx.TrainData.MFCC     : []
-    }
+       **{feature: [] for feature in args.features} # MFCC only by default
+    } for config in configs]
+
+    # features and labels are streamed to disk shard by shard as soon as they are extracted,
+    # and journaled along with every shard, so that an interrupted run can be resumed by rerunning it with the same arguments
+    writers = [open_traindata_writer(compose_traindata_filename(traindata_id, args.traindata_format), args.shard_size,
+                                     compose_dataprep_journal_key(args, config), resume = not args.restart,
+                                     array_dtypes = Aimx.TrainData.array_dtypes(args.features), h5_compression = args.h5_compression,
+                                     feature_dtype = args.feature_dtype) for traindata_id, config in zip(traindata_ids, configs)]
 
 #    samples_per_segment = int(SAMPLES_PER_TRACK / num_segments)
 #    expected_num_of_mfcc_vectors_per_segment = math.ceil(samples_per_segment / hop_length) # mfccs are calculater per hop
 
     print_info("vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv preprocess_dataset()")
-    print_info("traindata_id   =", traindata_id)
-    print_info("n_mfcc         =", n_mfcc)
-    print_info("n_fft          =", n_fft)
-    print_info("hop_length     =", hop_length)
+    print_info("traindata_id   =", traindata_ids)
+    print_info("n_mfcc         =", args.n_mfcc)
+    print_info("n_fft          =", args.n_fft)
+    print_info("hop_length     =", args.hop_length)
+    print_info("n_mels         =", args.n_mels)
     print_info("num_segments   =", num_segments)
     print_info("sample_rate    =", sample_rate)
     print_info("load_duration  =", load_duration)
-
-    label_id = 0
-
-    # loop through all subfolders
-    for dirpath, _, afnames in os.walk(dataset_path):
-        
-        # ensure we're processing at subfolder level
-        if PurePath(dirpath).name is PurePath(dataset_path).name:
-            continue
-
-        # process only those dir-labels that are in the requested view
-        if extract_filename(dirpath) not in args.dataset_view:
-            continue
-
-        # save genre label (i.e. subfolder name) in the mapping
-        label_name = PurePath(dirpath).name
-        traindata[Aimx.TrainData.MAPPING].append(label_name)
+    print_info("features       =", args.features)
+    print_info("workers        =", workers)
+    print_info("shard_size     =", args.shard_size)
+    print_info("use_index      =", args.use_index)
+    print_info("pcm_store      =", args.pcm_store)
+
+    global total_audios_length_sec
+
+    if args.use_index:
+        # the index tells which clips are shorter than 1 sec (or unreadable), so they are skipped without decoding them,
+        # and the total audio length is summed up from the headers of all the files considered
+        label_afpaths = [(label_name, [af_path for af_path, entry in afentries if not entry[ENTRY_SHORT]]) for label_name, afentries in label_afentries]
+        total_audios_length_sec += sum(indexed_duration(entry, load_duration) for _, afentries in label_afentries for _, entry in afentries)
+    else:
+        label_afpaths = [(label_name, [af_path for af_path, _ in afentries]) for label_name, afentries in label_afentries]
+    af_paths      = [af_path for _, label_af_paths in label_afpaths for af_path in label_af_paths]
+
+    # carry on from the last shards written by an interrupted run, if any
+    num_files_done, resumed_total_sec = resume_dataprep(writers, traindatas)
+    if resumed_total_sec is not None:
+        total_audios_length_sec = resumed_total_sec
+        print_info("Resuming interrupted dataprep after {} of {} audio files (use -restart to start over)".format(min(num_files_done), len(af_paths)))
+
+    # the audio is decoded into the PCM store only once for all the runs with the same -sample_rate and -load_duration
+    pcm_store = None
+    if args.pcm_store:
+        pcm_store = compose_pcm_store_path(dataset_path, sample_rate, load_duration, args.pcm_store_dtype, args.fast_wav)
+        num_decoded, num_stored = update_pcm_store(pcm_store, dataset_path, label_afpaths, sample_rate, load_duration,
+                                                   args.fast_wav, args.pcm_store_dtype, workers)
+        print_info("PCM store {}: {} audio files decoded, {} already there".format(quote_path(pcm_store), num_decoded, num_stored))
+
+    extract = partial(extract_asr_features, configs = configs, sample_rate = sample_rate, load_duration = load_duration, fast_mfcc = args.fast_mfcc,
+                                            fast_wav = args.fast_wav, features = args.features, pcm_store = pcm_store)
+
+    # files whose features are already in the cache (for the same extraction parameters) are not recomputed
+    cache   = FeatureCache(os.path.join(Aimx.Paths.GEN_CACHE, "features"), args.feature_cache_mb)
+    extract = partial(extract_cached, extract = extract, cache = cache)
+
+    # results are streamed back in the same deterministic label/file order as listed above
+    results = imap_audiofiles(extract, af_paths[min(num_files_done):], workers)
+
+    extraction_start_time = time.time()
+    num_files = 0
+
+    for label_id, (label_name, label_af_paths) in enumerate(label_afpaths):
+
+        # save label (i.e. subfolder name) in the mapping
+        for traindata in traindatas:
+            if label_id == len(traindata[Aimx.TrainData.MAPPING]): # not yet in there from the resumed run
+                traindata[Aimx.TrainData.MAPPING].append(label_name)
         print_info("\nProcessing label {} {}".format(cyan(label_id), label_name))
 
         # process all audio files in subfolders
-        for pbi, afname in enumerate(islice(afnames, args.dataset_depth)):
+        for pbi in range(len(label_af_paths)):
 
-            if not afname.endswith(".wav"):
-                continue
+            progress_bar(pbi, len(label_af_paths))
 
-            global total_audios_length_sec
-            
-            progress_bar(pbi, min(len(afnames), args.dataset_depth))
+            num_files += 1
+            if num_files <= min(num_files_done):
+                continue # already processed by the resumed run
 
-		    # load audio file
-            af_path                  = os.path.join(dirpath, afname)
-            signal, sample_rate      = librosa.load(af_path, sr = sample_rate, duration = load_duration)
-            total_audios_length_sec += librosa.get_duration(signal, sample_rate)
+            hit, (af_path, num_samples, duration, af_features) = next(results)
+            cache.count(hit)
+            if not args.use_index: # otherwise already summed up from the index
+                total_audios_length_sec += duration
 
-            print_info("\nTotal samples in signal (audio track) {} = {}".format(extract_filename(af_path), len(signal)),
+            print_info("\nTotal samples in signal (audio track) {} = {}".format(extract_filename(af_path), num_samples),
                        verbose = args.verbose)
 
-            # drop audio files with less than pre-decided number of samples
-            if len(signal) >= args.sample_rate: # i.e. only those longer than 1 sec
+            for c, (traindata, writer) in enumerate(zip(traindatas, writers)):
+                if num_files <= num_files_done[c]:
+                    continue # already in the shards of this traindata written by the resumed run
 
-                # ensure strict consistency of the length of the signal (exactly 1 second)
-                signal = signal[:args.sample_rate]
+                # audio files shorter than 1 sec come back with no features
+                if af_features is not None:
+                    # store data for analysed track
+                    writer.append({**af_features[c], Aimx.TrainData.LABELS: label_id})
+                    traindata[Aimx.TrainData.FILES ].append(af_path)
 
-                # extract MFCCs
-                mfcc = librosa.feature.mfcc(signal, sample_rate, n_mfcc=n_mfcc, n_fft=n_fft, hop_length=hop_length)
+                writer.checkpoint(compose_dataprep_state(num_files, traindata, total_audios_length_sec))
 
-                # store data for analysed track
-                traindata[Aimx.TrainData.MFCC  ].append(mfcc.T.tolist())
-                traindata[Aimx.TrainData.LABELS].append(label_id)
-                traindata[Aimx.TrainData.FILES ].append(af_path)
+            if af_features is not None:
                 print_info("{}: {}".format(cyansky(af_path), label_id), verbose = args.verbose)
 
-        label_id += 1
-    
+        if args.shard_size == 0:
+            for traindata, writer in zip(traindatas, writers):
+                writer.flush(compose_dataprep_state(num_files, traindata, total_audios_length_sec)) # one shard per label
+
     print("\n")
-    return traindata, traindata_id
+    print_dataprep_throughput(len(af_paths) - min(num_files_done), time.time() - extraction_start_time, workers)
+
+    if cache.enabled():
+        cache.evict()
+        cache.print_stats()
+    return traindatas, traindata_ids, writers
                 
 if __name__ == "__main__":
-    
+
+    args = parser.parse_args()
+
+    ########################## Command Argument Handling & Verification #######################
+
+    if args.example:
+        print_info(nameofthis(__file__) + " -dataset_path ../workdir/dataset -dataset_depth 5")
+        print_info(nameofthis(__file__) + " -dataset_path ../workdir/dataset -dataset_depth 5 -n_mfcc 13 20 40 -hop_length 256 512 # 6 traindata in one pass")
+        exit()
+
+    if provided(args.dataset_path) and not args.dataset_path.exists():
+        raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(args.dataset_path)))
+
+    if not provided(args.dataset_path) and not Path(DATASET_DIR_DEFAULT).exists():
+        raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain default dataset directory " + quote(pinkred(DATASET_DIR_DEFAULT_NAME)))
+
+    if Aimx.Dataprep.ALL_DIR_LABELS in args.dataset_view: # special value ok for now, may need to be rewritten in a better way
+        args.dataset_view = get_all_dirnames_in(args.dataset_path)
+
+    ###########################################################################################
+
+    print_script_start_preamble(nameofthis(__file__), vars(args))
+
     start_time = time.time()
 
-    traindata, traindata_id = preprocess_dataset(args.dataset_path, n_mfcc = args.n_mfcc,        
-                                                                     n_fft = args.n_fft,         
-                                                                hop_length = args.hop_length,
-                                                              num_segments = args.num_segments,
-                                                               sample_rate = args.sample_rate, 
-                                                             load_duration = args.load_duration)
-    traindata_filename = traindata_id + ".json"
+    # the traindata already made with the same parameters by an earlier run (see the artifact catalog) are reused, only the others are made
+    # from the very same audio files (see fingerprint_audiofiles())
+    label_afentries = list_dataset_afentries(args.dataset_path, args.dataset_view, args.dataset_depth, args.use_index)
+    fingerprint     = fingerprint_audiofiles(label_afentries, args.dataset_path)
+    configs   = compose_feature_configs(args)
+    params    = [compose_dataprep_catalog_params(args, config, nameofthis(__file__), fingerprint) for config in configs]
+    artifacts = [None if args.recompute else find_artifact(Aimx.Catalog.FULLPATH, KIND_TRAINDATA, config_params, args.dataset_path, args.dataset_view,
+                                                                                                                 args.dataset_depth) for config_params in params]
+    missing   = [c for c, artifact in enumerate(artifacts) if artifact is None]
+    for artifact in artifacts:
+        if artifact is not None:
+            print_info("Reusing traindata " + quote_path(artifact["path"]) + " made with the same parameters (use -recompute to make it anew)")
+
+    traindatas, traindata_ids, writers = [], [], []
+    if missing:
+        traindatas, traindata_ids, writers = preprocess_dataset(args.dataset_path, label_afentries, configs = [configs[c] for c in missing],
+                                                                              num_segments = args.num_segments,
+                                                                               sample_rate = args.sample_rate, 
+                                                                             load_duration = args.load_duration,
+                                                                                   workers = resolve_workers(args.workers))
+    traindata_filenames = [compose_traindata_filename(traindata_id, args.traindata_format) for traindata_id in traindata_ids]
 
     dataprep_duration = timedelta(seconds = round(time.time() - start_time))
     timestamp = timestamp_now()
 
-    traindata[Aimx.TIMESTAMP] = timestamp
-    traindata[Aimx.DURATION]  = str(dataprep_duration)
-
-    # save MFCCs to the traindata file
-    save_traindata(traindata, traindata_filename)
+    for traindata, writer in zip(traindatas, writers):
+        traindata[Aimx.TIMESTAMP] = timestamp
+        traindata[Aimx.DURATION]  = str(dataprep_duration)
+
+        # write the last shard and the manifest (or the whole json traindata file)
+        writer.close(traindata)
+
+    # catalog the traindata made, and make the reused ones recent again, in the order of the configurations (the last one being the most recent output)
+    made = dict(zip(missing, zip(traindata_filenames, traindatas)))
+    for c, config_params in enumerate(params):
+        if c in made:
+            traindata_filename, traindata = made[c]
+            artifacts[c] = { "path": os.path.join(Aimx.Paths.GEN_TRAINDATA, traindata_filename),
+                             "info": { Aimx.TrainData.MAPPING: traindata[Aimx.TrainData.MAPPING], Aimx.Dataprep.TOTAL_AUDIOS_LENGTH: total_audios_length_sec } }
+            register_artifact(Aimx.Catalog.FULLPATH, KIND_TRAINDATA, artifacts[c]["path"], config_params, args.dataset_path, args.dataset_view,
+                                                                                                           args.dataset_depth, info = artifacts[c]["info"])
+        else:
+            touch_artifact(Aimx.Catalog.FULLPATH, artifacts[c]["path"])
+
+    # save as most recent data preprocess result metadata (the last configuration being the most recent output)
+    save_dataprep_result_meta([artifact["path"] for artifact in artifacts], artifacts[-1]["info"][Aimx.TrainData.MAPPING], timestamp, str(dataprep_duration),
+                                                                            artifacts[-1]["info"][Aimx.Dataprep.TOTAL_AUDIOS_LENGTH])
 
-    # save as most recent data preprocess result metadata
-    save_dataprep_result_meta(traindata_filename, traindata[Aimx.TrainData.MAPPING], timestamp, str(dataprep_duration), total_audios_length_sec)
-    
     print_info("Finished {} at {} with wall clock time: {} ".format(cyansky(nameofthis(__file__)),
                                                                     lightyellow(timestamp),
                                                                     lightyellow(dataprep_duration)))
\ No newline at end of file
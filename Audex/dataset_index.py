@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+from pathlib import Path
+import argparse
+import time
+import sys
+import os
+
+# Add this directory to path so that package is recognized.
+# Looks like a hack, but is ok for now to allow moving forward.
+# Source: https://stackoverflow.com/a/23891673/4973224
+# TODO: Replace with the idiomatic way.
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from Audex.utils.utils_common import *
+from Audex.utils.utils_audex  import *
+
+parser = argparse.ArgumentParser(description = 'This utility script builds (or incrementally refreshes) the cached index of a dataset:'
+                                               ' files per label directory with their size, mtime, sample rate and frame count'
+                                               ' read from their headers. Dataprep uses it with -use_index instead of walking the'
+                                               ' dataset and decoding the audio files just to count their durations.')
+
+parser.add_argument("-dataset_path", type = Path,         help = 'Path to a dataset of sound files.')
+parser.add_argument("-rebuild",      action ='store_true', help = 'Re-read all files instead of only the new or changed ones.')
+parser.add_argument("-example",      action ='store_true', help = 'Show a working example on how to call the script.')
+
+args = parser.parse_args()
+
+########################## Command Argument Handling & Verification #######################
+
+if args.example:
+    print_info(nameofthis(__file__) + " -dataset_path ../workdir/datasets/speech_commands_v001")
+    exit()
+
+if not provided(args.dataset_path) or not args.dataset_path.exists():
+    raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(args.dataset_path)))
+
+###########################################################################################
+
+print_script_start_preamble(nameofthis(__file__), vars(args))
+
+if __name__ == "__main__":
+
+    start_time = time.time()
+
+    index_path     = compose_dataset_index_path(args.dataset_path)
+    previous_index = None if args.rebuild else load_dataset_index(index_path)
+
+    index, num_indexed = build_dataset_index(args.dataset_path, previous_index)
+    save_dataset_index(index, index_path)
+
+    num_files  = sum(len(entries) for entries in index[INDEX_DIRS].values())
+    af_entries = [entry for entries in index[INDEX_DIRS].values() for entry in entries if ENTRY_CORRUPT in entry] # audio files only
+
+    print_info("Indexed {} files ({} audio) in {} directories: {} read, {} unchanged".format(num_files, len(af_entries), len(index[INDEX_DIRS]),
+                                                                                            num_indexed, num_files - num_indexed))
+    print_info("Corrupt: {}, shorter than 1 sec: {}, total duration: {} sec".format(sum(entry[ENTRY_CORRUPT] for entry in af_entries),
+                                                                                     sum(entry[ENTRY_SHORT]   for entry in af_entries),
+                                                                                     round(sum(indexed_duration(entry) for entry in af_entries))))
+    print_info("Finished {} at {} with wall clock time: {} ".format(cyansky(nameofthis(__file__)),
+                                                                    lightyellow(timestamp_now()),
+                                                                    lightyellow(round(time.time() - start_time, 2))))
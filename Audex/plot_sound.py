@@ -17,8 +17,11 @@ sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 # Module imports from this project
 from Audex.utils.utils_common     import *
 from Audex.utils.utils_plot_sound import *
+from Audex.utils.utils_wavio      import load_audio
+from Audex.utils.utils_features   import *
 
 AUDIO_FILES_DIR_DEFAULT_NAME = "sounds"
+MFCC_N_MELS = 128 # Mel bands the MFCCs are computed from (librosa's default, the dataprep default too)
 AUDIO_FILES_DIR_DEFAULT = os.path.join(os.getcwd(), AUDIO_FILES_DIR_DEFAULT_NAME)
 
 # Calling without -files_path               will expect to find the default ./sounds directory.
@@ -34,6 +37,11 @@ parser.add_argument("-plot_frequencies", action ='store_true', help = 'Plot freq
 parser.add_argument("-plot_specs",       action ='store_true', help = 'Plot spectrograms of the sound files.')
 parser.add_argument("-plot_melspecs",    action ='store_true', help = 'Plot Mel spectrograms of the sound files.')
 parser.add_argument("-plot_mfccs",       action ='store_true', help = 'Plot MFCCs of the sound files.')
+parser.add_argument("-n_fft",            default = 2048, type=int, help = 'Length of the FFT window.   Measured in # of samples.')
+parser.add_argument("-hop_length",       default =  512, type=int, help = 'Sliding window for the FFT. Measured in # of samples.')
+parser.add_argument("-n_mels",           default =   90, type=int, help = 'Number of Mel bands of the Mel spectrograms (the MFCCs are computed from ' + str(MFCC_N_MELS) + ', as in dataprep).')
+parser.add_argument("-n_mfcc",           default =   20, type=int, help = 'Number of MFCC to plot.')
+parser.add_argument("-fast_wav",         action ='store_true', help = 'Decode WAV files with the fast native decoder instead of librosa.')
 parser.add_argument("-example",          action ='store_true', help = 'Show a working example on how to call the script.')
 
 args = parser.parse_args()
@@ -65,19 +73,31 @@ signal_packs = []
 
 if afiles_path.is_file():
     print_info("|||||| Loading file " + quote_path(afiles_path) + "...", end="")
-    signal_packs.append((Path(afiles_path).name, librosa.load(afiles_path)))
+    signal_packs.append((Path(afiles_path).name, load_audio(afiles_path, fast_wav = args.fast_wav)))
     print_info("[DONE]")
 else: # directory
     (_, _, afnames) = next(os.walk(args.files_path)) # works
     for afname in afnames:
         af = os.path.join(args.files_path, afname)
         print_info("|||||| Loading file " + quote_path(af) + "...", end="")
-        signal_packs.append((afname, librosa.load(af)))
+        signal_packs.append((afname, load_audio(af, fast_wav = args.fast_wav)))
         print_info("[DONE] & appended to signal pack")
 
 for sigp in signal_packs:
     print_stats(sigp)
 
+def extract_plot_features(signal, sample_rate):
+    # the spectrograms and MFCCs to plot share the STFT of the signal, the MFCCs having mel bands of their own
+    power    = stft_power(signal, args.n_fft, args.hop_length)
+    features = extract_features(signal, sample_rate, n_fft = args.n_fft, hop_length = args.hop_length, n_mels = args.n_mels, power = power,
+                                features = [feature for feature, plot in [(FEATURE_POWER, ARG_PLOT_SPECS), (FEATURE_LOGMEL, ARG_PLOT_MELSPECS)] if plot])
+    if ARG_PLOT_MFCCS:
+        features.update(extract_features(signal, sample_rate, n_mfcc = args.n_mfcc, n_fft = args.n_fft, hop_length = args.hop_length,
+                                         n_mels = MFCC_N_MELS, power = power, features = [FEATURE_MFCC]))
+    return features
+
+signal_features = [extract_plot_features(sigp[1][0], sigp[1][1]) for sigp in signal_packs]
+
 if ARG_PLOT_SIGNALS:
     plot_signals_single_chart(signal_packs)
 
@@ -86,15 +106,15 @@ if ARG_PLOT_FREQUENCIES:
         plot_frequency_distribution(sigp)
 
 if ARG_PLOT_SPECS:
-    for sigp in signal_packs:
-        plot_spectrogram(sigp, y_axis = "log")
+    for sigp, features in zip(signal_packs, signal_features):
+        plot_spectrogram(sigp, features[FEATURE_POWER], args.hop_length, y_axis = "log")
 
 if ARG_PLOT_MELSPECS:
-    for sigp in signal_packs:
-        plot_melspec(sigp)
+    for sigp, features in zip(signal_packs, signal_features):
+        plot_melspec(sigp, features[FEATURE_LOGMEL], args.hop_length)
 
 if ARG_PLOT_MFCCS:
-    for sigp in signal_packs:
-        plot_mfcc(sigp)
+    for sigp, features in zip(signal_packs, signal_features):
+        plot_mfcc(sigp, features[FEATURE_MFCC], args.hop_length)
 
 pt.show()
\ No newline at end of file
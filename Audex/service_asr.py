@@ -17,6 +17,11 @@ from Audex.utils.utils_common import *
 from Audex.utils.utils_audex  import Aimx
 from Audex.utils.utils_audex  import get_dataprep_result_meta
 from Audex.utils.utils_audex  import get_actual_model_path
+from Audex.utils.utils_audex  import enable_jit
+from Audex.utils.utils_audex  import jit_compile_model
+from Audex.utils.utils_features import get_mfcc_engine
+from Audex.utils.utils_wavio    import load_audio
+from Audex.utils.utils_vad      import speech_windows
 
 def process_clargs():
     # Calling with "-inferdata_path /to/file" will expect to find the file in ./to directory.
@@ -32,6 +37,12 @@ def process_clargs():
     parser.add_argument("-num_segments",   default =     5, type=int, help = 'Number of segments we want to divide sample tracks into.')
     parser.add_argument("-sample_rate",    default = 22050, type=int, help = 'Sample rate at which to read the audio files.')
     parser.add_argument("-load_duration",  default =     1, type=int, help = 'Only load up to this much audio (in seconds).')
+    parser.add_argument("-fast_mfcc",      action ='store_true',      help = 'Extract MFCCs of all seconds of a file in one call to the vectorized engine instead of librosa.')
+    parser.add_argument("-fast_wav",       action ='store_true',      help = 'Decode WAV files with the fast native decoder instead of librosa.')
+    parser.add_argument("-vad",            action ='store_true',      help = 'Skip the seconds without speech (detected by frame energy and zero crossing rate) before numerizing them.')
+    parser.add_argument("-vad_threshold",  default =   -40, type=float, help = 'Frames at least this loud (RMS in dB relative to full scale) count as speech.')
+    parser.add_argument("-vad_recenter",   action ='store_true',      help = 'Center the 1-second windows on the detected utterances instead of on whole seconds.')
+    parser.add_argument("-jit",            action ='store_true',      help = 'XLA-compile the model, with a persistent compilation cache in the workdir from TensorFlow 2.12 on.')
     parser.add_argument("-example",        action ='store_true',      help = 'Show a working example on how to call the script.')
 
     args = parser.parse_args()
@@ -59,6 +70,8 @@ class _AsrService:
     """
     model     = None
     modelType = None
+    fast_mfcc = False # extract MFCCs with the vectorized batched engine instead of librosa
+    fast_wav  = False # decode WAV files with the fast native decoder instead of librosa
 
     # audio file currently being analyzed
     af_fullpath        = None
@@ -83,14 +96,14 @@ class _AsrService:
 
     def load_audiofile(self, af_fullpath, load_duration):
         self.af_fullpath = af_fullpath
-        self.af_signal, self.af_sr = librosa.load(af_fullpath, duration=load_duration)
+        self.af_signal, self.af_sr = load_audio(af_fullpath, duration=load_duration, fast_wav=self.fast_wav)
         self.af_loaded_duration    = librosa.get_duration(self.af_signal, self.af_sr)
 
     # This dataprep is for ASR CNN inference
     def numerize(self, startsec=0, n_mfcc=13, n_fft=2048, hop_length=512):
         """
         # Extract mfccs from an audio file.
-        :param   startsec (int): second in the signal from which numerization starts
+        :param   startsec (int): second in the signal from which numerization starts (may be fractional)
         :param     n_mfcc (int): # of coefficients to extract
         :param      n_fft (int): Interval we consider to apply STFT. Measured in # of samples
         :param hop_length (int): Sliding window for STFT. Measured in # of samples
@@ -106,9 +119,13 @@ class _AsrService:
         # but it was called on an input with incompatible shape (None, 87, 13, 1)."
         # Therefore, TODO: Generalize the line below so that the array interval length is extracted from the model.
         LENGTH_SEC = 1
-        self.af_signalsec = self.af_signal[startsec*self.af_sr : (startsec + LENGTH_SEC)*self.af_sr]
+        start = int(round(startsec*self.af_sr)) # startsec is fractional for windows recentered on speech
+        self.af_signalsec = self.af_signal[start : start + LENGTH_SEC*self.af_sr]
 
-        mfccs = librosa.feature.mfcc(self.af_signalsec, self.af_sr, n_mfcc=n_mfcc, n_fft=n_fft, hop_length=hop_length)
+        if self.fast_mfcc:
+            mfccs = get_mfcc_engine(self.af_sr, n_mfcc, n_fft, hop_length).mfcc(self.af_signalsec)[0].T
+        else:
+            mfccs = librosa.feature.mfcc(y=self.af_signalsec, sr=self.af_sr, n_mfcc=n_mfcc, n_fft=n_fft, hop_length=hop_length)
         if self.modelType == 'cnn':
             # convert the 2d MFCC array into a 4d array to feed to the model for prediction:
             #            (# segments, # coefficients)
@@ -121,6 +138,28 @@ class _AsrService:
 
         return mfccs.T
 
+    def numerize_batch(self, startsecs, n_mfcc=13, n_fft=2048, hop_length=512):
+        """
+        # Extract mfccs from several 1-second intervals of an audio file in one vectorized call.
+        :param startsecs  (list): seconds in the signal from which numerization of each interval starts
+        :param     n_mfcc  (int): # of coefficients to extract
+        :param      n_fft  (int): Interval we consider to apply STFT. Measured in # of samples
+        :param hop_length  (int): Sliding window for STFT. Measured in # of samples
+        :return mfccs (ndarray): numpy array with MFCC data of shape (# intervals, # time steps, # coefficients),
+                                 with an extra channel axis appended for the CNN model
+        """
+        LENGTH_SEC = 1
+        starts    = [int(round(startsec*self.af_sr)) for startsec in startsecs]
+        intervals = np.stack([self.af_signal[start : start + LENGTH_SEC*self.af_sr] for start in starts])
+
+        mfccs = get_mfcc_engine(self.af_sr, n_mfcc, n_fft, hop_length).mfcc(intervals)
+        if self.modelType == 'cnn':
+            mfccs = mfccs[..., np.newaxis] # shape for CNN model
+        elif self.modelType != 'rnn':
+            raise Exception("ASR received an unknown model type: " + self.modelType)
+
+        return mfccs
+
     def predict(self, mfccs):
         # make a prediction and get the predicted label and confidence
         predictions   = self.model.predict(mfccs)
@@ -130,30 +169,46 @@ class _AsrService:
 
         return inference, confidence
 
+    def predict_batch(self, mfccs):
+        # make predictions for a whole batch of intervals and get the predicted labels and confidences
+        predictions = self.model.predict(mfccs)
+        return [(self.label_mapping[predmax_index], confidence) for predmax_index, confidence in zip(np.argmax(predictions, axis=1),
+                                                                                                     np.max(predictions, axis=1))]
+
+    def speech_startsecs(self, threshold_db=-40, recenter=False):
+        # seconds in the signal from which the 1-second intervals holding speech start
+        return [start / self.af_sr for start in speech_windows(self.af_signal, self.af_sr, 1, threshold_db, recenter)]
+
     def report(self, predicted_word, confidence, confidence_threshold=0.9):
+        currsec = "{:g}".format(round(self.af_currsec, 2)) # windows recentered on speech start at fractional seconds
         if predicted_word in extract_filename(self.af_fullpath):
             # inference is correct
             if confidence > confidence_threshold:
-                print(self.inference_report_columns.format(self.af_loaded_duration, self.af_currsec,    cyan("{:.2f}".format(confidence)), yellow(extract_filename(self.af_fullpath)), cyan(predicted_word)))
+                print(self.inference_report_columns.format(self.af_loaded_duration, currsec,    cyan("{:.2f}".format(confidence)), yellow(extract_filename(self.af_fullpath)), cyan(predicted_word)))
             else:
-                print(self.inference_report_columns.format(self.af_loaded_duration, self.af_currsec, pinkred("{:.2f}".format(confidence)), yellow(extract_filename(self.af_fullpath)), cyan(predicted_word)))
+                print(self.inference_report_columns.format(self.af_loaded_duration, currsec, pinkred("{:.2f}".format(confidence)), yellow(extract_filename(self.af_fullpath)), cyan(predicted_word)))
         else:
             # inference is wrong
             if confidence > confidence_threshold:
-                print(self.inference_report_columns.format(self.af_loaded_duration, self.af_currsec,     red("{:.2f}".format(confidence)), yellow(extract_filename(self.af_fullpath)), pinkred(predicted_word)))
+                print(self.inference_report_columns.format(self.af_loaded_duration, currsec,     red("{:.2f}".format(confidence)), yellow(extract_filename(self.af_fullpath)), pinkred(predicted_word)))
             else:
-                print(self.inference_report_columns.format(self.af_loaded_duration, self.af_currsec, pinkred("{:.2f}".format(confidence)), yellow(extract_filename(self.af_fullpath)), pinkred(predicted_word)))
+                print(self.inference_report_columns.format(self.af_loaded_duration, currsec, pinkred("{:.2f}".format(confidence)), yellow(extract_filename(self.af_fullpath)), pinkred(predicted_word)))
 
-def CreateAsrService(model_path):
+def CreateAsrService(model_path, jit=False):
     """
     Factory function for AsrService class.
+        :param jit (bool): XLA-compile the model (on first call only, see enable_jit()).
     """
     # ensure an instance is created only on first call
     if  _AsrService._instance is None:
         _AsrService._instance = _AsrService()
+        if jit:
+            enable_jit()
         try:
             print_info("|||||| Loading model " + quote_path(model_path) + "... ", end="")
             _AsrService.model     = keras.models.load_model(model_path)
+            if jit:
+                jit_compile_model(_AsrService.model)
             _AsrService.modelType = extract_filename(model_path)[6:9] # from name: model_cnn_...
             print_info("[DONE]")
         except Exception as e:
@@ -165,20 +220,42 @@ if __name__ == "__main__":
 
     args = process_clargs()
 
-    asr = CreateAsrService(args.model_path)
+    asr = CreateAsrService(args.model_path, args.jit)
+    asr.fast_mfcc = args.fast_mfcc
+    asr.fast_wav  = args.fast_wav
     
     print_info("\nPredicting with dataset view (labels):", asr.label_mapping)
     print_info("On files in:", args.inferdata_path)
     print_info(asr.inference_report_headers.format("Loaded Sec", "Con", "Filename", "Inference"))
 
     (_, _, afnames) = next(os.walk(args.inferdata_path))
+
+    num_windows, num_inferred = 0, 0
     
     for afname in afnames:
         af_fullpath = os.path.join(args.inferdata_path, afname)
         asr.load_audiofile(af_fullpath, args.load_duration)
         if len(asr.af_signal) < args.sample_rate: # process only signals of at least 1 sec
             continue
-        for i in range(int(asr.af_loaded_duration)):
-            mfccs = asr.numerize(startsec=i)
+        startsecs    = list(range(int(asr.af_loaded_duration)))
+        num_windows += len(startsecs)
+        if args.vad:
+            startsecs = asr.speech_startsecs(args.vad_threshold, args.vad_recenter)
+        num_inferred += len(startsecs)
+        if not startsecs: # silence throughout
+            continue
+        if args.fast_mfcc:
+            # numerize and predict all seconds of the file at once
+            for startsec, (w, c) in zip(startsecs, asr.predict_batch(asr.numerize_batch(startsecs))):
+                asr.af_currsec = startsec
+                asr.report(w, c, args.confidence_threshold)
+            continue
+        for startsec in startsecs:
+            mfccs = asr.numerize(startsec=startsec)
             w, c  = asr.predict(mfccs)
-            asr.report(w, c, args.confidence_threshold)
\ No newline at end of file
+            asr.report(w, c, args.confidence_threshold)
+
+    if args.vad and num_windows:
+        # recentered windows may (rarely) outnumber the whole seconds, the last one of a file can overlap the one before
+        num_skipped = max(num_windows - num_inferred, 0)
+        print_info("VAD skipped {} of {} windows ({:.1%}) as silent".format(num_skipped, num_windows, num_skipped / num_windows))
\ No newline at end of file
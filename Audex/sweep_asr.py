@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+from pathlib import Path
+import subprocess
+import itertools
+import argparse
+import shlex
+import json
+import time
+import sys
+import os
+
+# Add this directory to path so that package is recognized.
+# Looks like a hack, but is ok for now to allow moving forward.
+# Source: https://stackoverflow.com/a/23891673/4973224
+# TODO: Replace with the idiomatic way.
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from Audex.utils.utils_common import *
+from Audex.utils.utils_audex  import *
+from Audex.utils.utils_sweep  import *
+
+parser = argparse.ArgumentParser(description = 'This utility script runs a hyperparameter sweep of train_asr.py: one trial per combination of the'
+                                               ' given values, several trials at a time, each on its own cores with its own number of threads.'
+                                               ' Successive halving stops the trials that fall behind early on, and every trial is recorded'
+                                               ' (hyperparameters, metrics and wall time) in ' + quote(Aimx.Sweep.RESULTS_FULLPATH) + '.')
+
+parser.add_argument("-traindata_path", type = Path,  default = Aimx.MOST_RECENT_OUTPUT,             help = 'Path to the traindata to train every trial on.')
+parser.add_argument("-ann_type",       type = str,   default = ["cnn"],   nargs = '+',              help = 'ANN types to try.')
+parser.add_argument("-batch_size",     type = int,   default = [32],      nargs = '+',              help = 'Batch sizes to try.')
+parser.add_argument("-learning_rate",  type = float, default = [0.0001],  nargs = '+',              help = 'Learning rates to try.')
+parser.add_argument("-width",          type = int,   default = [64],      nargs = '+',              help = 'Model widths to try (see train_asr.py -width).')
+parser.add_argument("-depth",          type = int,   default = None,      nargs = '+',              help = 'Model depths to try (see train_asr.py -depth, default of each ANN type if not provided).')
+parser.add_argument("-epochs",         type = int,   default = 27,                                  help = 'Number of epochs of the trials that are never stopped.')
+parser.add_argument("-min_epochs",     type = int,   default = 1,                                   help = 'Number of epochs before a trial is first judged by successive halving.')
+parser.add_argument("-eta",            type = int,   default = 3,                                   help = 'Successive halving keeps the best 1/eta of the trials every eta times as many epochs.')
+parser.add_argument("-metric",         type = str,   default = "val_accuracy", choices = ["val_accuracy", "val_loss"], help = 'Metric the trials are judged by.')
+parser.add_argument("-threads",        type = int,   default = 1,                                   help = 'Number of cores (and of TensorFlow threads) of each trial.')
+parser.add_argument("-workers",        type = int,   default = None,                                help = 'Number of trials run at a time (as many as there are cores for -threads each by default).')
+parser.add_argument("-train_args",     type = str,   default = "",                                  help = 'More train_asr.py arguments, the same for every trial, e.g. "-feature mfcc -patience 3".')
+parser.add_argument("-sweep_id",       type = str,   default = RUN_ID,                              help = 'Name of the sweep in the results (a new one, made of the date, time and process id, by default).')
+parser.add_argument("-example",        action ='store_true',                                        help = 'Show a working example on how to call the script.')
+
+args = parser.parse_args()
+
+########################## Command Argument Handling & Verification #######################
+
+if args.example:
+    print_info(nameofthis(__file__) + " -ann_type cnn rnn -batch_size 32 64 -learning_rate 0.001 0.0001 -width 32 64 -epochs 27 -threads 2")
+    exit()
+
+actual_traindata_path = os.path.abspath(get_actual_traindata_path(args.traindata_path))
+if not os.path.exists(actual_traindata_path):
+    raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(actual_traindata_path)))
+
+if args.eta < 2 or args.min_epochs < 1 or args.epochs < args.min_epochs:
+    raise ValueError("-eta must be at least 2, -min_epochs at least 1 and -epochs at least -min_epochs")
+
+# cores this process may run on, split among the workers: each worker (and the trials it runs) gets -threads of them
+CORES = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+if not provided(args.workers):
+    args.workers = max(1, len(CORES) // args.threads)
+
+###########################################################################################
+
+print_script_start_preamble(nameofthis(__file__), vars(args))
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_asr.py")
+POLL_SEC     = 0.5
+
+def compose_trials():
+    """ :return (list): One trial (dict of its hyperparameters) per combination of the hyperparameter values to try. """
+    combinations = itertools.product(args.ann_type, args.batch_size, args.learning_rate, args.width, args.depth or [None])
+    return [{"trial": i, "ann_type": ann_type, "batch_size": batch_size, "learning_rate": learning_rate, "width": width, "depth": depth}
+            for i, (ann_type, batch_size, learning_rate, width, depth) in enumerate(combinations)]
+
+def start_trial(trial, cores, sweep_dir):
+    """ Starts train_asr.py for the trial in the background, pinned to the cores. """
+    name = "trial_{:03d}".format(trial["trial"])
+    trial["metrics"] = os.path.join(sweep_dir, name + ".metrics.jsonl")
+    trial["log"]     = os.path.join(sweep_dir, name + ".log")
+    trial["cores"]   = cores
+    trial["args"]    = ["-traindata_path", actual_traindata_path, "-ann_type", trial["ann_type"], "-batch_size", str(trial["batch_size"]),
+                        "-learning_rate", str(trial["learning_rate"]), "-width", str(trial["width"]), "-epochs", str(args.epochs),
+                        "-threads", str(args.threads), "-metrics_out", trial["metrics"], "-verbose", "2", "-retrain"]
+    if provided(trial["depth"]):
+        trial["args"] += ["-depth", str(trial["depth"])]
+    trial["args"] += shlex.split(args.train_args)
+
+    # numpy and TensorFlow thread pools sized to the trial's cores, so that the trials running together do not oversubscribe them
+    env = dict(os.environ, OMP_NUM_THREADS=str(args.threads), TF_NUM_INTRAOP_THREADS=str(args.threads), TF_NUM_INTEROP_THREADS=str(args.threads))
+    pin = (lambda: os.sched_setaffinity(0, cores)) if hasattr(os, "sched_setaffinity") else None
+    with open(trial["log"], "w") as log:
+        trial["process"] = subprocess.Popen([sys.executable, TRAIN_SCRIPT] + trial["args"], stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                            env=env, preexec_fn=pin)
+    trial["started"] = timestamp_now()
+    trial["start"]   = time.time()
+    trial["offset"]  = 0
+    trial["epochs"]  = 0
+    trial["last"]    = {}
+    trial["test"]    = {}
+    trial["status"]  = None
+
+def read_new_metrics(trial):
+    """ :return (list): The metrics records (see train_asr.py -metrics_out) appended since the last call, complete lines only. """
+    if not os.path.exists(trial["metrics"]):
+        return []
+    with open(trial["metrics"], "r") as file:
+        file.seek(trial["offset"])
+        lines = file.read()
+    complete = lines[: lines.rfind("\n") + 1]
+    trial["offset"] += len(complete.encode())
+    return [json.loads(line) for line in complete.splitlines() if line.strip()]
+
+def follow_trial(trial, halving):
+    """ Takes in the new metrics of a running trial, and stops it if successive halving tells so. """
+    for record in read_new_metrics(trial):
+        if "epoch" not in record:
+            trial["test"] = record
+            continue
+        trial["epochs"], trial["last"] = record["epoch"], record
+        if trial["status"] is None and args.metric in record and not halving.report(trial["trial"], record["epoch"], record[args.metric]):
+            trial["status"] = TRIAL_STOPPED
+            trial["process"].terminate()
+            print_info("Trial {} stopped by successive halving after {} epoch(s), {} = {:.4f}".format(trial["trial"], record["epoch"],
+                                                                                                      args.metric, record[args.metric]))
+
+def record_finished_trial(trial):
+    if trial["status"] is None:
+        # the test metrics are written once training is over, so whatever happens after (saving, plotting) does not matter
+        trial["status"] = TRIAL_FINISHED if trial["test"] else TRIAL_FAILED
+    record_trial(Aimx.Sweep.RESULTS_FULLPATH, {
+        "sweep":         args.sweep_id,
+        "trial":         trial["trial"],
+        "status":        trial["status"],
+        "ann_type":      trial["ann_type"],
+        "batch_size":    trial["batch_size"],
+        "learning_rate": trial["learning_rate"],
+        "width":         trial["width"],
+        "depth":         trial["depth"],
+        "epochs":        trial["epochs"],
+        "val_accuracy":  trial["last"].get("val_accuracy"),
+        "val_loss":      trial["last"].get("val_loss"),
+        "test_accuracy": trial["test"].get("test_accuracy"),
+        "test_loss":     trial["test"].get("test_loss"),
+        "wall_time_sec": round(time.time() - trial["start"], 2),
+        "cores":         trial["cores"],
+        "args":          trial["args"],
+        "log":           trial["log"],
+        "started":       trial["started"],
+        "ended":         timestamp_now()})
+    print_info("Trial {} {} after {} epoch(s) in {:.1f} sec (log {})".format(trial["trial"], trial["status"], trial["epochs"],
+                                                                            time.time() - trial["start"], quote_path(trial["log"])))
+
+def print_results():
+    trials = select_trials(Aimx.Sweep.RESULTS_FULLPATH, args.sweep_id)
+    maximize = args.metric != "val_loss"
+    ranked = sorted(trials, key=lambda t: (t[args.metric] is None, -(t[args.metric] or 0) if maximize else (t[args.metric] or 0)))
+    print_info("\nSweep {} ({} trials), best {} first:".format(cyansky(args.sweep_id), len(trials), args.metric))
+    print_info("{:>5}  {:<8} {:<4} {:>5} {:>9} {:>5} {:>5} {:>6} {:>8} {:>8} {:>8} {:>9}".format(
+               "trial", "status", "ann", "batch", "lr", "width", "depth", "epochs", "val_acc", "val_loss", "test_acc", "wall_sec"))
+    number = lambda value, fmt: fmt.format(value) if value is not None else "-"
+    for t in ranked:
+        print_info("{:>5}  {:<8} {:<4} {:>5} {:>9} {:>5} {:>5} {:>6} {:>8} {:>8} {:>8} {:>9}".format(
+                   t["trial"], t["status"], t["ann_type"], t["batch_size"], number(t["learning_rate"], "{:g}"), t["width"], number(t["depth"], "{}"),
+                   t["epochs"], number(t["val_accuracy"], "{:.4f}"), number(t["val_loss"], "{:.4f}"), number(t["test_accuracy"], "{:.4f}"),
+                   number(t["wall_time_sec"], "{:.1f}")))
+
+if __name__ == "__main__":
+
+    start_time = time.time()
+
+    sweep_dir = os.path.join(Aimx.Paths.GEN_SWEEPS, args.sweep_id)
+    Path(sweep_dir).mkdir(parents=True, exist_ok=True)
+
+    trials  = compose_trials()
+    halving = SuccessiveHalving(args.min_epochs, args.epochs, args.eta, maximize = args.metric != "val_loss")
+    slots   = [[CORES[(worker * args.threads + i) % len(CORES)] for i in range(args.threads)] for worker in range(args.workers)]
+    pending = list(trials)
+    running = {} # worker -> trial
+    print_info("Running {} trials on {} workers of {} core(s) each, halving rungs at epochs {}".format(len(trials), args.workers, args.threads,
+                                                                                                    sorted(halving.rungs) or "(none)"))
+    try:
+        while pending or running:
+            for worker in range(args.workers):
+                if worker not in running and pending:
+                    running[worker] = pending.pop(0)
+                    start_trial(running[worker], slots[worker], sweep_dir)
+            time.sleep(POLL_SEC)
+            for worker, trial in list(running.items()):
+                follow_trial(trial, halving)
+                if trial["process"].poll() is not None:
+                    follow_trial(trial, halving) # whatever was written right before exiting
+                    record_finished_trial(trial)
+                    del running[worker]
+    finally:
+        for trial in running.values():
+            trial["process"].terminate()
+
+    print_results()
+
+    print_info("Finished {} at {} with wall clock time: {} ".format(cyansky(nameofthis(__file__)),
+                                                                    lightyellow(timestamp_now()),
+                                                                    lightyellow(round(time.time() - start_time, 2))))
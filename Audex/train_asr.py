@@ -9,7 +9,6 @@ import cmd
 import sys
 import os
 
-from sklearn.model_selection import train_test_split
 import tensorflow.keras as keras
 
 # Add this directory to path so that package is recognized.
@@ -18,7 +17,8 @@ import tensorflow.keras as keras
 # TODO: Replace with the idiomatic way.
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
-from Audex.utils.utils_audex import *
+from Audex.utils.utils_audex   import *
+from Audex.utils.utils_augment import *
 
 def process_clargs():
     # Calling with "-traindata_path /to/file" will expect to find the file in ./to directory.
@@ -30,13 +30,34 @@ def process_clargs():
                                ', which by design is the output of the previous step of dataset preprocessing.')
 
     parser.add_argument("-ann_type",   default = "cnn", type=str, help = 'ANN type (CNN, RNN, etc).')
+    parser.add_argument("-feature",    default = Aimx.TrainData.MFCC, choices = FEATURE_TYPES, help = 'Traindata feature to train on (see dataprep -features).')
     parser.add_argument("-batch_size", default = 32,    type=int, help = 'Batch size.')
+    parser.add_argument("-learning_rate", default = 0.0001, type=float, help = 'Learning rate of the Adam optimizer.')
+    parser.add_argument("-width",      default = 64,    type=int, help = 'Number of filters of the 1st conv layer (half as many in the next ones), or of units'
+                                                                         ' of the LSTM layers, and of units of the dense layer.')
+    parser.add_argument("-depth",      default = None,  type=int, help = 'Number of conv layers (3 by default) or LSTM layers (2 by default).')
     parser.add_argument("-epochs",     default = 50,    type=int, help = 'Number of epochs to train.')
     parser.add_argument("-patience",   default =  5,    type=int, help = 'Number of epochs with no improvement after which training will be stopped.')
     parser.add_argument("-verbose",    default =  1,    type=int, help = 'Verbosity modes: 0 (silent), 1 (will show progress bar),'
                                                                          ' or 2 (one line per epoch). Default is 1.')
+    parser.add_argument("-shuffle_buffer", default = SHUFFLE_BUFFER_SAMPLES, type=int, help = 'Number of samples the training samples are shuffled within, every epoch.')
+    parser.add_argument("-augment",    action ='store_true',      help = 'Augment the raw training clips on the fly every epoch (time shift, noise, gain and speed).')
+    parser.add_argument("-aug_shift_ms",     default = 100,  type=float, help = 'Maximum time shift of augmented clips in milliseconds.')
+    parser.add_argument("-aug_speed",        default = 0.1,  type=float, help = 'Maximum relative speed change of augmented clips.')
+    parser.add_argument("-aug_gain_db",      default = 6,    type=float, help = 'Maximum gain change of augmented clips in dB.')
+    parser.add_argument("-aug_noise_snr_db", default = 10,   type=float, help = 'Lowest signal-to-noise ratio of the noise mixed into augmented clips in dB.')
+    parser.add_argument("-aug_noise_path",   default = None, type=Path,  help = 'Directory of background noise .wav files to mix in (white noise if not provided).')
+    parser.add_argument("-aug_workers",      default = 4,    type=int,   help = 'Number of threads preparing augmented batches in parallel with training.')
+    parser.add_argument("-seed",       default = None,  type=int, help = 'Seed of the train, validation and test splits, of the shuffling and of the weight initialization (a random one by default).')
+    parser.add_argument("-checkpoint_every", default = 1, type=int, help = 'Save a checkpoint (weights, optimizer state and epoch) every that many epochs, never if 0.')
+    parser.add_argument("-resume",     action ='store_true',      help = 'Resume an interrupted training (run with the very same arguments) from its last checkpoint.')
+    parser.add_argument("-init_from",  default = None,  type=Path, help = 'Start from the weights of a saved model (its output layer excepted, if the dataset view changed since).')
+    parser.add_argument("-threads",    default = None,  type=int, help = 'Number of threads TensorFlow runs ops on (all the cores by default).')
+    parser.add_argument("-metrics_out", default = None, type=Path, help = 'Append the metrics of every epoch, and the test metrics at the end, to this JSON lines file.')
     parser.add_argument("-showplot",   action ='store_true',      help = 'At the end, will show an interactive plot of the training history.')
     parser.add_argument("-savemodel",  action ='store_true',      help = 'Save a trained model in directory ' + quote(Aimx.Paths.GEN_SAVED_MODELS))
+    parser.add_argument("-jit",        action ='store_true',      help = 'XLA-compile the model (compare the step times printed with and without it), with a persistent compilation cache in the workdir from TensorFlow 2.12 on.')
+    parser.add_argument("-retrain",    action ='store_true',      help = 'Train anew even if the artifact catalog has a model trained with the same arguments.')
     parser.add_argument("-example",    action ='store_true',      help = 'Show a working example on how to call the script.')
 
     args = parser.parse_args()
@@ -47,14 +68,29 @@ def process_clargs():
         print_info(nameofthis(__file__) + " -epochs 5")
         exit()
 
-    if provided(args.traindata_path) and not args.traindata_path.exists():
+    if provided(args.aug_noise_path) and not args.aug_noise_path.exists():
+        raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(args.aug_noise_path)))
+
+    if provided(args.traindata_path) and not os.path.exists(get_actual_traindata_path(args.traindata_path)): # traindata ids are looked up in the catalog
         if str(args.traindata_path) is not Aimx.MOST_RECENT_OUTPUT:
             raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(args.traindata_path)))
 
     # path to the traindata file that stores MFCCs and genre labels for each processed segment
     args.traindata_path = get_actual_traindata_path(args.traindata_path)
 
-    if not args.savemodel and os.path.getsize(args.traindata_path) > 100_000_000: # > 100 Mb
+    if args.depth is None:
+        args.depth = 3 if args.ann_type == "cnn" else 2
+
+    if args.width < 2 or args.depth < 1:
+        raise ValueError("-width must be at least 2 and -depth at least 1")
+
+    if provided(args.init_from):
+        args.init_from = get_actual_model_path(args.init_from) # model names are looked up in the catalog
+        if not os.path.exists(args.init_from):
+            raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(args.init_from)))
+
+    # nobody is there to answer when run in the background (e.g. by sweep_asr.py)
+    if not args.savemodel and sys.stdin.isatty() and get_traindata_size(args.traindata_path) > 100_000_000: # > 100 Mb
         args.savemodel = prompt_user_warning("Attempting to train on a large >100Mb traindata without '-savemodel',"
                                              " would you rather save the final model? [yes / no] ")
         print_info("As requested, proceeding with -savemodel =", args.savemodel)
@@ -65,66 +101,77 @@ def process_clargs():
 
     return args
 
-def prepare_traindata(ann_type, traindata_path, test_size, valid_size):
+def prepare_traindata(ann_type, traindata_path, test_size, valid_size, feature=Aimx.TrainData.MFCC, shuffle_buffer=SHUFFLE_BUFFER_SAMPLES, seed=None):
     """
-    Loads data and splits it into train, validation and test sets.
+    Opens the traindata as a tf.data input pipeline and splits its samples into train, validation and test sets.
     Params:
-         test_size (float): Value in [0, 1] indicating percentage of dataset to allocate to test       split
-        valid_size (float): Value in [0, 1] indicating percentage of dataset to allocate to validation split
+          test_size (float): Value in [0, 1] indicating percentage of dataset to allocate to test       split
+         valid_size (float): Value in [0, 1] indicating percentage of dataset to allocate to validation split
+            feature   (str): Traindata feature to use as inputs
+     shuffle_buffer   (int): Number of samples the training samples are shuffled within, every epoch
+               seed   (int): Seed of the splits and shuffling, or None for a random one
     Returns:
-        x_train (ndarray): Input training set
-        x_valid (ndarray): Input valid set
-        x_test  (ndarray): Input test set
-        y_train (ndarray): Target training set
-        y_valid (ndarray): Target valid set
-        y_test  (ndarray): Target test set
+        pipeline (TraindataPipeline): Sample indices of the train (pipeline.train), validation and test sets, and their batches
     """
-    x, y = load_traindata(traindata_path) # x = inputs, y = labels
-
-    # create train, validation and test split
-    x_train, x_test,  y_train, y_test  = train_test_split(x,       y,       test_size = test_size)
-    x_train, x_valid, y_train, y_valid = train_test_split(x_train, y_train, test_size = valid_size)
-
-    if ann_type == "cnn":
-        # add an axis to input sets; example resulting shape: (89, 259, 13, 1)
-        x_train = x_train[..., np.newaxis]
-        x_valid = x_valid[..., np.newaxis]
-        x_test  =  x_test[..., np.newaxis]
+    print_info("|||||| Opening traindata " + quote_path(traindata_path) + "... ", end="")
+    pipeline = TraindataPipeline(traindata_path, feature, test_size, valid_size, add_channel = ann_type == "cnn", shuffle_buffer = shuffle_buffer, seed = seed)
+    print_info("[DONE]\n")
 
     print_info("Dataset view (labels) from dataprep result meta:")
     cmd.Cmd().columnize(get_dataprep_result_meta()[Aimx.Dataprep.DATASET_VIEW], displaywidth=100)
 
-    print_info("Extended x_train (input) shape: " + str(x_train.shape))
-    print_info("Extended x_valid (input) shape: " + str(x_valid.shape))
-    print_info("Extended x_test  (input) shape: " + str(x_test.shape))
+    pipeline.print_splits()
 
-    return x_train, x_valid, x_test, y_train, y_valid, y_test
+    return pipeline
 
-def build_model_cnn(input_shape):
+def prepare_augmented_traindata(args, pipeline):
+    """
+    Loads the raw clips of the training set, to be augmented and turned into features anew every epoch.
+    Returns:
+        train_data (AugmentedSequence): Training batches for model.fit()
+    """
+    params      = get_traindata_dataprep_params(args.traindata_path) # the clips are augmented and turned into features as dataprep did
+    sample_rate = int(params["sample_rate"])
+    f_train     = np.array(load_traindata_files(args.traindata_path))[pipeline.train]
+    print_info("|||||| Loading {} training clips for on-the-fly augmentation... ".format(len(f_train)))
+    clips = load_clips(f_train, sample_rate, fast_wav = params["fast_wav"] == str(True))
+    noise = load_noise(args.aug_noise_path, sample_rate) if provided(args.aug_noise_path) else None
+
+    engine = get_mfcc_engine(sample_rate, int(params["n_mfcc"]), int(params["n_fft"]), int(params["hop_length"]), int(params["n_mels"]))
+    shape  = engine.features(clips[:1], [args.feature])[args.feature].shape[1:]
+    if shape != pipeline.features.shape[1:3]:
+        raise ValueError("Features of shape {} computed from 1 second clips do not match the traindata {} of shape {} (only traindata of"
+                         " a single segment per 1 second file can be augmented)".format(shape, args.feature, pipeline.features.shape[1:3]))
+
+    augmenter = WaveAugmenter(sample_rate, shift_ms = args.aug_shift_ms, speed = args.aug_speed, gain_db = args.aug_gain_db,
+                                                noise_snr_db = args.aug_noise_snr_db, noise = noise)
+    return AugmentedSequence(clips, pipeline.labels[pipeline.train], args.batch_size, augmenter, engine, add_channel = args.ann_type == "cnn", seed = pipeline.seed,
+                                                                                                            feature = args.feature)
+
+def build_model_cnn(input_shape, width=64, depth=3):
     """
     Generates CNN model
     Param:
         input_shape (tuple): Shape of input set
+              width   (int): Number of filters of the 1st conv layer (half as many in the next ones) and of units of the dense layer
+              depth   (int): Number of conv layers
     Returns:
         model: CNN model
     """
     model = keras.Sequential()
 
     # 1st conv layer
-    model.add(keras.layers.Conv2D(filters=64, kernel_size=(3, 3), activation='relu', input_shape=input_shape,
+    model.add(keras.layers.Conv2D(filters=width, kernel_size=(3, 3), activation='relu', input_shape=input_shape,
                                   kernel_regularizer = keras.regularizers.l2(0.001)))
     model.add(keras.layers.BatchNormalization())
     model.add(keras.layers.MaxPooling2D(pool_size=(3, 3), strides=(2, 2), padding='same'))
 
-    # 2nd conv layer
-    model.add(keras.layers.Conv2D(32, (3, 3), activation='relu', kernel_regularizer = keras.regularizers.l2(0.001)))
-    model.add(keras.layers.BatchNormalization())
-    model.add(keras.layers.MaxPooling2D((3, 3), strides=(2, 2), padding='same'))
-
-    # 3rd conv layer
-    model.add(keras.layers.Conv2D(32, (2, 2), activation='relu', kernel_regularizer = keras.regularizers.l2(0.001)))
-    model.add(keras.layers.BatchNormalization())
-    model.add(keras.layers.MaxPooling2D((2, 2), strides=(2, 2), padding='same'))
+    # next conv layers, the last one with smaller kernels
+    for layer in range(1, depth):
+        kernel = (2, 2) if layer == depth - 1 else (3, 3)
+        model.add(keras.layers.Conv2D(width // 2, kernel, activation='relu', kernel_regularizer = keras.regularizers.l2(0.001)))
+        model.add(keras.layers.BatchNormalization())
+        model.add(keras.layers.MaxPooling2D(kernel, strides=(2, 2), padding='same'))
 
     # flatten output and feed it into dense layer
     model.add(keras.layers.Flatten())
@@ -132,7 +179,7 @@ def build_model_cnn(input_shape):
     #model.add(keras.layers.Dropout(0.1))
     #model.add(keras.layers.Dense(128, activation='relu'))
     #model.add(keras.layers.Dropout(0.1))
-    model.add(keras.layers.Dense(64, activation='relu'))
+    model.add(keras.layers.Dense(width, activation='relu'))
     model.add(keras.layers.Dropout(0.3))
 
     # output layer
@@ -141,22 +188,25 @@ def build_model_cnn(input_shape):
 
     return model
 
-def build_model_rnn(input_shape):
+def build_model_rnn(input_shape, width=64, depth=2):
     """
     Generates RNN-LSTM model
     Param:
         input_shape (tuple): Shape of input set
+              width   (int): Number of units of the LSTM layers and of the dense layer
+              depth   (int): Number of LSTM layers
     Returns:
         model: RNN-LSTM model
     """
     model = keras.Sequential()
+    model.add(keras.Input(shape=input_shape))
 
-    # 2 LSTM layers
-    model.add(keras.layers.LSTM(64, input_shape=input_shape, return_sequences=True))
-    model.add(keras.layers.LSTM(64))
+    # LSTM layers, all but the last one returning the whole sequence
+    for layer in range(depth):
+        model.add(keras.layers.LSTM(width, return_sequences = layer < depth - 1))
 
     # dense layer
-    model.add(keras.layers.Dense(64, activation='relu'))
+    model.add(keras.layers.Dense(width, activation='relu'))
     model.add(keras.layers.Dropout(0.3))
 
     # output layer
@@ -168,31 +218,80 @@ if __name__ == "__main__":
 
     args = process_clargs()
 
+    # a model already trained with the same parameters on the same traindata (see the artifact catalog) is reused rather than trained anew
+    catalog_params = compose_training_catalog_params(args, nameofthis(__file__))
+    if not args.retrain and reuse_trained_model(catalog_params):
+        exit()
+
+    if provided(args.threads):
+        set_thread_limits(args.threads)
+
+    if args.jit:
+        enable_jit()
+
+    trainid = args.ann_type + "_e" + str(args.epochs) + "_" + extract_filename(args.traindata_path)
+
+    # a resumed training gets the very same splits and shuffling, hence the seed of the checkpointed one
+    checkpoint_fullpath = compose_checkpoint_fullpath(trainid, catalog_params)
+    seed = load_checkpoint_state(checkpoint_fullpath)["seed"] if args.resume else args.seed
+    if provided(seed):
+        set_random_seed(seed)
+
     # get train, validation, test splits
-    x_train, x_valid, x_test, y_train, y_valid, y_test = prepare_traindata(args.ann_type, args.traindata_path, test_size = 0.25, valid_size = 0.2)
+    pipeline = prepare_traindata(args.ann_type, args.traindata_path, test_size = 0.25, valid_size = 0.2, feature = args.feature, shuffle_buffer = args.shuffle_buffer,
+                                                                                                                                  seed = seed)
+    if args.augment:
+        train_data = prepare_augmented_traindata(args, pipeline)
+    else:
+        train_data = pipeline.dataset(pipeline.train, args.batch_size, shuffle = True)
 
     # create network
     if (args.ann_type == "cnn"):
-        model = build_model_cnn(input_shape = (x_train.shape[1], x_train.shape[2], 1))
+        model = build_model_cnn(input_shape = pipeline.input_shape, width = args.width, depth = args.depth)
     else:
-        model = build_model_rnn(input_shape = (x_train.shape[1], x_train.shape[2]))
+        model = build_model_rnn(input_shape = pipeline.input_shape, width = args.width, depth = args.depth)
 
-    model.compile(optimizer = keras.optimizers.Adam(learning_rate = 0.0001),
+    model.compile(optimizer = keras.optimizers.Adam(learning_rate = args.learning_rate),
                   loss      = 'sparse_categorical_crossentropy',
                   metrics   = ['accuracy'])
 
+    if args.jit:
+        jit_compile_model(model)
+
     model.summary()
 
+    if provided(args.init_from) and not args.resume:
+        warm_start_model(model, args.init_from)
+
     earlystop_callback = keras.callbacks.EarlyStopping(monitor="accuracy", min_delta=0.001, patience=args.patience)
+    checkpoint         = TrainingCheckpoint(checkpoint_fullpath, model, pipeline.seed, args.checkpoint_every, earlystop_callback)
+    throughput_monitor = ThroughputMonitor(len(pipeline.train), args.batch_size, args.jit)
+    callbacks          = [earlystop_callback, checkpoint, throughput_monitor] + ([MetricsLogger(args.metrics_out)] if provided(args.metrics_out) else [])
+
+    initial_epoch = checkpoint.restore(args.epochs) if args.resume else 0
+    if args.augment:
+        train_data.set_epoch(initial_epoch)
+    else:
+        pipeline.epoch = initial_epoch
 
     start_time = time.time()
 
     # train model
-    history = model.fit(x_train, y_train, validation_data = (x_valid, y_valid),
-                        batch_size = args.batch_size,
-                        epochs     = args.epochs,
-                        verbose    = args.verbose,
-                        callbacks  = [earlystop_callback])
+    if args.augment:
+        # augmented batches are made by a pool of threads while the model trains, validation data stay unaugmented
+        history = model.fit(train_data, validation_data = pipeline.dataset(pipeline.valid, args.batch_size),
+                            epochs         = args.epochs,
+                            initial_epoch  = initial_epoch,
+                            verbose        = args.verbose,
+                            callbacks      = callbacks,
+                            workers        = args.aug_workers,
+                            max_queue_size = 2 * args.aug_workers)
+    else:
+        history = model.fit(throughput_monitor.stamp(train_data), validation_data = pipeline.dataset(pipeline.valid, args.batch_size),
+                            epochs        = args.epochs,
+                            initial_epoch = initial_epoch,
+                            verbose       = args.verbose,
+                            callbacks     = callbacks)
 
     training_duration = timedelta(seconds = round(time.time() - start_time))
     timestamp = timestamp_now()
@@ -200,16 +299,26 @@ if __name__ == "__main__":
     print_info("Finished {} at {} with wall clock time: {} ".format(cyansky(nameofthis(__file__)),
                                                                     lightyellow(timestamp),
                                                                     lightyellow(training_duration)))    
+    history.history = checkpoint.history # that of all the epochs, those before resuming included
+    throughput = throughput_monitor.summary()
+    print_throughput(throughput)
+
     # evaluate model on test set
     print_info('\nEvaluating test accuracy:')
-    model.evaluate(x_test, y_test, verbose = args.verbose)
-        
-    trainid = args.ann_type + "_e" + str(args.epochs) + "_" + extract_filename(args.traindata_path)
+    test_loss, test_acc = model.evaluate(pipeline.dataset(pipeline.test, args.batch_size), verbose = args.verbose)
+    pipeline.close()
+
+    if provided(args.metrics_out):
+        append_metrics(args.metrics_out, {"test_loss": test_loss, "test_accuracy": test_acc, "wall_time_sec": round(time.time() - start_time, 2),
+                                          Aimx.Training.THROUGHPUT: throughput})
 
     # save as most recent training result metadata
-    save_training_result_meta(trainid, timestamp, str(training_duration), args.savemodel)
+    save_training_result_meta(trainid, timestamp, str(training_duration), args.savemodel, throughput = throughput)
 
     if (args.savemodel):
         save_model(model, trainid)
+        catalog_model(trainid, catalog_params, args.traindata_path, str(training_duration))
+
+    checkpoint.remove() # nothing left to resume
 
     plot_history(history, trainid, args.showplot) # accuracy and error as a function of epochs
\ No newline at end of file
@@ -9,7 +9,6 @@ import cmd
 import sys
 import os
 
-from sklearn.model_selection import train_test_split
 import tensorflow.keras as keras
 
 # Add this directory to path so that package is recognized.
@@ -29,13 +28,21 @@ def process_clargs():
                         help = 'Path to the data file to be fed to the NN. Or use ' + Aimx.MOST_RECENT_OUTPUT +
                                ', which by design is the output of the previous step of dataset preprocessing.')
 
+    parser.add_argument("-feature",    default = Aimx.TrainData.MFCC, choices = FEATURE_TYPES, help = 'Traindata feature to train on (see dataprep -features).')
     parser.add_argument("-batch_size", default = 32, type=int, help = 'Batch size.')
+    parser.add_argument("-shuffle_buffer", default = SHUFFLE_BUFFER_SAMPLES, type=int, help = 'Number of samples the training samples are shuffled within, every epoch.')
     parser.add_argument("-epochs",     default = 50, type=int, help = 'Number of epochs to train.')
     parser.add_argument("-patience",   default =  5, type=int, help = 'Number of epochs with no improvement after which training will be stopped.')
     parser.add_argument("-verbose",    default =  1, type=int, help = 'Verbosity modes: 0 (silent), 1 (will show progress bar),'
                                                                       ' or 2 (one line per epoch). Default is 1.')
+    parser.add_argument("-seed",       default = None, type=int, help = 'Seed of the train, validation and test splits, of the shuffling and of the weight initialization (a random one by default).')
+    parser.add_argument("-checkpoint_every", default = 1, type=int, help = 'Save a checkpoint (weights, optimizer state and epoch) every that many epochs, never if 0.')
+    parser.add_argument("-resume",     action ='store_true',   help = 'Resume an interrupted training (run with the very same arguments) from its last checkpoint.')
+    parser.add_argument("-init_from",  default = None, type=Path, help = 'Start from the weights of a saved model (its output layer excepted, if the dataset view changed since).')
     parser.add_argument("-showplot",   action ='store_true',   help = 'At the end, show an interactive plot of the training history.')
     parser.add_argument("-savemodel",  action ='store_true',   help = 'Save a trained model in directory ' + quote(Aimx.Paths.GEN_SAVED_MODELS))
+    parser.add_argument("-jit",        action ='store_true',   help = 'XLA-compile the model (compare the step times printed with and without it), with a persistent compilation cache in the workdir from TensorFlow 2.12 on.')
+    parser.add_argument("-retrain",    action ='store_true',   help = 'Train anew even if the artifact catalog has a model trained with the same arguments.')
     parser.add_argument("-example",    action ='store_true',   help = 'Show a working example on how to call the script.')
 
     args = parser.parse_args()
@@ -46,14 +53,19 @@ def process_clargs():
         print_info(nameofthis(__file__) + " -epochs 5")
         exit()
 
-    if provided(args.traindata_path) and not args.traindata_path.exists():
+    if provided(args.traindata_path) and not os.path.exists(get_actual_traindata_path(args.traindata_path)): # traindata ids are looked up in the catalog
         if str(args.traindata_path) is not Aimx.MOST_RECENT_OUTPUT:
             raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(args.traindata_path)))
 
     # path to the traindata file that stores MFCCs and genre labels for each processed segment
     args.traindata_path = get_actual_traindata_path(args.traindata_path)
 
-    if not args.savemodel and os.path.getsize(args.traindata_path) > 100_000_000: # > 100 Mb
+    if provided(args.init_from):
+        args.init_from = get_actual_model_path(args.init_from) # model names are looked up in the catalog
+        if not os.path.exists(args.init_from):
+            raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(args.init_from)))
+
+    if not args.savemodel and get_traindata_size(args.traindata_path) > 100_000_000: # > 100 Mb
         args.savemodel = prompt_user_warning("Attempting to train on a large >100Mb traindata without '-savemodel',"
                                              " would you rather save the final model? [yes / no] ")
         print_info("As requested, proceeding with -savemodel =", args.savemodel)
@@ -64,39 +76,28 @@ def process_clargs():
 
     return args
 
-def prepare_traindata(traindata_path, test_size, valid_size):
+def prepare_traindata(traindata_path, test_size, valid_size, feature=Aimx.TrainData.MFCC, shuffle_buffer=SHUFFLE_BUFFER_SAMPLES, seed=None):
     """
-    Loads data and splits it into train, validation and test sets.
+    Opens the traindata as a tf.data input pipeline and splits its samples into train, validation and test sets.
     Params:
-         test_size (float): Value in [0, 1] indicating percentage of dataset to allocate to test       split
-        valid_size (float): Value in [0, 1] indicating percentage of dataset to allocate to validation split
+          test_size (float): Value in [0, 1] indicating percentage of dataset to allocate to test       split
+         valid_size (float): Value in [0, 1] indicating percentage of dataset to allocate to validation split
+            feature   (str): Traindata feature to use as inputs
+     shuffle_buffer   (int): Number of samples the training samples are shuffled within, every epoch
+               seed   (int): Seed of the splits and shuffling, or None for a random one
     Returns:
-        x_train (ndarray): Input training set
-        x_valid (ndarray): Input valid set
-        x_test  (ndarray): Input test set
-        y_train (ndarray): Target training set
-        y_valid (ndarray): Target valid set
-        y_test  (ndarray): Target test set
+        pipeline (TraindataPipeline): Sample indices of the train (pipeline.train), validation and test sets, and their batches
     """
-    x, y = load_traindata(traindata_path)
-
-    # create train, validation and test split
-    x_train, x_test,  y_train, y_test  = train_test_split(x,       y,       test_size = test_size)
-    x_train, x_valid, y_train, y_valid = train_test_split(x_train, y_train, test_size = valid_size)
-
-    # add an axis to input sets; example resulting shape: (89, 259, 13, 1)
-    x_train = x_train[..., np.newaxis]
-    x_valid = x_valid[..., np.newaxis]
-    x_test  =  x_test[..., np.newaxis]
+    print_info("|||||| Opening traindata " + quote_path(traindata_path) + "... ", end="")
+    pipeline = TraindataPipeline(traindata_path, feature, test_size, valid_size, add_channel = True, shuffle_buffer = shuffle_buffer, seed = seed)
+    print_info("[DONE]\n")
 
     print_info("Dataset view (labels) from dataprep result meta:")
     cmd.Cmd().columnize(get_dataprep_result_meta()[Aimx.Dataprep.DATASET_VIEW], displaywidth=100)
 
-    print_info("Extended x_train (input) shape: " + str(x_train.shape))
-    print_info("Extended x_valid (input) shape: " + str(x_valid.shape))
-    print_info("Extended x_test  (input) shape: " + str(x_test.shape))
+    pipeline.print_splits()
 
-    return x_train, x_valid, x_test, y_train, y_valid, y_test
+    return pipeline
 
 def build_model(input_shape):
     """
@@ -137,28 +138,56 @@ if __name__ == "__main__":
 
     args = process_clargs()
 
+    # a model already trained with the same parameters on the same traindata (see the artifact catalog) is reused rather than trained anew
+    catalog_params = compose_training_catalog_params(args, nameofthis(__file__))
+    if not args.retrain and reuse_trained_model(catalog_params):
+        exit()
+
+    if args.jit:
+        enable_jit()
+
+    trainid = "cnn_e" + str(args.epochs) + "_" + extract_filename(args.traindata_path)
+
+    # a resumed training gets the very same splits and shuffling, hence the seed of the checkpointed one
+    checkpoint_fullpath = compose_checkpoint_fullpath(trainid, catalog_params)
+    seed = load_checkpoint_state(checkpoint_fullpath)["seed"] if args.resume else args.seed
+    if provided(seed):
+        set_random_seed(seed)
+
     # get train, validation, test splits
-    x_train, x_valid, x_test, y_train, y_valid, y_test = prepare_traindata(args.traindata_path, test_size = 0.25, valid_size = 0.2)
+    pipeline = prepare_traindata(args.traindata_path, test_size = 0.25, valid_size = 0.2, feature = args.feature, shuffle_buffer = args.shuffle_buffer, seed = seed)
 
     # create network
-    model = build_model(input_shape = (x_train.shape[1], x_train.shape[2], 1))
+    model = build_model(input_shape = pipeline.input_shape)
 
     model.compile(optimizer = keras.optimizers.Adam(learning_rate = 0.0001),
                   loss      = 'sparse_categorical_crossentropy',
                   metrics   = ['accuracy'])
 
+    if args.jit:
+        jit_compile_model(model)
+
     model.summary()
 
+    if provided(args.init_from) and not args.resume:
+        warm_start_model(model, args.init_from)
+
     earlystop_callback = keras.callbacks.EarlyStopping(monitor="accuracy", min_delta=0.001, patience=args.patience)
+    checkpoint         = TrainingCheckpoint(checkpoint_fullpath, model, pipeline.seed, args.checkpoint_every, earlystop_callback)
+    throughput_monitor = ThroughputMonitor(len(pipeline.train), args.batch_size, args.jit)
+
+    initial_epoch = checkpoint.restore(args.epochs) if args.resume else 0
+    pipeline.epoch = initial_epoch
 
     start_time = time.time()
 
     # train model
-    history = model.fit(x_train, y_train, validation_data = (x_valid, y_valid),
-                       batch_size = args.batch_size,
-                       epochs     = args.epochs,
-                       verbose    = args.verbose,
-                       callbacks  = [earlystop_callback])
+    history = model.fit(throughput_monitor.stamp(pipeline.dataset(pipeline.train, args.batch_size, shuffle = True)),
+                       validation_data = pipeline.dataset(pipeline.valid, args.batch_size),
+                       epochs        = args.epochs,
+                       initial_epoch = initial_epoch,
+                       verbose       = args.verbose,
+                       callbacks     = [earlystop_callback, checkpoint, throughput_monitor])
 
     training_duration = timedelta(seconds = round(time.time() - start_time))
     timestamp = timestamp_now()
@@ -166,23 +195,28 @@ if __name__ == "__main__":
     print_info("Finished {} at {} with wall clock time: {} ".format(cyansky(nameofthis(__file__)),
                                                                     lightyellow(timestamp),
                                                                     lightyellow(training_duration)))
+    history.history = checkpoint.history # that of all the epochs, those before resuming included
+    throughput = throughput_monitor.summary()
+    print_throughput(throughput)
+
     # evaluate model on test set
-    test_loss, test_acc = model.evaluate(x_test, y_test, verbose = args.verbose)
+    test_loss, test_acc = model.evaluate(pipeline.dataset(pipeline.test, args.batch_size), verbose = args.verbose)
     print_info('\nTest accuracy:', test_acc)
         
     # pick a sample to predict from the test set
-    x_to_predict = x_test[30]
-    y_to_predict = y_test[30] # target
+    x_to_predict, y_to_predict = pipeline.read(pipeline.test[30:31]) # target
+    pipeline.close()
 
     # predict sample
-    predict(model, x_to_predict, y_to_predict)
-
-    trainid = "cnn_e" + str(args.epochs) + "_" + extract_filename(args.traindata_path)
+    predict(model, x_to_predict[0], y_to_predict[0])
 
     # save as most recent training result metadata
-    save_training_result_meta(trainid, timestamp, str(training_duration), args.savemodel)
+    save_training_result_meta(trainid, timestamp, str(training_duration), args.savemodel, throughput = throughput)
 
     if (args.savemodel):
         save_model(model, trainid)
+        catalog_model(trainid, catalog_params, args.traindata_path, str(training_duration))
+
+    checkpoint.remove() # nothing left to resume
     
     plot_history(history, trainid, args.showplot) # accuracy and error as a function of epochs
\ No newline at end of file
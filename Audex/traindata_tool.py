@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+from pathlib import Path
+import argparse
+import time
+import sys
+import os
+
+# Add this directory to path so that package is recognized.
+# Looks like a hack, but is ok for now to allow moving forward.
+# Source: https://stackoverflow.com/a/23891673/4973224
+# TODO: Replace with the idiomatic way.
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from Audex.utils.utils_common import *
+from Audex.utils.utils_audex  import *
+
+parser = argparse.ArgumentParser(description = 'This utility script converts traindata between the legacy json format and the (much faster to load)'
+                                               ' binary and HDF5 formats, a block of samples at a time, and checks traindata: one entry per sample in every'
+                                               ' section, labels within the mapping, finite features and array sections matching their checksums (kept in'
+                                               ' every converted traindata). It also shows the number of samples and the size of each label.')
+
+parser.add_argument("-traindata_path", type = Path, default = Aimx.MOST_RECENT_OUTPUT,              help = 'Path to the traindata (binary traindata directory, HDF5 or json file).')
+parser.add_argument("-convert_to",     type = str,  choices = Aimx.TrainData.FORMATS,               help = 'Format to convert the traindata into.')
+parser.add_argument("-output_path",    type = Path,                                                 help = 'Path of the converted traindata (next to the traindata, named after it, by default).')
+parser.add_argument("-h5_compression", type = str,  default = "none", choices = H5_COMPRESSIONS,    help = 'Compression of the array datasets, if converted into HDF5.')
+parser.add_argument("-shard_size",     type = int,  default = READ_BLOCK_SAMPLES,                   help = 'Number of samples read and written at a time (and per shard, if converted into binary).')
+parser.add_argument("-workers",        type = int,  default = 1,                                    help = 'Number of processes parsing the arrays of a json traindata.')
+parser.add_argument("-verify",         action ='store_true',                                        help = 'Check the traindata (and the converted traindata against it).')
+parser.add_argument("-stats",          action ='store_true',                                        help = 'Show the number of samples and the size of each label.')
+parser.add_argument("-update_meta",    action ='store_true',                                        help = 'Make the converted traindata the most recent output (in dataprep_result_meta.json and the artifact catalog).')
+parser.add_argument("-example",        action ='store_true',                                        help = 'Show a working example on how to call the script.')
+
+args = parser.parse_args()
+
+########################## Command Argument Handling & Verification #######################
+
+if args.example:
+    print_info(nameofthis(__file__) + " -traindata_path ../workdir/gen_traindata/3v_6d_asr_13m_2048w_512h_5i_22050r_1s.json -convert_to npy -workers 4 -verify -update_meta")
+    exit()
+
+actual_traindata_path = str(get_actual_traindata_path(args.traindata_path))
+if not os.path.exists(actual_traindata_path):
+    raise FileNotFoundError("Directory " + quote(pinkred(os.getcwd())) + " does not contain requested path " + quote(pinkred(actual_traindata_path)))
+
+if args.update_meta and not provided(args.convert_to):
+    raise ValueError("-update_meta only applies along with -convert_to")
+
+if provided(args.convert_to):
+    if not provided(args.output_path):
+        traindata_id = PurePath(actual_traindata_path).name
+        if extract_fileext(traindata_id) in (".json", TRAINDATA_H5_EXT):
+            traindata_id = traindata_id[:-len(extract_fileext(traindata_id))]
+        args.output_path = os.path.join(os.path.dirname(actual_traindata_path), compose_traindata_filename(traindata_id, args.convert_to))
+    args.output_path = os.path.abspath(args.output_path)
+    if args.output_path == os.path.abspath(actual_traindata_path):
+        raise ValueError("Traindata " + quote(pinkred(actual_traindata_path)) + " is already in the " + args.convert_to + " format")
+
+if args.shard_size < 1:
+    raise ValueError("-shard_size must be positive")
+
+###########################################################################################
+
+print_script_start_preamble(nameofthis(__file__), vars(args))
+
+def print_stats(reader):
+    """ Prints the number of samples and size (of all the array sections, as stored) of each label. """
+    mapping = reader.sections.get(Aimx.TrainData.MAPPING, [])
+    counts  = np.zeros(len(mapping), dtype=np.int64)
+    for block in reader.blocks(args.shard_size):
+        labels  = block[Aimx.TrainData.LABELS]
+        counts += np.bincount(labels[(labels >= 0) & (labels < len(mapping))], minlength=len(mapping))
+    sample_size = sum(np.dtype(reader.canonical_dtype(key)).itemsize * int(np.prod(reader.sample_shape(key))) for key in reader.arrays)
+    print_info("Traindata {}: {} samples of {} labels, {} array sections ({}), {:.1f} MB on disk".format(
+               quote_path(actual_traindata_path), len(reader), len(mapping), len(reader.arrays),
+               ", ".join("{} {} {}".format(key, reader.canonical_dtype(key), list(reader.sample_shape(key))) for key in reader.arrays),
+               get_traindata_size(actual_traindata_path) / 2**20))
+    for label, (name, count) in enumerate(zip(mapping, counts)):
+        print_info("  {:>4} {:<20} {:>8} samples ({:5.1f}%) {:>10.1f} KB".format(label, name, count, 100 * count / max(len(reader), 1),
+                                                                                count * sample_size / 2**10))
+
+def report_problems(problems, traindata_path):
+    if problems:
+        print_info("Traindata " + quote_path(traindata_path) + " has " + pinkred(str(len(problems)) + " problem(s)") + ":")
+        for problem in problems:
+            print_info("  " + problem)
+    else:
+        print_info("Traindata " + quote_path(traindata_path) + " verified: " + cyansky("OK"))
+    return not problems
+
+if __name__ == "__main__":
+
+    start_time = time.time()
+    verified   = True
+
+    print_info("|||||| Opening traindata " + quote_path(actual_traindata_path) + "... ", end="")
+    with TraindataReader(actual_traindata_path, args.workers) as reader:
+        print_info("[DONE]")
+
+        if args.stats:
+            print_stats(reader)
+
+        if args.verify:
+            verified = report_problems(verify_traindata(reader, block_size=args.shard_size), actual_traindata_path)
+
+        if provided(args.convert_to):
+            # the array sections keep the dtypes they are stored in (quantized features stay quantized), one block at a time
+            writer = open_traindata_writer(args.output_path, args.shard_size, array_dtypes={key: reader.canonical_dtype(key) for key in reader.arrays},
+                                                                              h5_compression=args.h5_compression)
+            def written_blocks():
+                for block in reader.blocks(args.shard_size):
+                    writer.extend(block)
+                    writer.flush()
+                    yield block
+            checksums = compute_checksums(written_blocks())
+            writer.close({**reader.sections, TRAINDATA_CHECKSUMS: checksums})
+            dataset_view = reader.sections.get(Aimx.TrainData.MAPPING, [])
+
+    if provided(args.convert_to):
+        if args.verify:
+            with TraindataReader(args.output_path, args.workers) as converted:
+                verified = report_problems(verify_traindata(converted, checksums, args.shard_size), args.output_path) and verified
+        if args.update_meta and verified:
+            repoint_dataprep_result_meta(args.output_path, actual_traindata_path, dataset_view, args.convert_to)
+        print_info("Converted {} ({:.1f} MB) into {} ({:.1f} MB)".format(quote_path(actual_traindata_path), get_traindata_size(actual_traindata_path) / 2**20,
+                                                                          quote_path(args.output_path), get_traindata_size(args.output_path) / 2**20))
+
+    print_info("Finished {} at {} with wall clock time: {} ".format(cyansky(nameofthis(__file__)),
+                                                                    lightyellow(timestamp_now()),
+                                                                    lightyellow(round(time.time() - start_time, 2))))
+    if not verified:
+        exit(1)
@@ -5,13 +5,27 @@ from shutil  import copy2
 
 import tensorflow as tf
 import numpy as np
+import hashlib
+import random
+import shutil
 import time
 import json
+import sys
 import os
 
+try:
+    import resource # peak memory of the process (see peak_rss_mb()), not on Windows
+except ImportError:
+    resource = None
+
 import matplotlib.pyplot as pt
 
-from Audex.utils.utils_common import *
+from Audex.utils.utils_common        import *
+from Audex.utils.utils_traindata     import *
+from Audex.utils.utils_dataset_index import *
+from Audex.utils.utils_catalog       import *
+from Audex.utils.utils_features      import FEATURE_TYPES
+from Audex.utils.utils_dataprep      import list_dataset_audiofiles
 
 # NOTE: Value depends on where the main script was called from:
 # Currently, it must be /Aimx/Audex for WORKDIR to get the right value "/Aimx/workdir
@@ -20,26 +34,60 @@ WORKDIR = os.path.join(Path().resolve().parent, "workdir")
 
 total_audios_length_sec = 0.0
 
+# Shuffling of the training samples (see TraindataPipeline): within windows of that many samples,
+# made of that many blocks of consecutive samples taken in a random order
+SHUFFLE_BUFFER_SAMPLES = 8192
+SHUFFLE_BUFFER_BLOCKS  = 32
+
+# tells the result meta files of this run apart from those of the other (possibly concurrent) runs in the workdir
+RUN_ID = time.strftime("%Y%m%d-%H%M%S") + "_" + str(os.getpid())
+
 class Aimx:
     class Paths:
         GEN_PLOTS        = os.path.join(WORKDIR, "gen_plots")
         GEN_SAVED_MODELS = os.path.join(WORKDIR, "gen_models")
         GEN_TRAINDATA    = os.path.join(WORKDIR, "gen_traindata")
+        GEN_CACHE        = os.path.join(WORKDIR, "gen_cache")
+        GEN_RUN_META     = os.path.join(WORKDIR, "gen_run_meta") # result meta of every run, never overwritten by other runs
+        GEN_XLA_CACHE    = os.path.join(WORKDIR, "gen_xla_cache") # persistent cache of the XLA-compiled models (-jit)
+        GEN_SWEEPS       = os.path.join(WORKDIR, "gen_sweeps")    # logs and metrics of the trials of every sweep (see sweep_asr.py)
     
     class Dataprep:
         RESULT_METADATA_FULLPATH = os.path.join(WORKDIR, "dataprep_result_meta.json")
         TOTAL_AUDIOS_LENGTH = "total_audio_files_length_sec"
         DATASET_VIEW        = "dataset_view"
         ALL_DIR_LABELS      = "alldirlabs"
+        TRAINDATA_MANIFEST  = "traindata_manifest"
+        TRAINDATA_OUTPUTS   = "traindata_outputs" # all the traindata of the run, one per feature extraction configuration
 
     class TrainData:
         MAPPING = "mapping"
         LABELS  = "labels"
         FILES   = "files"
-        MFCC    = "mfcc"
+        MFCC    = "mfcc"   # feature arrays are named after their feature type (see FEATURE_TYPES), MFCC being the default one
+
+        FORMAT_BINARY = "npy"  # directory of memory-mappable .npy arrays + json manifest
+        FORMAT_JSON   = "json" # legacy single json file
+        FORMAT_HDF5   = "h5"   # single chunked (optionally compressed) HDF5 file with random access to any samples
+        FORMATS       = [FORMAT_BINARY, FORMAT_JSON, FORMAT_HDF5]
+
+        # dtypes in which the array sections are stored in the binary format
+        ARRAY_DTYPES  = {MFCC: "float32", LABELS: "int32"}
+
+        @staticmethod
+        def array_dtypes(features):
+            """ dtypes of the array sections of a traindata with the given feature types. """
+            return {**{feature: "float32" for feature in features}, Aimx.TrainData.LABELS: "int32"}
 
     class Training:
         RESULT_METADATA_FULLPATH = os.path.join(WORKDIR, "training_result_meta.json")
+        THROUGHPUT               = "throughput"
+
+    class Catalog:
+        FULLPATH = os.path.join(WORKDIR, "artifact_catalog.sqlite") # all the traindata and models of the workdir (see utils_catalog)
+
+    class Sweep:
+        RESULTS_FULLPATH = os.path.join(WORKDIR, "sweep_results.sqlite") # all the trials of all the sweeps (see utils_sweep)
 
     MOST_RECENT_OUTPUT  = "most_recent_output"
     TIMESTAMP           = "timestamp"
@@ -60,54 +108,79 @@ def to_genre_name(label_id):
     ][label_id]
 
 def get_dataprep_result_meta():
-    if not hasattr(get_dataprep_result_meta, "cached"):
-        with open(Aimx.Dataprep.RESULT_METADATA_FULLPATH, "r") as file:
-            print_info("|||||| Loading file  " + quote_path(Aimx.Dataprep.RESULT_METADATA_FULLPATH) + "... ", end="")
-            jsonfile = json.load(file)
-            print_info("[DONE]")
-        get_dataprep_result_meta.cached = jsonfile
-    return get_dataprep_result_meta.cached
+    # cached until the file changes, which another run sharing the workdir may do at any time
+    return read_json_cached(Aimx.Dataprep.RESULT_METADATA_FULLPATH, get_dataprep_result_meta)
 
 def get_training_result_meta():
-    if not hasattr(get_training_result_meta, "cached"):
-        with open(Aimx.Training.RESULT_METADATA_FULLPATH, "r") as file:
-            print_info("|||||| Loading file  " + quote_path(Aimx.Training.RESULT_METADATA_FULLPATH) + "... ", end="")
-            jsonfile = json.load(file)
-            print_info("[DONE]")
-        get_training_result_meta.cached = jsonfile
-    return get_training_result_meta.cached
+    return read_json_cached(Aimx.Training.RESULT_METADATA_FULLPATH, get_training_result_meta)
 
-def get_actual_traindata_path(arg):
-    # Handle any special requests (most recent, largest, smallest, etc.)
+def compose_run_meta_fullpath(meta_fullpath, run_id=RUN_ID):
+    return os.path.join(Aimx.Paths.GEN_RUN_META, extract_filename(meta_fullpath) + "_" + run_id + ".json")
+
+def write_result_meta(meta, meta_fullpath):
+    """
+    Writes the result meta of this run into a file of its own (see compose_run_meta_fullpath()), which no other run overwrites,
+    and over the shared result meta of the workdir (that of the most recent run). Concurrent runs thus never corrupt either,
+    nor lose the results of one another.
+    """
+    write_json_atomic(compose_run_meta_fullpath(meta_fullpath), meta)
+    with file_lock(meta_fullpath):
+        print_info("|||||| Writing file", quote_path(meta_fullpath), "... ", end="")
+        write_json_atomic(meta_fullpath, meta)
+        print_info("[DONE]")
+
+def resolve_artifact_path(arg, kind, get_result_meta):
+    """
+    Resolves most_recent_output (an alias of the most recent artifact of the kind in the catalog) and the names of cataloged
+    artifacts (traindata ids, model directory names) to their paths. Workdirs from before the catalog fall back on the result meta.
+    """
     if str(arg) == Aimx.MOST_RECENT_OUTPUT:
-        return get_dataprep_result_meta()[Aimx.MOST_RECENT_OUTPUT]
+        artifact = most_recent_artifact(Aimx.Catalog.FULLPATH, kind)
+        return artifact["path"] if artifact is not None else get_result_meta()[Aimx.MOST_RECENT_OUTPUT]
+    if not os.path.exists(str(arg)):
+        artifact = most_recent_artifact(Aimx.Catalog.FULLPATH, kind, PurePath(arg).name)
+        if artifact is not None:
+            return artifact["path"]
     return arg # no special requests, return pristine
 
+def get_actual_traindata_path(arg):
+    # Handle any special requests (most recent, largest, smallest, etc.)
+    return resolve_artifact_path(arg, KIND_TRAINDATA, get_dataprep_result_meta)
+
 def get_actual_model_path(arg):
     # Handle any special requests (most recent, largest, smallest, etc.)
-    if str(arg) == Aimx.MOST_RECENT_OUTPUT:
-        return get_training_result_meta()[Aimx.MOST_RECENT_OUTPUT]
-    return arg # no special requests, return pristine
+    return resolve_artifact_path(arg, KIND_MODEL, get_training_result_meta)
 
-def save_dataprep_result_meta(traindata_filename, dataset_view, timestamp, dataprep_duration, total_audios_length_sec):
+def save_dataprep_result_meta(traindata_filenames, dataset_view, timestamp, dataprep_duration, total_audios_length_sec):
+    """
+        :param traindata_filenames (list): Names (or full paths) of the traindata produced or reused (see compose_traindata_filename()),
+                                           the last one being the most recent output.
+    """
     meta = {
         Aimx.MOST_RECENT_OUTPUT:           {},
+        Aimx.Dataprep.TRAINDATA_MANIFEST:  {},
+        Aimx.Dataprep.TRAINDATA_OUTPUTS:   {},
         Aimx.Dataprep.DATASET_VIEW:        {},
         Aimx.Dataprep.TOTAL_AUDIOS_LENGTH: {},
         Aimx.TIMESTAMP:                    {},
         Aimx.DURATION:                     {}
     }
-    meta[Aimx.MOST_RECENT_OUTPUT]           = os.path.join(Aimx.Paths.GEN_TRAINDATA, traindata_filename)
+    traindata_fullpaths = [os.path.join(Aimx.Paths.GEN_TRAINDATA, traindata_filename) for traindata_filename in traindata_filenames]
+    traindata_fullpath  = traindata_fullpaths[-1]
+    meta[Aimx.MOST_RECENT_OUTPUT]           = traindata_fullpath
+    meta[Aimx.Dataprep.TRAINDATA_MANIFEST]  = os.path.join(traindata_fullpath, TRAINDATA_MANIFEST) if is_binary_traindata(traindata_fullpath) else ""
+    meta[Aimx.Dataprep.TRAINDATA_OUTPUTS]   = traindata_fullpaths
     meta[Aimx.Dataprep.DATASET_VIEW]        = dataset_view
     meta[Aimx.Dataprep.TOTAL_AUDIOS_LENGTH] = round(total_audios_length_sec)
     meta[Aimx.TIMESTAMP]                    = timestamp
     meta[Aimx.DURATION]                     = dataprep_duration
-    with open(Aimx.Dataprep.RESULT_METADATA_FULLPATH, 'w') as file: 
-        print_info("|||||| Writing file", quote_path(Aimx.Dataprep.RESULT_METADATA_FULLPATH), "... ", end="")
-        json.dump(meta, file, indent=4)
-        print_info("[DONE]")
+    write_result_meta(meta, Aimx.Dataprep.RESULT_METADATA_FULLPATH)
 
-def save_training_result_meta(trainid, timestamp, training_duration, savemodel=False):
+def save_training_result_meta(trainid, timestamp, training_duration, savemodel=False, model_fullpath=None, throughput=None):
+    """
+        :param model_fullpath (str): Path to the (saved) model, if not the one saved under trainid (e.g. a reused one).
+        :param    throughput (dict): Training throughput (see ThroughputMonitor.summary()), if monitored.
+    """
     meta = {
         Aimx.MOST_RECENT_OUTPUT:           {},
         Aimx.Dataprep.DATASET_VIEW:        {},
@@ -115,43 +188,525 @@ def save_training_result_meta(trainid, timestamp, training_duration, savemodel=F
         Aimx.TIMESTAMP:                    {},
         Aimx.DURATION:                     {}
     }
-    model_fullpath = os.path.join(Aimx.Paths.GEN_SAVED_MODELS, "model_" + trainid) if savemodel else ""
+    if model_fullpath is None:
+        model_fullpath = os.path.join(Aimx.Paths.GEN_SAVED_MODELS, "model_" + trainid) if savemodel else ""
     meta[Aimx.MOST_RECENT_OUTPUT]           = model_fullpath
     meta[Aimx.Dataprep.DATASET_VIEW]        = get_dataprep_result_meta()[Aimx.Dataprep.DATASET_VIEW]
     meta[Aimx.Dataprep.TOTAL_AUDIOS_LENGTH] = get_dataprep_result_meta()[Aimx.Dataprep.TOTAL_AUDIOS_LENGTH]
     meta[Aimx.TIMESTAMP]                    = timestamp
     meta[Aimx.DURATION]                     = training_duration
-    with open(Aimx.Training.RESULT_METADATA_FULLPATH, 'w') as file: 
-        print_info("|||||| Writing file", quote_path(Aimx.Training.RESULT_METADATA_FULLPATH), "... ", end="")
-        json.dump(meta, file, indent=4)
-        print_info("[DONE]")
+    if throughput is not None:
+        meta[Aimx.Training.THROUGHPUT]      = throughput
+    write_result_meta(meta, Aimx.Training.RESULT_METADATA_FULLPATH)
 
-def load_traindata(arg_traindata_path):
+def load_traindata(arg_traindata_path, feature=Aimx.TrainData.MFCC, dequantize=True):
     """
-    Loads training data from json file and reads them into arrays for NN processing.
-        :param data_path (str): Path to json file containing traindata
-        :return inputs (ndarray: the "mfcc"   section in the json traindata) 
-        :return labels (ndarray: the "labels" section in the json traindata, one label per segment)
+    Loads training data from a traindata file and reads them into arrays for NN processing.
+    Binary traindata are memory-mapped, HDF5 traindata are read in chunks, legacy json traindata files are parsed as a whole.
+        :param  data_path (str): Path to the traindata (binary traindata directory, HDF5 or json file)
+        :param    feature (str): Feature type to use as inputs (the traindata must have been prepared with it)
+        :param dequantize (bool): Dequantize quantized features (see dataprep -feature_dtype) right away,
+                                  rather than returning them as a QuantizedArray to be dequantized batch by batch
+        :return inputs (ndarray: the "mfcc"   section in the traindata, or that of the requested feature type) 
+        :return labels (ndarray: the "labels" section in the traindata, one label per segment)
     """
     actual_traindata_path = get_actual_traindata_path(arg_traindata_path)
+    timestamp = str(time.ctime(os.path.getmtime(actual_traindata_path))) if os.path.exists(actual_traindata_path) else ""
+    m = "most recent [" + timestamp + "] " if str(arg_traindata_path) == Aimx.MOST_RECENT_OUTPUT else ""
+
+    if is_binary_traindata(actual_traindata_path):
+        print_info("|||||| Memory-mapping " + m + "traindata  " + quote_path(actual_traindata_path) + "... ", end="")
+        traindata = load_traindata_binary(actual_traindata_path)
+        print_info("[DONE]\n")
+        quantization = traindata.get(TRAINDATA_QUANTIZATION, {}).get(feature)
+        return as_features(traindata[feature], quantization, dequantize), traindata[Aimx.TrainData.LABELS]
+
+    if is_hdf5_traindata(actual_traindata_path):
+        print_info("|||||| Loading " + m + "HDF5 traindata  " + quote_path(actual_traindata_path) + "... ", end="")
+        with Hdf5Traindata(actual_traindata_path) as traindata:
+            inputs, labels = traindata.read(feature), traindata.read(Aimx.TrainData.LABELS)
+            quantization   = traindata.meta.get(TRAINDATA_QUANTIZATION, {}).get(feature)
+        print_info("[DONE]\n")
+        return as_features(inputs, quantization, dequantize), labels
+
     try:
-        with open(actual_traindata_path, "r") as file:
-            timestamp = str(time.ctime(os.path.getmtime(actual_traindata_path)))
-            m = "most recent [" + timestamp + "] " if str(arg_traindata_path) == Aimx.MOST_RECENT_OUTPUT else ""
-            print_info("|||||| Loading " + m + "file  " + quote_path(actual_traindata_path) + "... ", end="")
-            traindata = json.load(file)
-            print_info("[DONE]")            
+        # the arrays are parsed straight into numpy arrays, a chunk of the file at a time (rather than
+        # json.load() building a Python object per coefficient first), so peak memory stays close to their size
+        print_info("|||||| Loading " + m + "file  " + quote_path(actual_traindata_path) + "... ", end="")
+        traindata = load_traindata_json(actual_traindata_path, {feature: "float32", Aimx.TrainData.LABELS: "int32"}, [TRAINDATA_QUANTIZATION])
+        print_info("[DONE]")
     except FileNotFoundError:
         print_info("Data file " + quote(actual_traindata_path) + " not provided or not found. Exiting...")
         exit() # cannot proceed without traindata file
     
     print_info("Reading traindata... ", end="")
-    inputs = np.array(traindata["mfcc"])   # convert the list to numpy array (MFCCs  turn into a 2d array)
-    labels = np.array(traindata["labels"]) # convert the list to numpy array (labels turn into a 1d array)
+    inputs = traindata[feature]                # MFCCs  as a 3d array (# samples, # frames, # coefficients)
+    labels = traindata[Aimx.TrainData.LABELS] # labels as a 1d array
+    inputs = as_features(inputs, traindata.get(TRAINDATA_QUANTIZATION, {}).get(feature), dequantize)
     print_info("[DONE]\n")
 
     return inputs, labels
 
+def load_traindata_files(arg_traindata_path):
+    """
+    Loads the "files" section of a traindata, i.e. the audio file each sample was extracted from (ASR traindata only).
+    """
+    actual_traindata_path = get_actual_traindata_path(arg_traindata_path)
+    if is_binary_traindata(actual_traindata_path):
+        return load_traindata_manifest(actual_traindata_path)[Aimx.TrainData.FILES]
+    if is_hdf5_traindata(actual_traindata_path):
+        with Hdf5Traindata(actual_traindata_path) as traindata:
+            return traindata.sample_files()
+    # skips the feature arrays instead of parsing the whole file
+    return load_traindata_json(actual_traindata_path, array_dtypes = {}, sections = [Aimx.TrainData.FILES])[Aimx.TrainData.FILES]
+
+def verify_traindata(reader, checksums=None, block_size=READ_BLOCK_SAMPLES):
+    """
+    Checks a traindata: every array section (and the files section, if any) holds one entry per sample, the labels are valid
+    indices into the mapping, the features are all finite, and the array sections match their checksums.
+        :param reader (TraindataReader): The traindata.
+        :param checksums        (dict): Expected checksums (see compute_checksums()), by default those kept in the traindata, if any.
+        :return (list): Description of each problem found, empty if none.
+    """
+    problems    = []
+    num_samples = len(reader)
+    for key in reader.arrays:
+        if reader.arrays[key]["shape"][0] != num_samples:
+            problems.append("section {} has {} samples, labels have {}".format(quote(key), reader.arrays[key]["shape"][0], num_samples))
+    files = reader.sections.get(Aimx.TrainData.FILES)
+    if files is not None and len(files) != num_samples:
+        problems.append("section {} lists {} audio files for {} samples".format(quote(Aimx.TrainData.FILES), len(files), num_samples))
+
+    num_labels    = len(reader.sections.get(Aimx.TrainData.MAPPING, []))
+    num_invalid   = 0
+    num_nonfinite = {}
+    def checked_blocks(): # checked on their way to being checksummed, so that the traindata is read only once
+        nonlocal num_invalid
+        for block in reader.blocks(block_size):
+            labels = block[Aimx.TrainData.LABELS]
+            num_invalid += np.count_nonzero((labels < 0) | (labels >= num_labels))
+            for key, array in block.items():
+                if array.dtype.kind == "f":
+                    num_nonfinite[key] = num_nonfinite.get(key, 0) + array.size - np.count_nonzero(np.isfinite(array))
+            yield block
+    actual_checksums = compute_checksums(checked_blocks())
+    if num_invalid:
+        problems.append("{} labels outside of [0, {}) (the mapping)".format(num_invalid, num_labels))
+    for key, count in num_nonfinite.items():
+        if count:
+            problems.append("section {} holds {} NaN or infinite values".format(quote(key), count))
+
+    checksums = reader.sections.get(TRAINDATA_CHECKSUMS) if checksums is None else checksums
+    for key, checksum in (checksums or {}).items():
+        if actual_checksums.get(key) != checksum:
+            problems.append("section {} checksum {} does not match the expected {}".format(quote(key), actual_checksums.get(key), checksum))
+    return problems
+
+class TraindataPipeline:
+    """
+    tf.data input pipeline of a traindata of any format and size. The features are never loaded as a whole: they stay
+    memory-mapped (binary traindata, and json traindata parsed into a scratch directory first, see TraindataReader) or
+    on disk (HDF5), and each batch is read (and dequantized, if quantized) out of them only when needed, in parallel
+    with training, then prefetched. The train, validation and test splits are just arrays of sample indices, so
+    splitting copies nothing, and traindata larger than memory train just as well.
+    """
+    def __init__(self, traindata_path, feature, test_size, valid_size=0, add_channel=False, shuffle_buffer=SHUFFLE_BUFFER_SAMPLES, seed=None):
+        """
+        :param traindata_path   (str): Path to the traindata (binary traindata directory, HDF5 or json file).
+        :param        feature   (str): Traindata feature to use as inputs.
+        :param      test_size (float): Value in [0, 1] indicating percentage of the samples to allocate to the test split.
+        :param     valid_size (float): Value in [0, 1] indicating percentage of the remaining samples to allocate to the validation split.
+        :param    add_channel  (bool): Add a trailing channel axis to the inputs (CNN).
+        :param shuffle_buffer   (int): Number of samples the training samples are shuffled within, every epoch.
+        :param            seed  (int): Seed of the splits and shuffling, or None for a random one (see self.seed).
+        """
+        self.reader         = TraindataReader(traindata_path)
+        self.features       = self.reader.array(feature)
+        self.labels         = self.reader.array(Aimx.TrainData.LABELS).take(np.arange(len(self.reader))) # labels are small, read right away
+        self.quantization   = self.reader.sections.get(TRAINDATA_QUANTIZATION, {}).get(feature)
+        self.add_channel    = add_channel
+        self.shuffle_buffer = max(1, shuffle_buffer)
+        self.seed           = seed if seed is not None else int(np.random.default_rng().integers(2**31))
+        self.epoch          = 0 # epoch of the next shuffled order (see epoch_order())
+
+        # same split sizes as train_test_split()
+        order   = np.random.default_rng(self.seed).permutation(len(self.labels))
+        n_test  = int(np.ceil(test_size  * len(order)))
+        n_valid = int(np.ceil(valid_size * (len(order) - n_test)))
+        self.test  = np.sort(order[:n_test])
+        self.valid = np.sort(order[n_test : n_test + n_valid])
+        self.train = np.sort(order[n_test + n_valid:])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.reader.close()
+
+    @property
+    def input_shape(self):
+        return self.features.shape[1:] + ((1,) if self.add_channel else ())
+
+    def read(self, indices):
+        """
+        :param indices (ndarray): Sample indices.
+        :return (ndarray, ndarray): The float32 inputs and the labels of those samples (sorted by index, so that reads go forward).
+        """
+        indices = np.sort(indices)
+        inputs  = self.features.take(indices)
+        if self.quantization is not None:
+            inputs = dequantize_array(inputs, self.quantization)
+        return (inputs[..., np.newaxis] if self.add_channel else inputs), self.labels[indices]
+
+    def read_batch(self, indices):
+        inputs, labels = tf.numpy_function(self.read, [indices], [tf.float32, tf.int32])
+        inputs.set_shape((None,) + self.input_shape)
+        labels.set_shape((None,))
+        return inputs, labels
+
+    def epoch_order(self, indices):
+        """
+        The samples of a split in a shuffled order, a new one every call (i.e. every epoch): blocks of consecutive samples are taken
+        in a random order, then shuffled within windows of shuffle_buffer samples, so that reads stay within a few blocks at a time,
+        yet labels (stored one after the other) all get mixed. The order only depends on the seed and the epoch, so a training
+        resumed at some epoch (see TrainingCheckpoint) gets the very same batches from then on.
+            :param indices (ndarray): Sorted sample indices of a split (e.g. self.train).
+            :return (ndarray): The indices in the order of the epoch.
+        """
+        rng = np.random.default_rng([self.seed, self.epoch])
+        self.epoch += 1
+        block  = max(1, self.shuffle_buffer // SHUFFLE_BUFFER_BLOCKS)
+        starts = rng.permutation(np.arange(0, len(indices), block))
+        order  = np.concatenate([indices[start : start + block] for start in starts] or [indices])
+        return order[np.lexsort((rng.random(len(order)), np.arange(len(order)) // self.shuffle_buffer))]
+
+    def dataset(self, indices, batch_size, shuffle=False):
+        """
+        :param indices (ndarray): Sorted sample indices of a split (e.g. self.train).
+        :param  batch_size (int): Batch size.
+        :param     shuffle (bool): Shuffle the samples anew every epoch (training batches, see epoch_order()).
+        :return (tf.data.Dataset): Batches of (inputs, labels) for model.fit(), evaluate() and predict().
+        """
+        samples = tf.data.Dataset.from_tensor_slices(indices)
+        if shuffle:
+            def epoch_samples(_):
+                order = tf.numpy_function(lambda: self.epoch_order(indices), [], tf.int64)
+                order.set_shape(indices.shape)
+                return tf.data.Dataset.from_tensor_slices(order)
+            samples = tf.data.Dataset.range(1).flat_map(epoch_samples) # a new order every time the dataset is iterated over
+        batches = samples.batch(batch_size).map(self.read_batch, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        return batches.prefetch(tf.data.experimental.AUTOTUNE)
+
+    def print_splits(self):
+        print_info("Extended x_train (input) shape: " + str((len(self.train),) + self.input_shape))
+        print_info("Extended x_valid (input) shape: " + str((len(self.valid),) + self.input_shape))
+        print_info("Extended x_test  (input) shape: " + str((len(self.test),)  + self.input_shape))
+
+# XLA compilation of the models (-jit): the train, test and predict steps get compiled into a few fused kernels, which saves
+# most of the per-op dispatch overhead of these small conv and LSTM models on CPU. Auto-clustering only considers CPU ops
+# with --tf_xla_cpu_global_jit, so both flags are set (before TensorFlow first optimizes a graph, which reads them once).
+# From TensorFlow 2.12 on, the compiled kernels are kept in a persistent cache in the workdir, so that later runs of the
+# same model (with the same input shapes) skip compilation.
+XLA_AUTO_JIT_FLAGS              = ["--tf_xla_auto_jit=2", "--tf_xla_cpu_global_jit"]
+XLA_PERSISTENT_CACHE_TF_VERSION = (2, 12) # first TensorFlow version with a persistent XLA compilation cache
+XLA_JIT_COMPILE_TF_VERSION      = (2, 5)  # first TensorFlow version whose Keras models have jit_compile
+
+def get_tf_version():
+    return tuple(int(v) for v in tf.version.VERSION.split(".")[:2])
+
+def enable_jit(cache_dir=Aimx.Paths.GEN_XLA_CACHE):
+    """
+    Turns on XLA compilation of the graph functions of this process (auto-clustering, CPU included), with a persistent
+    compilation cache where TensorFlow has one. To be called before any model is built or any graph function is run.
+    """
+    flags = os.environ.get("TF_XLA_FLAGS", "").split()
+    flags += [flag for flag in XLA_AUTO_JIT_FLAGS if flag not in flags]
+    if get_tf_version() >= XLA_PERSISTENT_CACHE_TF_VERSION:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        flags.append("--tf_xla_persistent_cache_directory=" + cache_dir)
+    else:
+        print_info("TensorFlow", tf.version.VERSION, "has no persistent XLA compilation cache (from 2.12 on), the model is compiled anew every run")
+    os.environ["TF_XLA_FLAGS"] = " ".join(flags)
+    tf.config.optimizer.set_jit(True)
+
+def jit_compile_model(model):
+    """
+    XLA-compiles the train, test and predict steps of a (compiled or loaded) model: with jit_compile where Keras has it,
+    by wrapping the steps into XLA-compiled graph functions otherwise (as jit_compile does).
+    """
+    if isinstance(getattr(type(model), "jit_compile", None), property):
+        model.jit_compile = True
+    elif get_tf_version() < XLA_JIT_COMPILE_TF_VERSION:
+        model.train_step   = tf.function(model.train_step,   experimental_compile=True)
+        model.test_step    = tf.function(model.test_step,    experimental_compile=True)
+        model.predict_step = tf.function(model.predict_step, experimental_compile=True)
+
+def peak_rss_mb():
+    """ :return (float): Peak resident memory of the process so far in MB, or None where unknown (Windows). """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # in KB, but in bytes on macOS
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+INPUT_BOUND_FRACTION = 0.5 # share of the step time waiting for data beyond which the input pipeline is the bottleneck
+
+class ThroughputMonitor(tf.keras.callbacks.Callback):
+    """
+    Instruments a training: times every epoch and every training step, counts the training samples per second and tracks
+    the peak memory (RSS) of the process. The time each step waits for its batch is told from the time it computes, if the
+    training batches are stamped (see stamp()): mostly waiting means the input pipeline is the bottleneck, not the model.
+    The first step (which traces the train step into a graph and, with -jit, compiles it with XLA, unless already in the
+    persistent cache) is told from all the steps after it. The summary goes into the training result meta (and the assets
+    of a saved model), so that throughput regressions show between versions.
+    """
+    def __init__(self, samples, batch_size, jit=False):
+        """
+        :param    samples (int): Number of training samples (per epoch).
+        :param batch_size (int): Batch size.
+        :param       jit (bool): Whether the model is XLA-compiled (-jit).
+        """
+        super().__init__()
+        self.samples    = samples
+        self.batch_size = batch_size
+        self.jit        = jit
+        self.stamps     = [] # times the training batches were handed to their steps
+        self.times      = [] # of all the training steps
+        self.waits      = [] # for their batch, of all the training steps (if stamped)
+        self.epochs     = [] # one record per epoch
+
+    def stamp(self, dataset):
+        """
+        :param dataset (tf.data.Dataset): Training batches of (inputs, labels), e.g. from TraindataPipeline.dataset().
+        :return (tf.data.Dataset): The same batches, stamped with the time each leaves the prefetch buffer, i.e. is handed
+                                   to its step (once ready, if the step has to wait for it).
+        """
+        def now():
+            self.stamps.append(time.perf_counter())
+            return np.float64(self.stamps[-1])
+        def stamp_batch(inputs, labels):
+            stamp = tf.numpy_function(now, [], tf.float64)
+            with tf.control_dependencies([stamp]):
+                return tf.identity(inputs), tf.identity(labels)
+        return dataset.map(stamp_batch) # not parallel: runs as each step asks for its batch
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start  = time.perf_counter()
+        self.epoch_stamps = len(self.stamps)
+        self.epoch_times  = []
+        self.epoch_waits  = []
+        self.train_end    = self.epoch_start
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.train_end = time.perf_counter()
+        self.epoch_times.append(self.train_end - self.start)
+        stamp = self.epoch_stamps + len(self.epoch_times) - 1
+        if stamp < len(self.stamps):
+            self.epoch_waits.append(min(max(self.stamps[stamp] - self.start, 0.0), self.epoch_times[-1]))
+
+    def on_epoch_end(self, epoch, logs=None):
+        train_sec = self.train_end - self.epoch_start # validation excluded
+        samples   = min(len(self.epoch_times) * self.batch_size, self.samples)
+        waits     = self.epoch_waits[1:] if not self.times else self.epoch_waits # the first step of the training waits on tracing, not data
+        self.times += self.epoch_times
+        self.waits += self.epoch_waits
+        self.epochs.append({"epoch":           epoch + 1,
+                            "epoch_sec":       round(time.perf_counter() - self.epoch_start, 3),
+                            "train_sec":       round(train_sec, 3),
+                            "steps":           len(self.epoch_times),
+                            "samples":         samples,
+                            "median_step_ms":  round(1000 * float(np.median(self.epoch_times)), 2) if self.epoch_times else None,
+                            "samples_per_sec": round(samples / train_sec, 1) if train_sec > 0 else None,
+                            "data_wait_sec":   round(sum(waits), 3) if self.epoch_waits else None,
+                            "peak_rss_mb":     peak_rss_mb()})
+
+    def summary(self):
+        """
+        :return (dict): Time of the first step and median time of the steps after it in milliseconds, samples per second and share
+                        of the step time spent waiting for data of the steps after it, peak RSS in MB, and the record of every epoch.
+        """
+        # the first step aside (see above), so that the throughput of short trainings is not dragged down by tracing
+        waits     = self.waits[1:] if len(self.waits) == len(self.times) else [] # unless not all the steps were stamped
+        samples   = sum(epoch["samples"] for epoch in self.epochs) - min(self.batch_size, self.samples)
+        train_sec = sum(epoch["train_sec"] for epoch in self.epochs) - (self.times[0] if self.times else 0)
+        return {"jit":                self.jit,
+                "steps":              len(self.times),
+                "first_step_ms":      round(1000 * self.times[0], 2) if self.times else None,
+                "median_step_ms":     round(1000 * float(np.median(self.times[1:])), 2) if len(self.times) > 1 else None,
+                "samples_per_sec":    round(samples / train_sec, 1) if len(self.times) > 1 and train_sec > 0 else None,
+                "data_wait_fraction": round(sum(waits) / sum(self.times[1:]), 3) if waits and sum(self.times[1:]) > 0 else None,
+                "peak_rss_mb":        peak_rss_mb(),
+                "epochs":             self.epochs}
+
+def set_thread_limits(threads):
+    """ Limits the threads TensorFlow runs ops on (within an op and across ops), e.g. to share the cores with other trainings. """
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(threads)
+
+def append_metrics(metrics_fullpath, metrics):
+    """ Appends a record of metrics as a line of JSON, flushed right away for whoever follows the file (e.g. sweep_asr.py). """
+    with open(metrics_fullpath, "a") as file:
+        file.write(json.dumps({key: float(value) if isinstance(value, (np.floating, np.integer)) else value for key, value in metrics.items()}) + "\n")
+
+class MetricsLogger(tf.keras.callbacks.Callback):
+    """ Appends the metrics of every epoch (loss, accuracy, val_loss, val_accuracy) to a JSON lines file (see append_metrics()). """
+    def __init__(self, metrics_fullpath):
+        super().__init__()
+        self.metrics_fullpath = metrics_fullpath
+
+    def on_train_begin(self, logs=None):
+        self.start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        append_metrics(self.metrics_fullpath, {"epoch": epoch + 1, **{key: float(value) for key, value in (logs or {}).items()},
+                                               "wall_time_sec": round(time.time() - self.start, 2)})
+
+def print_throughput(throughput):
+    if throughput["steps"] > 1:
+        print_info("Step time{}: {} ms first step (tracing{}), {} ms median of the {} steps after it".format(
+                   " with XLA (-jit)" if throughput["jit"] else "", lightyellow(throughput["first_step_ms"]),
+                   " and XLA compilation" if throughput["jit"] else "", lightyellow(throughput["median_step_ms"]), throughput["steps"] - 1))
+    if throughput["samples_per_sec"] is not None:
+        print_info("Throughput: {} samples/sec".format(lightyellow(throughput["samples_per_sec"])), end="")
+        if throughput["data_wait_fraction"] is not None:
+            print_info(", {} of the step time waiting for data ({} bound)".format(lightyellow("{:.0%}".format(throughput["data_wait_fraction"])),
+                       "input pipeline" if throughput["data_wait_fraction"] > INPUT_BOUND_FRACTION else "model"), end="")
+        print_info(", peak RSS {} MB".format(lightyellow(throughput["peak_rss_mb"])) if throughput["peak_rss_mb"] is not None else "")
+
+# Training checkpoints: every few epochs, the weights, the optimizer state, all the other model variables (e.g. the
+# seed generators of the dropout layers), the epoch and the early stopping state of a training are saved into a
+# checkpoint directory in gen_models, named after the training id and the hash of the training parameters (see
+# compose_training_catalog_params()). -resume continues a killed training from its last checkpoint, as if never
+# interrupted: same splits and shuffling (same seed, see TraindataPipeline.epoch_order()), same batches from then on.
+# The checkpoint directory of a training that ran to its end (or was stopped early) is deleted (see TrainingCheckpoint.remove()).
+CHECKPOINT_STATE = "checkpoint_state.json"
+CHECKPOINTS_KEPT = 2
+
+def compose_checkpoint_fullpath(trainid, params):
+    return os.path.join(Aimx.Paths.GEN_SAVED_MODELS, "checkpoints_" + trainid + "_" + compose_params_hash(params)[:8])
+
+def set_random_seed(seed):
+    """ Seeds python, numpy and TensorFlow, thus the weight initialization and the dropout of the models built next. """
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+def load_checkpoint_state(checkpoint_fullpath):
+    """ :return (dict): State of the training (epoch, seed, early stopping, history) at its last checkpoint. """
+    state_fullpath = os.path.join(checkpoint_fullpath, CHECKPOINT_STATE)
+    if not os.path.exists(state_fullpath):
+        raise FileNotFoundError("No checkpoint to resume from in " + quote(pinkred(checkpoint_fullpath)) + " (was the training run with the same arguments, and not run to its end already?)")
+    with open(state_fullpath, "r") as file:
+        return json.load(file)
+
+class TrainingCheckpoint(tf.keras.callbacks.Callback):
+    """
+    Saves a checkpoint of the training every few epochs (see above), and restores the last one (see restore()). To be
+    given to model.fit() after the early stopping callback, whose state it restores once that one has reset it.
+    """
+    def __init__(self, checkpoint_fullpath, model, seed, every=1, earlystop=None):
+        """
+        :param checkpoint_fullpath (str): Checkpoint directory (see compose_checkpoint_fullpath()).
+        :param        model (keras.Model): Compiled model.
+        :param                 seed (int): Seed of the splits and shuffling (see TraindataPipeline).
+        :param                every (int): Save a checkpoint every that many epochs (and at the end of the training), never if 0.
+        :param earlystop (EarlyStopping): Early stopping callback of the training.
+        """
+        super().__init__()
+        self.checkpoint_fullpath = checkpoint_fullpath
+        self.seed       = seed
+        self.every      = every
+        self.earlystop  = earlystop
+        self.epoch      = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer, variables=list(model.variables), epoch=self.epoch)
+        self.manager    = tf.train.CheckpointManager(self.checkpoint, checkpoint_fullpath, max_to_keep=CHECKPOINTS_KEPT)
+        self.history    = {} # metrics of every epoch since the very beginning of the training
+        self.restored   = None
+
+    def restore(self, epochs):
+        """
+        :param epochs (int): Number of epochs of the training.
+        :return (int): The epoch to resume the training at: that of the last checkpoint, or epochs if early stopping ended the training.
+        """
+        state = load_checkpoint_state(self.checkpoint_fullpath)
+        print_info("|||||| Restoring checkpoint " + quote_path(self.manager.latest_checkpoint) + " of epoch " + str(state["epoch"]) + "... ", end="")
+        self.checkpoint.restore(self.manager.latest_checkpoint).expect_partial() # the optimizer variables are restored once created
+        self.history  = state["history"]
+        self.restored = state
+        print_info("[DONE]")
+        if state["stopped"]:
+            print_info("The training was stopped early at epoch", state["epoch"], "already, there is nothing left to train")
+            return epochs
+        return state["epoch"]
+
+    def on_train_begin(self, logs=None):
+        if self.restored is not None and self.earlystop is not None:
+            self.earlystop.wait = self.restored["earlystop"]["wait"]
+            self.earlystop.best = self.restored["earlystop"]["best"]
+
+    def on_epoch_end(self, epoch, logs=None):
+        for key, value in (logs or {}).items():
+            self.history.setdefault(key, []).append(float(value))
+        if self.every and (epoch + 1) % self.every == 0:
+            self.save(epoch + 1)
+
+    def on_train_end(self, logs=None):
+        if self.every and self.history and int(self.epoch.numpy()) != len(self.history.get("loss", [])):
+            self.save(len(self.history["loss"]))
+
+    def save(self, epoch):
+        self.epoch.assign(epoch)
+        self.manager.save(checkpoint_number=epoch)
+        best = getattr(self.earlystop, "best", None)
+        write_json_atomic(os.path.join(self.checkpoint_fullpath, CHECKPOINT_STATE),
+                          {"epoch":     epoch,
+                           "seed":      self.seed,
+                           "stopped":   bool(getattr(self.earlystop, "stopped_epoch", 0)),
+                           "earlystop": {"wait": getattr(self.earlystop, "wait", 0), "best": float(best) if best is not None else None},
+                           "history":   self.history})
+
+    def remove(self):
+        """ Deletes the checkpoint directory, once the training is over and its checkpoints are of no more use. """
+        if os.path.exists(self.checkpoint_fullpath):
+            shutil.rmtree(self.checkpoint_fullpath)
+
+def load_model_dataset_view(model_path):
+    """ :return (list): The dataset view (labels) a saved model was trained on (see save_model()), or None if unknown. """
+    meta_fullpath = os.path.join(model_path, "assets", PurePath(Aimx.Dataprep.RESULT_METADATA_FULLPATH).name)
+    if not os.path.exists(meta_fullpath):
+        return None
+    with open(meta_fullpath, "r") as file:
+        return json.load(file).get(Aimx.Dataprep.DATASET_VIEW)
+
+def warm_start_model(model, init_model_path):
+    """
+    Initializes a model with the weights of a trained one, layer by layer, wherever the layers match (same type and weight
+    shapes, e.g. same ANN type, width and depth). The output layer keeps its fresh initialization if the dataset view
+    (labels) changed since, as each of its units stands for a label.
+        :param init_model_path (str): Path to the saved model (see save_model()).
+    """
+    print_info("|||||| Loading model " + quote_path(init_model_path) + " to warm-start from... ", end="")
+    source = tf.keras.models.load_model(init_model_path, compile=False)
+    print_info("[DONE]")
+    source_view  = load_model_dataset_view(init_model_path)
+    dataset_view = get_dataprep_result_meta()[Aimx.Dataprep.DATASET_VIEW]
+    layers = list(zip(model.layers, source.layers))
+    if source_view is not None and source_view != dataset_view:
+        print_info("Dataset view changed from", source_view, "to", dataset_view, "since, the output layer is initialized anew")
+        layers = layers[:-1]
+    initialized = 0
+    for layer, source_layer in layers:
+        weights = source_layer.get_weights()
+        if type(layer) is type(source_layer) and [w.shape for w in weights] == [w.shape for w in layer.get_weights()]:
+            layer.set_weights(weights)
+            initialized += bool(weights)
+    print_info("Warm-started {} of the {} layers with weights".format(initialized, sum(1 for layer in model.layers if layer.get_weights())))
+
 def predict(model, x, y):
     """
     Predict a single sample using the trained model
@@ -177,11 +732,71 @@ def save_model(model, trainid):
     print_info("|||||| Copying file", quote_path(Aimx.Dataprep.RESULT_METADATA_FULLPATH), "into model assets... ", end="")
     copy2(Aimx.Dataprep.RESULT_METADATA_FULLPATH, os.path.join(MODEL_FULLPATH, "assets"))
     print_info("[DONE]")
+    # the training result meta of this very run (see save_training_result_meta()), should another run have overwritten the shared one since
     print_info("|||||| Copying file", quote_path(Aimx.Training.RESULT_METADATA_FULLPATH), "into model assets... ", end="")
-    copy2(Aimx.Training.RESULT_METADATA_FULLPATH, os.path.join(MODEL_FULLPATH, "assets"))
+    copy2(compose_run_meta_fullpath(Aimx.Training.RESULT_METADATA_FULLPATH), os.path.join(MODEL_FULLPATH, "assets", PurePath(Aimx.Training.RESULT_METADATA_FULLPATH).name))
     print_info("[DONE]")
     
-def compose_traindata_id(dataset_depth, dataset_view, dataset_path, n_mfcc, n_fft, hop_length, num_segments, sample_rate, load_duration):
+# training arguments that do not affect the model trained, and therefore do not prevent reusing a cataloged model
+TRAINING_NEUTRAL_ARGS = ["verbose", "showplot", "savemodel", "retrain", "example", "aug_workers", "jit", "threads", "metrics_out",
+                         "resume", "checkpoint_every"]
+
+def compose_traindata_fingerprint(traindata_path):
+    """
+    Fingerprint of the contents of a traindata: the size and mtime of its manifest (binary traindata) or of its file (json
+    and h5), both written last whenever dataprep makes the traindata (anew, e.g. with -recompute).
+    """
+    stat = os.stat(os.path.join(traindata_path, TRAINDATA_MANIFEST) if is_binary_traindata(traindata_path) else traindata_path)
+    return "{}_{}".format(stat.st_size, stat.st_mtime_ns)
+
+def compose_training_catalog_params(args, script):
+    """
+    The parameters a model is cataloged with (see utils_catalog): the training arguments, the (absolute) traindata path, the
+    fingerprint of the traindata contents (so that no model trained on what the traindata used to be is reused) and the training script.
+    """
+    params = {arg: str(value) for arg, value in sorted(vars(args).items()) if arg not in TRAINING_NEUTRAL_ARGS}
+    params["traindata_path"]        = os.path.abspath(args.traindata_path)
+    params["traindata_fingerprint"] = compose_traindata_fingerprint(args.traindata_path)
+    params["script"]                = script
+    return params
+
+def reuse_trained_model(params):
+    """
+    Looks a model trained (and saved) with the given parameters up in the artifact catalog. If there is one, it becomes
+    the most recent output (in the training result meta too), so that it is used just as a newly trained one would be.
+        :return (bool): Whether such a model was found.
+    """
+    artifact = find_artifact(Aimx.Catalog.FULLPATH, KIND_MODEL, params)
+    if artifact is None:
+        return False
+    print_info("Reusing model " + quote_path(artifact["path"]) + " trained with the same parameters (use -retrain to train anew)")
+    touch_artifact(Aimx.Catalog.FULLPATH, artifact["path"])
+    save_training_result_meta(PurePath(artifact["path"]).name, timestamp_now(), artifact["info"].get(Aimx.DURATION, ""), model_fullpath = artifact["path"])
+    return True
+
+def catalog_model(trainid, params, traindata_path, training_duration):
+    """ Adds a saved model (see save_model()) to the artifact catalog, under the dataset, view and depth of the traindata it was trained on. """
+    traindata = find_artifact_by_path(Aimx.Catalog.FULLPATH, traindata_path) or {}
+    register_artifact(Aimx.Catalog.FULLPATH, KIND_MODEL, os.path.join(Aimx.Paths.GEN_SAVED_MODELS, "model_" + trainid), params,
+                      traindata.get("dataset"), traindata.get("view"), traindata.get("depth"), source = traindata_path, info = {Aimx.DURATION: training_duration})
+
+def get_traindata_dataprep_params(traindata_path):
+    """
+    The dataprep arguments a traindata was prepared with (as cataloged, i.e. as strings), those of the traindata it was
+    converted from for a converted one (see traindata_tool.py).
+    """
+    traindata = find_artifact_by_path(Aimx.Catalog.FULLPATH, traindata_path)
+    while traindata is not None and "converted_from" in traindata["params"]:
+        traindata = find_artifact_by_path(Aimx.Catalog.FULLPATH, traindata["params"]["converted_from"])
+    if traindata is None:
+        raise ValueError("Traindata " + quote(pinkred(traindata_path)) + " is not in the artifact catalog (or its source no longer is),"
+                         " prepare it anew with dataprep to know its dataprep arguments")
+    return traindata["params"]
+
+def compose_traindata_id(dataset_depth, dataset_view, dataset_path, n_mfcc, n_fft, hop_length, num_segments, sample_rate, load_duration, segment_stride=0,
+                                                                                                                                          features=(Aimx.TrainData.MFCC,),
+                                                                                                                                          n_mels=128,
+                                                                                                                                          feature_dtype="float32"):
     traindata_id =  str(len(dataset_view)) + "v_"
     traindata_id += str(dataset_depth)     + "d_"
     traindata_id += PurePath(dataset_path).name # the traindata file name
@@ -191,28 +806,140 @@ def compose_traindata_id(dataset_depth, dataset_view, dataset_path, n_mfcc, n_ff
                  +  "_" + str(num_segments)  + "i" \
                  +  "_" + str(sample_rate)   + "r" \
                  +  "_" + str(load_duration) + "s"
+    if segment_stride: # only present when segments are not laid out back to back
+        traindata_id += "_" + str(segment_stride) + "t"
+    if n_mels != 128: # only present when not the librosa default
+        traindata_id += "_" + str(n_mels) + "b"
+    if list(features) != [Aimx.TrainData.MFCC]: # only present when not just the MFCCs
+        traindata_id += "_" + "-".join(features)
+    if feature_dtype != "float32": # only present when the features are quantized
+        traindata_id += "_" + feature_dtype
     return traindata_id
 
-def save_traindata(traindata, traindata_filename):
+def compose_dataset_index_path(dataset_path):
+    # one index per dataset, told apart by the absolute dataset path (datasets of the same name may live in different places)
+    path_hash = hashlib.sha1(os.path.abspath(dataset_path).encode()).hexdigest()[:8]
+    return os.path.join(Aimx.Paths.GEN_CACHE, "dataset_index", PurePath(dataset_path).name + "_" + path_hash + ".json")
+
+def compose_pcm_store_path(dataset_path, sample_rate, load_duration, dtype="float32", fast_wav=False):
+    # one store per dataset and decoding parameters, as the decoders (librosa or the fast native one) differ slightly in resampling
+    path_hash = hashlib.sha1(os.path.abspath(dataset_path).encode()).hexdigest()[:8]
+    store_id  = "{}_{}_{}r_{}s_{}".format(PurePath(dataset_path).name, path_hash, sample_rate, load_duration, dtype)
+    return os.path.join(Aimx.Paths.GEN_CACHE, "pcm_store", store_id + ("_fastwav" if fast_wav else ""))
+
+def get_dataset_index(dataset_path):
+    """
+    Loads the index of a dataset, building (and saving) it first if the dataset has not been indexed yet, or
+    refreshing it if files were added, removed or renamed since (only the new or changed files are read then).
+    """
+    index_path = compose_dataset_index_path(dataset_path)
+    index = load_dataset_index(index_path)
+    if index is None:
+        print_info("|||||| Indexing dataset", quote_path(dataset_path), "... ", end="")
+        index, _ = build_dataset_index(dataset_path)
+        print_info("[DONE]")
+        save_dataset_index(index, index_path)
+    elif index_is_stale(index, dataset_path):
+        print_info("|||||| Dataset", quote_path(dataset_path), "changed since it was indexed, refreshing its index ... ", end="")
+        index, num_indexed = build_dataset_index(dataset_path, index)
+        print_info("[DONE] ({} files read)".format(num_indexed))
+        save_dataset_index(index, index_path)
+    return index
+
+def list_dataset_afentries(dataset_path, dataset_view, dataset_depth, use_index=False):
+    """
+    Lists the audio files dataprep processes label by label, along with their index entries: from the dataset index with
+    use_index (see get_dataset_index()), else walking the dataset, the entries then only having the size and mtime of the files.
+        :return (list): Pairs of (label name, list of (audio file path, index entry) pairs for that label).
+    """
+    if use_index:
+        return list_indexed_audiofiles(get_dataset_index(dataset_path), dataset_view, dataset_depth)
+    return stat_audiofiles(list_dataset_audiofiles(dataset_path, dataset_view, dataset_depth))
+
+def compose_traindata_filename(traindata_id, traindata_format):
+    # binary traindata are directories named after the traindata id
+    if traindata_format == Aimx.TrainData.FORMAT_JSON:
+        return traindata_id + ".json"
+    if traindata_format == Aimx.TrainData.FORMAT_HDF5:
+        return traindata_id + TRAINDATA_H5_EXT
+    return traindata_id
+
+def open_traindata_writer(traindata_filename, shard_size=0, journal_key=None, resume=False, array_dtypes=Aimx.TrainData.ARRAY_DTYPES, h5_compression=None,
+                                                                                                                                      feature_dtype="float32"):
+    """
+    Opens the writer into which dataprep streams the array sections (MFCCs and labels) of a traindata as they are
+    extracted. Samples are written to disk one shard at a time (json traindata are only assembled on close()).
+        :param traindata_filename  (str): Name of the traindata (see compose_traindata_filename()) in GEN_TRAINDATA.
+        :param         shard_size  (int): Minimum number of samples per shard (0 = only on explicit flush() calls).
+        :param        journal_key (dict): Whatever determines the traindata contents, or None to keep no journal.
+        :param             resume (bool): Resume an interrupted run with the same journal key, if any.
+        :param       array_dtypes (dict): dtypes of the array sections (see Aimx.TrainData.array_dtypes()).
+        :param     h5_compression  (str): Compression of the array datasets of HDF5 traindata (see H5_COMPRESSIONS).
+        :param      feature_dtype  (str): dtype to store the feature sections in (see FEATURE_DTYPES), quantized on close().
+    """
     Path(Aimx.Paths.GEN_TRAINDATA).mkdir(parents=True, exist_ok=True)
     GEN_TRAINDATA_FULLPATH = os.path.join(Aimx.Paths.GEN_TRAINDATA, traindata_filename)
-    with open(GEN_TRAINDATA_FULLPATH, "w") as data_file:
-        print_info("|||||| Writing file", quote_path(GEN_TRAINDATA_FULLPATH), "... ", end="")
-        json.dump(traindata, data_file, indent=4)
-        print_info("[DONE]")
+    quantize = {key: feature_dtype for key in array_dtypes if key != Aimx.TrainData.LABELS}
+    if extract_fileext(traindata_filename) == ".json":
+        return JsonTraindataWriter(GEN_TRAINDATA_FULLPATH, array_dtypes, shard_size, journal_key, resume, quantize)
+    if extract_fileext(traindata_filename) == TRAINDATA_H5_EXT:
+        return Hdf5TraindataWriter(GEN_TRAINDATA_FULLPATH, array_dtypes, shard_size, journal_key, resume, quantize, h5_compression, Aimx.TrainData.FILES)
+    return BinaryTraindataWriter(GEN_TRAINDATA_FULLPATH, array_dtypes, shard_size, journal_key, resume, quantize)
+
+def save_traindata(traindata, traindata_filename):
+    """ Saves a whole, in-memory traindata at once. """
+    writer = open_traindata_writer(traindata_filename)
+    for mfcc, label in zip(traindata[Aimx.TrainData.MFCC], traindata[Aimx.TrainData.LABELS]):
+        writer.append({Aimx.TrainData.MFCC: mfcc, Aimx.TrainData.LABELS: label})
+    writer.close(traindata)
 
 # This function may be necessary for test pipeline automation, e.g. in scenarios when
 # running multiple NNs, each requiring its own traindata. This function can in such
 # cases be used to switch quickly by updating dataprep_result_meta.json contents correspondingly.
 def update_dataprep_result_meta(traindata_filename, key, value):
-    with open(Aimx.Dataprep.RESULT_METADATA_FULLPATH, "r") as file:
-        print_info("|||||| Loading file " + quote_path(Aimx.Dataprep.RESULT_METADATA_FULLPATH) + "... ", end="")
-        prep_result_meta = json.load(file)
+    # locked from reading to writing, so that no other run's update gets lost in between
+    with file_lock(Aimx.Dataprep.RESULT_METADATA_FULLPATH):
+        prep_result_meta = dict(get_dataprep_result_meta())
+        prep_result_meta[key] = value
+        print_info("|||||| Writing file", quote_path(Aimx.Dataprep.RESULT_METADATA_FULLPATH), "... ", end="")
+        write_json_atomic(Aimx.Dataprep.RESULT_METADATA_FULLPATH, prep_result_meta)
         print_info("[DONE]")
-    prep_result_meta[key] = value
-    with open(Aimx.Dataprep.RESULT_METADATA_FULLPATH, 'w') as file:
+
+def repoint_dataprep_result_meta(traindata_fullpath, replaced_fullpath, dataset_view, traindata_format):
+    """
+    Points dataprep_result_meta.json at a traindata converted into another format (see traindata_tool.py): it becomes the
+    most recent output, in place of the traindata it was converted from among the traindata outputs. If there is no
+    dataprep result meta yet, one is created for the converted traindata alone. The converted traindata is cataloged
+    with the parameters of the traindata it was converted from (but its format), so that dataprep can reuse it too.
+        :param traindata_fullpath (str): Path to the converted traindata.
+        :param  replaced_fullpath (str): Path to the traindata it was converted from.
+        :param      dataset_view (list): Labels of the traindata (its mapping), should the meta have to be created.
+        :param   traindata_format (str): Format of the converted traindata (see Aimx.TrainData.FORMATS).
+    """
+    source = find_artifact_by_path(Aimx.Catalog.FULLPATH, replaced_fullpath)
+    if source is not None:
+        register_artifact(Aimx.Catalog.FULLPATH, KIND_TRAINDATA, traindata_fullpath, {**source["params"], "traindata_format": traindata_format},
+                          source["dataset"], source["view"], source["depth"], info = source["info"])
+    else:
+        register_artifact(Aimx.Catalog.FULLPATH, KIND_TRAINDATA, traindata_fullpath, {"converted_from": os.path.abspath(replaced_fullpath)},
+                          info = {Aimx.TrainData.MAPPING: dataset_view})
+
+    # locked from reading to writing, so that no other run's update gets lost in between
+    with file_lock(Aimx.Dataprep.RESULT_METADATA_FULLPATH):
+        if os.path.exists(Aimx.Dataprep.RESULT_METADATA_FULLPATH):
+            meta = dict(get_dataprep_result_meta())
+        else:
+            meta = { Aimx.Dataprep.DATASET_VIEW: dataset_view, Aimx.Dataprep.TOTAL_AUDIOS_LENGTH: 0, Aimx.TIMESTAMP: timestamp_now(), Aimx.DURATION: "" }
+        outputs = [os.path.abspath(output) for output in meta.get(Aimx.Dataprep.TRAINDATA_OUTPUTS, [])]
+        if os.path.abspath(replaced_fullpath) in outputs:
+            outputs[outputs.index(os.path.abspath(replaced_fullpath))] = traindata_fullpath
+        elif traindata_fullpath not in outputs:
+            outputs.append(traindata_fullpath)
+        meta[Aimx.MOST_RECENT_OUTPUT]          = traindata_fullpath
+        meta[Aimx.Dataprep.TRAINDATA_MANIFEST] = os.path.join(traindata_fullpath, TRAINDATA_MANIFEST) if is_binary_traindata(traindata_fullpath) else ""
+        meta[Aimx.Dataprep.TRAINDATA_OUTPUTS]  = outputs
         print_info("|||||| Writing file", quote_path(Aimx.Dataprep.RESULT_METADATA_FULLPATH), "... ", end="")
-        json.dump(prep_result_meta, file, indent=4)
+        write_json_atomic(Aimx.Dataprep.RESULT_METADATA_FULLPATH, meta)
         print_info("[DONE]")
 
 def plot_history(history, trainid, show_interactive):
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import tensorflow.keras as keras
+import numpy as np
+import os
+
+from Audex.utils.utils_common   import *
+from Audex.utils.utils_features import *
+from Audex.utils.utils_wavio    import load_audio
+
+class WaveAugmenter:
+    """
+    Random waveform augmentations of a whole (batch, samples) array of equally long clips: time shift and
+    speed perturbation (done together, as a single linearly interpolated resampling of each clip), gain, and
+    background noise mixed in at a random signal-to-noise ratio (both vectorized across the batch). Each clip
+    gets its own random shift, speed, gain and noise, so no two epochs see quite the same training audio.
+    """
+    def __init__(self, sample_rate, shift_ms=100, speed=0.1, gain_db=6, noise_snr_db=10, noise=None):
+        """
+        :param  sample_rate   (int): Sample rate of the clips.
+        :param     shift_ms (float): Maximum time shift (either way) in milliseconds.
+        :param        speed (float): Maximum relative speed change, e.g. 0.1 for speeds between 0.9 and 1.1.
+        :param      gain_db (float): Maximum gain change (either way) in dB.
+        :param noise_snr_db (float): Lowest signal-to-noise ratio of the mixed in noise, the highest is 30 dB above it.
+        :param      noise (ndarray): Background noise signal(s) concatenated into one 1d array, or None for white noise.
+        """
+        self.max_shift    = int(sample_rate * shift_ms / 1000)
+        self.speed        = speed
+        self.gain_db      = gain_db
+        self.noise_snr_db = noise_snr_db
+        self.noise        = noise
+
+    def shift_and_speed(self, clips, rng):
+        batch, length = clips.shape
+        shifts = rng.integers(-self.max_shift, self.max_shift + 1, size=batch)
+        speeds = rng.uniform(1 - self.speed, 1 + self.speed, size=batch)
+        # output sample t of each clip is read at (fractional) position (t - shift) * speed of the original clip,
+        # silence where shifted/sped out of the clip. One np.interp() pass per clip is faster than a batched gather,
+        # which needs several (batch, samples) sized temporaries of indices and interpolation weights.
+        grid    = np.arange(length)
+        shifted = np.empty_like(clips)
+        for i in range(batch):
+            shifted[i] = np.interp((grid - shifts[i]) * speeds[i], grid, clips[i], left=0, right=0)
+        return shifted
+
+    def gain(self, clips, rng):
+        return clips * (10 ** (rng.uniform(-self.gain_db, self.gain_db, size=(len(clips), 1)) / 20)).astype(np.float32)
+
+    def add_noise(self, clips, rng):
+        batch, length = clips.shape
+        if self.noise is None:
+            noise = rng.standard_normal((batch, length), dtype=np.float32)
+        else:
+            starts = rng.integers(0, len(self.noise) - length + 1, size=(batch, 1))
+            noise  = self.noise[starts + np.arange(length)] # a random excerpt of the background noise for each clip
+        snr_db      = rng.uniform(self.noise_snr_db, self.noise_snr_db + 30, size=(batch, 1))
+        signal_rms  = np.sqrt(np.mean(np.square(clips), axis=1, keepdims=True))
+        noise_rms   = np.sqrt(np.mean(np.square(noise), axis=1, keepdims=True)) + 1e-10
+        noise_scale = (signal_rms / noise_rms / 10 ** (snr_db / 20)).astype(np.float32)
+        return clips + noise * noise_scale
+
+    def augment(self, clips, rng):
+        """
+            :param clips (ndarray): float32 clips of shape (batch, samples), left unchanged.
+            :param   rng (Generator): Source of randomness (numpy.random.Generator).
+            :return (ndarray): Augmented clips of the same shape.
+        """
+        return self.add_noise(self.gain(self.shift_and_speed(clips, rng), rng), rng)
+
+class AugmentedSequence(keras.utils.Sequence):
+    """
+    Training batches made on the fly from raw clips: every batch is freshly augmented (see WaveAugmenter) and
+    turned into features (MFCCs by default) with the vectorized MFCC engine. Given to model.fit() with workers > 0, batches are
+    prepared in background threads while the model trains on the previous ones (numpy releases the GIL in the
+    heavy lifting, i.e. the FFT and the matrix multiplications).
+    """
+    def __init__(self, clips, labels, batch_size, augmenter, engine, add_channel=False, seed=0, feature=FEATURE_MFCC):
+        """
+        :param        clips       (ndarray): float32 clips of shape (# samples, clip length).
+        :param       labels       (ndarray): Label of each clip.
+        :param   batch_size           (int): Batch size.
+        :param    augmenter (WaveAugmenter): Augmentations to apply.
+        :param       engine    (MfccEngine): Engine to extract the features with, same parameters as in dataprep.
+        :param  add_channel          (bool): Add a trailing channel axis to the features (as CNNs expect).
+        :param         seed           (int): Seed of the (per batch and epoch) random augmentations.
+        :param      feature           (str): Feature type to extract (see FEATURE_TYPES).
+        """
+        self.clips       = clips
+        self.labels      = labels
+        self.batch_size  = batch_size
+        self.augmenter   = augmenter
+        self.engine      = engine
+        self.add_channel = add_channel
+        self.seed        = seed
+        self.feature     = feature
+        self.epoch       = 0
+        self.order       = np.random.default_rng([seed, self.epoch]).permutation(len(clips))
+
+    def __len__(self):
+        return int(np.ceil(len(self.clips) / self.batch_size))
+
+    def __getitem__(self, index):
+        # a generator of its own for every batch keeps batches reproducible no matter which thread makes them
+        rng   = np.random.default_rng([self.seed, self.epoch, index])
+        batch = self.order[index * self.batch_size : (index + 1) * self.batch_size]
+        x     = self.engine.features(self.augmenter.augment(self.clips[batch], rng), [self.feature])[self.feature]
+        return (x[..., np.newaxis] if self.add_channel else x), self.labels[batch]
+
+    def on_epoch_end(self):
+        self.set_epoch(self.epoch + 1)
+
+    def set_epoch(self, epoch):
+        """ Makes the batches those of the epoch (e.g. of a resumed training, see TrainingCheckpoint). """
+        self.epoch = epoch
+        self.order = np.random.default_rng([self.seed, self.epoch]).permutation(len(self.clips))
+
+def load_clips(af_paths, sample_rate, fast_wav=False):
+    """
+    Loads the first second of each audio file, the same way dataprep_asr does before extracting MFCCs.
+        :param fast_wav (bool): Decode WAV files with the fast native decoder instead of librosa, as dataprep did (see its -fast_wav).
+        :return (ndarray): float32 clips of shape (# files, sample_rate).
+    """
+    clips = np.zeros((len(af_paths), sample_rate), dtype=np.float32)
+    for i, af_path in enumerate(af_paths):
+        progress_bar(i, len(af_paths))
+        signal = load_audio(af_path, sr = sample_rate, duration = 1, fast_wav = fast_wav)[0][:sample_rate]
+        clips[i, :len(signal)] = signal
+    print()
+    return clips
+
+def load_noise(noise_path, sample_rate):
+    """
+    Loads all the .wav files in a directory (e.g. _background_noise_ in speech commands datasets) into one long signal.
+    """
+    af_paths = [os.path.join(noise_path, afname) for afname in sorted(os.listdir(noise_path)) if afname.endswith(".wav")]
+    noise    = np.concatenate([load_audio(af_path, sr = sample_rate, fast_wav = True)[0] for af_path in af_paths] or [np.zeros(0, np.float32)])
+    if len(noise) < sample_rate:
+        raise ValueError("Less than 1 second of background noise found in " + quote(noise_path))
+    return noise
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import hashlib
+import sqlite3
+import json
+import os
+
+from Audex.utils.utils_common import *
+
+# Artifact catalog: an SQLite database of all the traindata and models produced in a workdir, along with the parameters
+# each one was produced with (the dataprep or training arguments that determine its contents), indexed by dataset, view,
+# depth and a hash of those parameters. Dataprep and training look their parameters up in it before doing any work,
+# and reuse the artifact found rather than recompute it. Every artifact produced or reused becomes the most recent
+# one of its kind, which is what "most_recent_output" stands for.
+KIND_TRAINDATA = "traindata"
+KIND_MODEL     = "model"
+
+CATALOG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS artifacts (
+        id          INTEGER PRIMARY KEY,
+        kind        TEXT    NOT NULL,
+        path        TEXT    NOT NULL UNIQUE,
+        dataset     TEXT,
+        view        TEXT,
+        depth       INTEGER,
+        params      TEXT    NOT NULL,
+        params_hash TEXT    NOT NULL,
+        source      TEXT,
+        info        TEXT,
+        created     TEXT    NOT NULL,
+        recency     INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS artifacts_lookup  ON artifacts (kind, dataset, view, depth, params_hash);
+    CREATE INDEX IF NOT EXISTS artifacts_recency ON artifacts (kind, recency);
+"""
+CATALOG_TIMEOUT_SEC = 60 # how long to wait for another process to finish writing the catalog
+
+def open_catalog(catalog_path):
+    Path(os.path.dirname(catalog_path)).mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(catalog_path, timeout=CATALOG_TIMEOUT_SEC)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(CATALOG_SCHEMA)
+    return connection
+
+def compose_params_hash(params):
+    """ :return (str): Hash of the (JSON-serializable) parameters, the same whatever the order of their keys. """
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+def register_artifact(catalog_path, kind, path, params, dataset=None, view=None, depth=None, source=None, info=None):
+    """
+    Adds an artifact to the catalog (replacing any previous entry of the same path) as the most recent one of its kind.
+        :param   kind  (str): KIND_TRAINDATA or KIND_MODEL.
+        :param   path  (str): Path to the artifact (traindata or saved model).
+        :param params (dict): Parameters that determine the contents of the artifact (see find_artifact()).
+        :param dataset (str): Path to the dataset the artifact was made from.
+        :param    view (list): Labels (dataset view) of the artifact.
+        :param   depth  (int): Number of audio files per label.
+        :param  source  (str): Path to the traindata a model was trained on.
+        :param    info (dict): Anything else worth keeping along (e.g. the traindata mapping).
+    """
+    with open_catalog(catalog_path) as connection:
+        connection.execute("INSERT OR REPLACE INTO artifacts (kind, path, dataset, view, depth, params, params_hash, source, info, created, recency)"
+                           " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(recency), 0) + 1 FROM artifacts))",
+                           (kind, os.path.abspath(path), os.path.abspath(dataset) if dataset else None, json.dumps(view) if view is not None else None,
+                            depth, json.dumps(params, sort_keys=True), compose_params_hash(params), os.path.abspath(source) if source else None,
+                            json.dumps(info or {}), timestamp_now()))
+    connection.close()
+
+def touch_artifact(catalog_path, path):
+    """ Makes an (already cataloged) artifact the most recent one of its kind, e.g. when reused. """
+    with open_catalog(catalog_path) as connection:
+        connection.execute("UPDATE artifacts SET recency = (SELECT COALESCE(MAX(recency), 0) + 1 FROM artifacts) WHERE path = ?", (os.path.abspath(path),))
+    connection.close()
+
+def select_artifacts(catalog_path, where, values):
+    """
+    :return (list): The cataloged artifacts (as dicts) matching the SQL condition, most recent first. Those no longer on disk
+                    are dropped from the catalog along the way.
+    """
+    if not os.path.exists(catalog_path):
+        return []
+    with open_catalog(catalog_path) as connection:
+        rows    = connection.execute("SELECT * FROM artifacts WHERE " + where + " ORDER BY recency DESC", values).fetchall()
+        missing = [row["path"] for row in rows if not os.path.exists(row["path"])]
+        if missing:
+            connection.executemany("DELETE FROM artifacts WHERE path = ?", [(path,) for path in missing])
+    connection.close()
+    artifacts = []
+    for row in rows:
+        if row["path"] not in missing:
+            artifact = dict(row)
+            artifact["params"] = json.loads(artifact["params"])
+            artifact["view"]   = json.loads(artifact["view"]) if artifact["view"] is not None else None
+            artifact["info"]   = json.loads(artifact["info"]) if artifact["info"] is not None else {}
+            artifacts.append(artifact)
+    return artifacts
+
+def find_artifact(catalog_path, kind, params, dataset=None, view=None, depth=None):
+    """
+    Looks up an artifact produced with the given parameters (and of the given dataset, view and depth, if given).
+        :return (dict): The most recent such artifact (its path, params, info, etc.), or None if there is none.
+    """
+    where  = "kind = ? AND params_hash = ?"
+    values = [kind, compose_params_hash(params)]
+    for column, value in (("dataset", os.path.abspath(dataset) if dataset else None), ("view", json.dumps(view) if view is not None else None), ("depth", depth)):
+        if value is not None:
+            where += " AND " + column + " = ?"
+            values.append(value)
+    artifacts = select_artifacts(catalog_path, where, values)
+    return artifacts[0] if artifacts else None
+
+def find_artifact_by_path(catalog_path, path):
+    artifacts = select_artifacts(catalog_path, "path = ?", [os.path.abspath(path)])
+    return artifacts[0] if artifacts else None
+
+def most_recent_artifact(catalog_path, kind, name=None):
+    """
+    :param name (str): Only the artifacts of this (file or directory) name, e.g. a traindata id or "model_" + a training id.
+    :return (dict): The most recent artifact of the kind (and name), or None if there is none.
+    """
+    where, values = "kind = ?", [kind]
+    if name is not None:
+        where += " AND (path = ? OR path LIKE ?)"
+        values += [name, "%" + os.sep + name]
+    artifacts = select_artifacts(catalog_path, where, values)
+    return artifacts[0] if artifacts else None
@@ -5,12 +5,20 @@ from colorama  import init
 from pathlib   import Path
 from pathlib   import PurePath
 from datetime  import datetime
+from contextlib import contextmanager
+import tempfile
 import pprint
 import json
 import glob
 import sys
 import os
 
+try:
+    import fcntl # advisory file locks on POSIX
+except ImportError:
+    fcntl = None
+    import msvcrt # and on Windows
+
 # On Windows, calling init() will filter ANSI escape sequences out of any text
 # On other platforms, calling init() has no effect
 init() # colorama
@@ -165,6 +173,81 @@ def print_info(s, *args, verbose = True, **kwargs):
 def deprint(s):
     print(pinkred(s))
 
+@contextmanager
+def file_lock(path):
+    """
+    Holds an advisory exclusive lock on a file for the duration of a with block, so that processes sharing a workdir
+    (e.g. parallel dataprep or training jobs) take turns at read-modify-writing it. The lock is taken on a side
+    ".lock" file, as the file itself gets replaced (see write_json_atomic()) while locked.
+    """
+    lock_path = str(path) + ".lock"
+    Path(lock_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a+") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX) # blocks until the other process is done
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1) # retries for 10 sec, then raises
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+# mode new files get, as open() creates them (temporary files made by mkstemp() are only readable by their owner)
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+@contextmanager
+def atomic_path(fullpath):
+    """
+    A temporary file next to fullpath to write into (e.g. by path, as h5py does), renamed over fullpath once the with block
+    is done with it: readers (even in other processes) thus always see either the previous or the new contents in full,
+    never a half-written file. The file keeps the mode of the file it replaces, or gets the one open() would give a new file,
+    so that others sharing the workdir can read it. If the with block fails, the temporary file is removed and nothing replaced.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fullpath)), suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.chmod(tmp_path, os.stat(fullpath).st_mode & 0o7777 if os.path.exists(fullpath) else 0o666 & ~UMASK)
+        os.replace(tmp_path, fullpath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@contextmanager
+def atomic_file(fullpath, mode="w"):
+    """ Opens a file to write into (in the given mode) that only replaces fullpath once written in full (see atomic_path()). """
+    with atomic_path(fullpath) as tmp_path:
+        with open(tmp_path, mode) as file:
+            yield file
+
+def write_json_atomic(json_fullpath, objson, indent=4):
+    """ Writes a json file atomically (see atomic_path()), creating its directory if need be. """
+    Path(json_fullpath).parent.mkdir(parents=True, exist_ok=True)
+    with atomic_file(json_fullpath) as file:
+        json.dump(objson, file, indent=indent)
+
+def read_json_cached(json_fullpath, cache_holder):
+    """
+    Loads a json file, or returns its contents as cached (in an attribute of cache_holder) since the last time it was loaded,
+    if the file has not changed since. Files replaced by write_json_atomic() (by this or another process) are loaded anew.
+    """
+    stat = os.stat(json_fullpath)
+    key  = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if getattr(cache_holder, "cached_key", None) != key:
+        with open(json_fullpath, "r") as file:
+            print_info("|||||| Loading file  " + quote_path(json_fullpath) + "... ", end="")
+            cache_holder.cached = json.load(file)
+            print_info("[DONE]")
+        cache_holder.cached_key = key
+    return cache_holder.cached
+
 ################################ PROTOTYPE / UNTESTED / NON-PRODUCTION FUNCTIONS BELOW THIS LINE
 ################################ May likely be useful in the future.
 
@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+
+from functools import partial
+from itertools import islice
+from itertools import product
+from pathlib   import PurePath
+from pathlib   import Path
+import multiprocessing
+import hashlib
+import librosa
+import pickle
+import math
+import os
+
+from Audex.utils.utils_common    import *
+from Audex.utils.utils_features  import *
+from Audex.utils.utils_wavio     import load_audio
+from Audex.utils.utils_pcm_store import *
+
+# NOTE: Everything that runs inside dataprep worker processes lives in this module (rather than
+# in the dataprep scripts themselves) so that workers only need to import this lightweight module.
+# Where worker processes are spawned (Windows) they still re-import the main module, which is why
+# the dataprep scripts parse their command line and do their work under if __name__ == "__main__".
+
+def resolve_workers(workers):
+    """
+    Translates the -workers command line value into an actual number of worker processes.
+        :param workers (int): Requested number of workers, 0 (or less) meaning "all available cores".
+    """
+    return workers if workers > 0 else os.cpu_count()
+
+def list_dataset_audiofiles(dataset_path, dataset_view, dataset_depth):
+    """
+    Walks the dataset and lists the audio files to be processed label by label,
+    in exactly the same order in which dataprep has always been visiting them.
+        :param  dataset_path (str): Path to dataset.
+        :param dataset_view (list): Specific directories (labels) to go through.
+        :param dataset_depth (int): Number of files to consider from each category.
+        :return (list): Pairs of (label name, list of audio file paths to process for that label).
+    """
+    label_afpaths = []
+
+    # loop through all subfolders
+    for dirpath, _, afnames in os.walk(dataset_path):
+
+        # ensure we're processing at subfolder level
+        if PurePath(dirpath).name is PurePath(dataset_path).name:
+            continue
+
+        # process only those dir-labels that are in the requested view
+        if extract_filename(dirpath) not in dataset_view:
+            continue
+
+        af_paths = [os.path.join(dirpath, afname) for afname in islice(afnames, dataset_depth) if afname.endswith(".wav")]
+        label_afpaths.append((PurePath(dirpath).name, af_paths))
+
+    return label_afpaths
+
+def imap_audiofiles(extract, af_paths, workers=1, batch_size=32):
+    """
+    Applies extract() to batches of audio files, fanning the batches out to a pool of worker processes
+    when more than one worker is requested. Results are streamed back one per file, in the order of af_paths.
+        :param  extract (callable): Module-level (picklable) function taking a list of audio file paths
+                                    and returning a list with one result per file.
+        :param    af_paths (list): Paths to the audio files to process.
+        :param       workers (int): Number of worker processes.
+        :param    batch_size (int): Maximum number of audio files handed to extract() at once.
+    """
+    if workers > 1:
+        # small enough batches to keep all workers busy
+        batch_size = max(1, min(batch_size, len(af_paths) // (workers * 4)))
+
+    batches = [af_paths[i:i + batch_size] for i in range(0, len(af_paths), batch_size)]
+
+    if workers == 1 or len(batches) < 2:
+        for batch in batches:
+            yield from extract(batch)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        for results in pool.imap(extract, batches):
+            yield from results
+
+# Version of the feature extraction, part of every feature cache key. Bump it whenever a change to the
+# extraction code (here or in utils_features) changes the features it yields, so that no stale entries are hit.
+FEATURE_EXTRACTION_VERSION = 2
+
+class FeatureCache:
+    """
+    On-disk cache of per-file extraction results. An entry is keyed by the identity of the audio file
+    (path + size + mtime), by the extraction function along with all its parameters and by the extraction
+    version (see FEATURE_EXTRACTION_VERSION), so that changing anything that would change the features
+    (n_mfcc, n_fft, hop_length, sample_rate, load_duration, the extraction code etc.) results in a miss.
+    Once the cache grows over its size cap, least recently used entries are evicted. A cache with a zero size cap is disabled: it never hits and never stores anything.
+    """
+    def __init__(self, cache_dir, size_cap_mb):
+        self.cache_dir = cache_dir
+        self.size_cap  = size_cap_mb * 1024 * 1024
+        self.size      = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evicted   = 0
+
+    def enabled(self):
+        return self.size_cap > 0
+
+    def key(self, af_path, extract):
+        af_stat = os.stat(af_path)
+        params  = sorted(extract.keywords.items()) # extract is a functools.partial binding all extraction parameters
+        identity = repr((os.path.abspath(af_path), af_stat.st_size, af_stat.st_mtime_ns, extract.func.__name__, params, FEATURE_EXTRACTION_VERSION))
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def load(self, key):
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path, "rb") as entry:
+                result = pickle.load(entry)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(entry_path) # mark as most recently used
+        return result
+
+    def store(self, key, result):
+        entry_path = self.entry_path(key)
+        Path(entry_path).parent.mkdir(parents=True, exist_ok=True)
+        # written atomically, so that concurrent workers and interrupted runs never leave a partial entry behind
+        with atomic_file(entry_path, "wb") as entry:
+            pickle.dump(result, entry, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def count(self, hit):
+        if hit:
+            self.hits   += 1
+        else:
+            self.misses += 1
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits into its size cap.
+        """
+        entries = []
+        for subdir in os.scandir(self.cache_dir) if os.path.exists(self.cache_dir) else []:
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".pkl"):
+                    entry_stat = entry.stat()
+                    entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries): # least recently used first
+            if self.size <= self.size_cap:
+                break
+            os.remove(entry_path)
+            self.size    -= size
+            self.evicted += 1
+
+    def print_stats(self):
+        lookups = max(self.hits + self.misses, 1)
+        print_info("Feature cache {}: {} hits, {} misses ({} hit rate), {} entries evicted, {:.1f} Mb in use".format(quote_path(self.cache_dir),
+                                                                                                                  self.hits,
+                                                                                                                  self.misses,
+                                                                                                                  lightyellow("{:.0%}".format(self.hits / lookups)),
+                                                                                                                  self.evicted,
+                                                                                                                  self.size / 1024 / 1024))
+
+def extract_cached(af_paths, extract, cache):
+    """
+    Runs extract() on those audio files whose results are not yet in the feature cache.
+        :return (list): Pairs of (whether the result came from the cache, whatever extract() returns for the file).
+    """
+    if not cache.enabled():
+        return [(False, result) for result in extract(af_paths)]
+
+    keys    = [cache.key(af_path, extract) for af_path in af_paths]
+    results = [cache.load(key) for key in keys]
+    misses  = [i for i, result in enumerate(results) if result is None]
+
+    if misses:
+        for i, result in zip(misses, extract([af_paths[i] for i in misses])):
+            cache.store(keys[i], result)
+            results[i] = result
+
+    return [(i not in misses, result) for i, result in enumerate(results)]
+
+def decode_audiofiles(af_paths, sample_rate, load_duration, fast_wav=False):
+    """ :return (list): The decoded (and resampled) float32 signal of each audio file. """
+    return [load_audio(af_path, sr = sample_rate, duration = load_duration, fast_wav = fast_wav)[0] for af_path in af_paths]
+
+def update_pcm_store(store_dir, dataset_path, label_afpaths, sample_rate, load_duration, fast_wav=False, dtype="float32", workers=1):
+    """
+    Makes sure the PCM store holds the decoded signals of all the given audio files. Only the files not in the store yet
+    (or changed since) are decoded, and the labels they belong to are rewritten with their other signals copied over.
+        :param label_afpaths (list): Pairs of (label name, list of audio file paths of that label), as listed by dataprep.
+        :return (tuple): Number of audio files decoded and number of those taken from the store as they were.
+    """
+    store   = open_pcm_store(store_dir)
+    missing = [af_path for _, af_paths in label_afpaths for af_path in af_paths if store.lookup(af_path) is None]
+    if not missing:
+        return 0, len([af_path for _, af_paths in label_afpaths for af_path in af_paths])
+
+    print_info("|||||| Decoding {} audio files into PCM store".format(len(missing)), quote_path(store_dir))
+    writer  = PcmStoreWriter(store_dir, dtype, dataset_path = os.path.abspath(dataset_path), sample_rate = sample_rate,
+                                               load_duration = load_duration, fast_wav = fast_wav)
+    decoded = imap_audiofiles(partial(decode_audiofiles, sample_rate = sample_rate, load_duration = load_duration, fast_wav = fast_wav),
+                              missing, workers)
+    num_reused = 0
+
+    for label, af_paths in label_afpaths:
+        label_missing = [af_path for af_path in af_paths if store.lookup(af_path) is None]
+        num_reused   += len(af_paths) - len(label_missing)
+        if not label_missing:
+            continue
+        writer.begin_label(label)
+        # the signals already stored for this label (and still up to date) are kept, followed by the newly decoded ones
+        for entry in store.labels.get(label, {}).get(PCM_STORE_FILES, []):
+            af_path = os.path.join(os.path.dirname(af_paths[0]), entry[ENTRY_NAME])
+            found   = store.lookup(af_path) if os.path.exists(af_path) else None
+            if found is not None:
+                writer.append(af_path, store.stored(*found))
+        for af_path in label_missing:
+            progress_bar(af_paths.index(af_path), len(af_paths))
+            writer.append(af_path, next(decoded))
+        store.arrays.pop(label, None) # unmap the previous label array before it gets replaced
+        writer.end_label()
+
+    print()
+    writer.close()
+    return len(missing), num_reused
+
+# dataprep arguments that do not affect the traindata contents, and therefore do not prevent resuming an interrupted run
+RESUME_NEUTRAL_ARGS = ["workers", "feature_cache_mb", "restart", "recompute", "verbose", "example", "h5_compression"]
+
+# dataprep arguments that do not affect the traindata contents, and therefore do not prevent reusing a cataloged traindata either
+CATALOG_NEUTRAL_ARGS = RESUME_NEUTRAL_ARGS + ["shard_size"]
+
+# state of a dataprep run journaled along with each shard written (see BinaryTraindataWriter)
+RESUME_NUM_FILES       = "num_files"
+RESUME_TRAINDATA       = "traindata"
+RESUME_TOTAL_AUDIO_SEC = "total_audios_length_sec"
+
+# dataprep arguments that take several values, every combination of which is a feature extraction configuration (see FeatureConfig)
+GRID_ARGS = FeatureConfig._fields
+
+def compose_feature_configs(args):
+    """ :return (list): A FeatureConfig for every combination of the values of the grid arguments, in the order given on the command line. """
+    return [FeatureConfig(*values) for values in product(*[getattr(args, arg) for arg in GRID_ARGS])]
+
+def compose_dataprep_journal_key(args, config):
+    """
+    The dataprep arguments (as strings) the traindata of a feature extraction configuration is produced with,
+    only runs with identical ones can be resumed. The grid arguments are those of that one configuration.
+    """
+    journal_key = {arg: str(value) for arg, value in sorted(vars(args).items()) if arg not in RESUME_NEUTRAL_ARGS}
+    journal_key.update({arg: str(value) for arg, value in config._asdict().items()})
+    return journal_key
+
+def compose_dataprep_catalog_params(args, config, script, dataset_fingerprint):
+    """
+    The parameters the traindata of a feature extraction configuration is cataloged with (see utils_catalog): those of the
+    journal key that determine the traindata contents, the (absolute) dataset path, the fingerprint of the audio files
+    processed (see fingerprint_audiofiles(), so that no traindata made before the dataset changed is reused) and the
+    dataprep script producing it.
+    """
+    params = {arg: str(value) for arg, value in sorted(vars(args).items()) if arg not in CATALOG_NEUTRAL_ARGS}
+    params.update({arg: str(value) for arg, value in config._asdict().items()})
+    params["dataset_path"]        = os.path.abspath(args.dataset_path)
+    params["dataset_fingerprint"] = dataset_fingerprint
+    params["script"]              = script
+    return params
+
+def compose_dataprep_state(num_files, traindata, total_audios_length_sec):
+    """
+        :param               num_files   (int): Number of audio files (in dataprep order) whose samples are all in the shards written so far.
+        :param               traindata  (dict): The non-array traindata sections (mapping, files, etc.) as of then.
+        :param total_audios_length_sec (float): Total length of the audio files processed so far.
+    """
+    return { RESUME_NUM_FILES: num_files, RESUME_TRAINDATA: traindata, RESUME_TOTAL_AUDIO_SEC: total_audios_length_sec }
+
+def resume_dataprep(writers, traindatas):
+    """
+    Carries on from the shards written by an interrupted run: the traindata written by resumed writers are taken over from their
+    journals. Writers may have got to different audio files (shards are cut at different points), so each one has its own resume point.
+        :param traindatas (list): The non-array traindata sections of each writer, replaced in place by the resumed ones.
+        :return (tuple): The number of audio files already processed for each writer, and the total audio length as of the earliest of
+                         these (or None if there is nothing to resume, i.e. all audio files have to be processed from the first one).
+    """
+    num_files_done = [writer.resumed_state[RESUME_NUM_FILES] if writer.resumed_state is not None else 0 for writer in writers]
+    for c, writer in enumerate(writers):
+        if writer.resumed_state is not None:
+            traindatas[c] = writer.resumed_state[RESUME_TRAINDATA]
+    if min(num_files_done) == 0:
+        return num_files_done, None
+    earliest = writers[num_files_done.index(min(num_files_done))]
+    return num_files_done, earliest.resumed_state[RESUME_TOTAL_AUDIO_SEC]
+
+def print_dataprep_throughput(num_files, elapsed_sec, workers):
+    print_info("Processed {} audio files in {:.2f} sec ({} files/sec) with {} worker(s)".format(num_files,
+                                                                                               elapsed_sec,
+                                                                                               lightyellow("{:.1f}".format(num_files / max(elapsed_sec, 1e-9))),
+                                                                                               workers))
+
+def extract_asr_features(af_paths, configs, sample_rate, load_duration, fast_mfcc=False, fast_wav=False, features=(FEATURE_MFCC,), pcm_store=None):
+    """
+    Loads a batch of audio files and extracts features (MFCCs by default) from the first second of each of them,
+    for each of the given configurations. Each signal is decoded once, and configurations sharing the n_fft and
+    hop_length share one STFT (see FeatureConfig).
+        :param     configs (list): Feature extraction configurations (see FeatureConfig).
+        :param  fast_mfcc  (bool): Extract features of the whole batch in one call to the vectorized engine instead of librosa.
+        :param   fast_wav  (bool): Decode the audio files with the fast native WAV decoder instead of librosa.
+        :param   features  (list): Feature types to extract in one pass (see FEATURE_TYPES).
+        :param   pcm_store  (str): Read the decoded signals from this PCM store instead of decoding the audio files (see utils_pcm_store).
+        :return (list): For each audio file, a tuple of:
+                            af_path       (str): Path of the processed audio file.
+                            num_samples   (int): Total samples in the loaded signal.
+                            duration    (float): Duration of the loaded signal in seconds.
+                            features     (list): For each configuration, feature type -> array of shape (# time steps, feature dimension),
+                                                 or None if the signal is shorter than 1 second.
+    """
+    signals = [load_signal(af_path, sample_rate, load_duration, fast_wav, pcm_store) for af_path in af_paths]
+
+    # drop audio files with less than pre-decided number of samples (i.e. only those longer than 1 sec),
+    # and ensure strict consistency of the length of the signal (exactly 1 second)
+    clips = [signal[:sample_rate] for signal in signals if len(signal) >= sample_rate]
+
+    if fast_mfcc:
+        clip_features = iter(features_batched(clips, sample_rate, configs, features))
+    else:
+        clip_features = (extract_features_grid(clip, sample_rate, configs, features) for clip in clips)
+
+    return [(af_path,
+             len(signal),
+             librosa.get_duration(y = signal, sr = sample_rate),
+             next(clip_features) if len(signal) >= sample_rate else None) for af_path, signal in zip(af_paths, signals)]
+
+def segment_start_frame(seg_first_sample, hop_length, num_frames, frames_per_segment):
+    """
+    The frame closest to the first sample of a segment (frame i being centered on sample i * hop_length), rounded down
+    instead if rounding up would cut the segment short at the end of the track.
+    """
+    return max(seg_first_sample // hop_length, min(int(round(seg_first_sample / hop_length)), num_frames - frames_per_segment))
+
+def extract_genre_features(af_paths, configs, num_segments, sample_rate, load_duration, fast_mfcc=False,
+                                                                                       fast_wav=False,
+                                                                                       single_stft=False,
+                                                                                       segment_stride=None,
+                                                                                       features=(FEATURE_MFCC,),
+                                                                                       pcm_store=None):
+    """
+    Loads a batch of audio tracks, divides each of them into segments and extracts features (MFCCs by default) from every
+    segment, for each of the given configurations. Each track is decoded once, and configurations sharing the n_fft and
+    hop_length share one STFT (see FeatureConfig).
+        :param         configs (list): Feature extraction configurations (see FeatureConfig).
+        :param      fast_mfcc  (bool): Extract features of the whole batch with the vectorized engine instead of librosa.
+        :param       fast_wav  (bool): Decode the audio files with the fast native WAV decoder instead of librosa.
+        :param    single_stft  (bool): Extract features of each whole track once and cut frame-aligned segments out of them,
+                                       instead of extracting features separately for every segment.
+        :param  segment_stride  (int): Distance between the starts of consecutive segments. Measured in # of samples.
+                                       Defaults to the segment length (no overlap), smaller values yield overlapping segments.
+        :param       features  (list): Feature types to extract in one pass (see FEATURE_TYPES).
+        :param       pcm_store  (str): Read the decoded signals from this PCM store instead of decoding the audio files (see utils_pcm_store).
+        :return (list): For each audio file, a tuple of:
+                            af_path     (str): Path of the processed audio file.
+                            num_samples (int): Total samples in the loaded signal.
+                            segments   (list): For each configuration, pairs of (segment index, feature type -> array of shape
+                                               (# time steps, feature dimension)), only for segments with the expected number of feature vectors.
+    """
+    samples_per_segment = int(sample_rate * load_duration / num_segments)
+
+    # first sample of each segment, calculated for a track of full length
+    seg_first_samples = range(0, sample_rate * load_duration - samples_per_segment + 1, segment_stride or samples_per_segment)
+    n = len(seg_first_samples)
+
+    signals = [load_signal(af_path, sample_rate, load_duration, fast_wav, pcm_store) for af_path in af_paths]
+
+    segment_signals = [signal[seg_first_sample : seg_first_sample + samples_per_segment]
+                       for signal in signals for seg_first_sample in seg_first_samples] if not single_stft else None
+
+    # segments of each file for each configuration
+    file_segments = [[None] * len(configs) for _ in af_paths]
+
+    # the segmentation depends on the hop length, so configurations are extracted in groups sharing the same STFT
+    for stft_key in sorted(set((config.n_fft, config.hop_length) for config in configs)):
+        group      = [c for c, config in enumerate(configs) if (config.n_fft, config.hop_length) == stft_key]
+        hop_length = stft_key[1]
+        expected_num_of_mfcc_vectors_per_segment = math.ceil(samples_per_segment / hop_length) # mfccs are calculated per hop
+
+        if single_stft:
+            # extract features of each whole track just once
+            if fast_mfcc:
+                track_features = features_batched(signals, sample_rate, [configs[c] for c in group], features)
+            else:
+                track_features = [extract_features_grid(signal, sample_rate, [configs[c] for c in group], features) for signal in signals]
+
+            # cut the segments out of the track features, starting at the frame closest to the first sample of each segment
+            segment_features = [[{feature: track_feature[start : start + expected_num_of_mfcc_vectors_per_segment]
+                                  for feature, track_feature in track_features_of_config.items()
+                                  for start in [segment_start_frame(seg_first_sample, hop_length, len(track_feature), expected_num_of_mfcc_vectors_per_segment)]}
+                                 for track_features_of_config in track_features_of_signal]
+                                for track_features_of_signal in track_features for seg_first_sample in seg_first_samples]
+        else:
+            # a segment yields 1 + len // hop_length feature vectors, so only those yielding the expected number are extracted
+            extracted = [i for i, segment_signal in enumerate(segment_signals)
+                         if 1 + len(segment_signal) // hop_length == expected_num_of_mfcc_vectors_per_segment]
+
+            # extract features for each segment
+            if fast_mfcc:
+                extracted_features = features_batched([segment_signals[i] for i in extracted], sample_rate, [configs[c] for c in group], features)
+            else:
+                extracted_features = [extract_features_grid(segment_signals[i], sample_rate, [configs[c] for c in group], features)
+                                      for i in extracted]
+
+            segment_features = [[None] * len(group)] * len(segment_signals)
+            for i, segment_feature in zip(extracted, extracted_features):
+                segment_features[i] = segment_feature
+
+        # store only features with expected number of vectors
+        for i in range(len(af_paths)):
+            for g, c in enumerate(group):
+                file_segments[i][c] = [(segment, segment_feature[g]) for segment, segment_feature in enumerate(segment_features[i * n : (i + 1) * n])
+                                       if segment_feature[g] is not None and len(segment_feature[g][features[0]]) == expected_num_of_mfcc_vectors_per_segment]
+
+    return [(af_path, len(signal), file_segments[i]) for i, (af_path, signal) in enumerate(zip(af_paths, signals))]
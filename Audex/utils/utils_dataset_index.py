@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+from itertools import islice
+from pathlib   import PurePath
+from pathlib   import Path
+import soundfile
+import hashlib
+import struct
+import json
+import os
+
+from Audex.utils.utils_common import *
+from Audex.utils.utils_wavio  import read_wav_header
+
+# Dataset index: a cached manifest of a dataset tree, i.e. the directories in os.walk() order and, for each
+# of them, its files in listing order along with their size, mtime and (for audio files) the sample rate and
+# frame count read from their headers. Dataprep can then list the audio files of each label, skip the short
+# or unreadable ones and sum up their durations without walking the dataset tree or decoding any audio.
+# The mtimes of the directories tell whether files were added, removed or renamed since (see index_is_stale()).
+INDEX_DATASET_PATH = "dataset_path"
+INDEX_DIRS         = "dirs"
+INDEX_DIR_MTIMES   = "dir_mtimes_ns"
+
+ENTRY_NAME        = "name"
+ENTRY_SIZE        = "size"
+ENTRY_MTIME_NS    = "mtime_ns"
+ENTRY_SAMPLE_RATE = "sample_rate"
+ENTRY_NUM_FRAMES  = "num_frames"
+ENTRY_CORRUPT     = "corrupt"
+ENTRY_SHORT       = "short" # shorter than 1 second
+
+def read_audiofile_info(af_path):
+    """
+    Reads the sample rate and the number of frames of an audio file from its header, without decoding any audio.
+        :return (tuple): (sample_rate, num_frames), or (None, None) if the file cannot be read.
+    """
+    try:
+        wav_info = read_wav_header(af_path)
+        return wav_info.sample_rate, wav_info.num_frames
+    except (ValueError, struct.error, OSError):
+        pass
+    try:
+        # formats the native WAV header parser does not handle (compressed WAV, FLAC, OGG, etc.)
+        info = soundfile.info(af_path)
+        return info.samplerate, info.frames
+    except Exception: # soundfile raises RuntimeError subclasses on unreadable files
+        return None, None
+
+def index_file(af_path, stat):
+    entry = { ENTRY_NAME: PurePath(af_path).name, ENTRY_SIZE: stat.st_size, ENTRY_MTIME_NS: stat.st_mtime_ns }
+    if af_path.endswith(".wav"):
+        sample_rate, num_frames = read_audiofile_info(af_path)
+        entry[ENTRY_SAMPLE_RATE] = sample_rate
+        entry[ENTRY_NUM_FRAMES]  = num_frames
+        entry[ENTRY_CORRUPT]     = not sample_rate
+        entry[ENTRY_SHORT]       = not sample_rate or num_frames < sample_rate
+    return entry
+
+def build_dataset_index(dataset_path, previous_index=None):
+    """
+    Walks the dataset tree and indexes all of its files. Files whose size and mtime are unchanged
+    since the previous index are taken over from it as they are, only new or changed files are read.
+        :param   dataset_path  (str): Path to dataset.
+        :param previous_index (dict): Index to refresh incrementally, or None to index all files from scratch.
+        :return (tuple): The index (dict) and the number of files whose headers had to be (re)read.
+    """
+    previous = {}
+    if previous_index:
+        for reldir, entries in previous_index[INDEX_DIRS].items():
+            previous.update({(reldir, entry[ENTRY_NAME]): entry for entry in entries})
+
+    index = { INDEX_DATASET_PATH: os.path.abspath(dataset_path), INDEX_DIRS: {}, INDEX_DIR_MTIMES: {} }
+    num_indexed = 0
+
+    for dirpath, _, afnames in os.walk(dataset_path):
+        reldir  = os.path.relpath(dirpath, dataset_path)
+        index[INDEX_DIR_MTIMES][reldir] = os.stat(dirpath).st_mtime_ns
+        entries = []
+        for afname in afnames:
+            af_path = os.path.join(dirpath, afname)
+            stat    = os.stat(af_path)
+            entry   = previous.get((reldir, afname))
+            if entry is None or entry[ENTRY_SIZE] != stat.st_size or entry[ENTRY_MTIME_NS] != stat.st_mtime_ns:
+                entry = index_file(af_path, stat)
+                num_indexed += 1
+            entries.append(entry)
+        index[INDEX_DIRS][reldir] = entries
+
+    return index, num_indexed
+
+def index_is_stale(index, dataset_path):
+    """
+    Tells whether files were added to, removed from or renamed in the dataset since it was indexed, by comparing the
+    mtimes of its directories with the indexed ones (a stat per directory, no walk). Indexes made before directory
+    mtimes were recorded count as stale. Files rewritten in place are not detected, build_dataset_index() catches those.
+    """
+    dir_mtimes = index.get(INDEX_DIR_MTIMES)
+    if dir_mtimes is None or dir_mtimes.keys() != index[INDEX_DIRS].keys():
+        return True
+    for reldir, mtime_ns in dir_mtimes.items():
+        try:
+            if os.stat(os.path.join(dataset_path, reldir)).st_mtime_ns != mtime_ns:
+                return True
+        except FileNotFoundError:
+            return True
+    return False
+
+def load_dataset_index(index_path):
+    """ :return (dict): The dataset index saved in index_path, or None if there is none. """
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r") as file:
+        return json.load(file)
+
+def save_dataset_index(index, index_path):
+    Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+    print_info("|||||| Writing file", quote_path(index_path), "... ", end="")
+    # written atomically, so that an interrupted run never leaves a half-written index behind
+    with atomic_file(index_path) as file:
+        json.dump(index, file)
+    print_info("[DONE]")
+
+def list_indexed_audiofiles(index, dataset_view, dataset_depth):
+    """
+    Lists the audio files to be processed label by label from a dataset index, in the same order and with the
+    same selection as list_dataset_audiofiles(): the first dataset_depth files of each label, of which the .wav ones.
+        :return (list): Pairs of (label name, list of (audio file path, index entry) pairs for that label).
+    """
+    label_afentries = []
+    for reldir, entries in index[INDEX_DIRS].items():
+        if reldir == os.curdir or PurePath(reldir).name not in dataset_view:
+            continue
+        dirpath = os.path.join(index[INDEX_DATASET_PATH], reldir)
+        label_afentries.append((PurePath(reldir).name, [(os.path.join(dirpath, entry[ENTRY_NAME]), entry)
+                                                        for entry in islice(entries, dataset_depth) if entry[ENTRY_NAME].endswith(".wav")]))
+    return label_afentries
+
+def stat_audiofiles(label_afpaths):
+    """
+    The audio files of each label along with their size and mtime, as if listed from a dataset index (see list_indexed_audiofiles()).
+        :param label_afpaths (list): Pairs of (label name, list of audio file paths for that label), see list_dataset_audiofiles().
+        :return (list): Pairs of (label name, list of (audio file path, entry with the size and mtime of the file) pairs for that label).
+    """
+    label_afentries = []
+    for label_name, af_paths in label_afpaths:
+        stats = [os.stat(af_path) for af_path in af_paths]
+        label_afentries.append((label_name, [(af_path, { ENTRY_SIZE: stat.st_size, ENTRY_MTIME_NS: stat.st_mtime_ns }) for af_path, stat in zip(af_paths, stats)]))
+    return label_afentries
+
+def fingerprint_audiofiles(label_afentries, dataset_path):
+    """
+    Fingerprint of the contents of the audio files of each label: a hash of their number and of the path (relative to the
+    dataset), size and mtime of each, so that adding, removing, renaming or rewriting any of them changes the fingerprint.
+        :param label_afentries (list): Pairs of (label name, list of (audio file path, index entry) pairs), see list_indexed_audiofiles().
+    """
+    files = [(label_name, os.path.relpath(af_path, dataset_path), entry[ENTRY_SIZE], entry[ENTRY_MTIME_NS])
+             for label_name, afentries in label_afentries for af_path, entry in afentries]
+    return hashlib.sha1(json.dumps([len(files), files]).encode()).hexdigest()
+
+def indexed_duration(entry, load_duration=None):
+    """
+    Duration in seconds of an indexed audio file (as librosa.get_duration() would report it once
+    loaded with the given load_duration), computed from its header. Unreadable files count as 0.
+    """
+    if entry[ENTRY_CORRUPT]:
+        return 0.0
+    duration = entry[ENTRY_NUM_FRAMES] / entry[ENTRY_SAMPLE_RATE]
+    return duration if load_duration is None else min(duration, load_duration)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+from collections import namedtuple
+from functools   import lru_cache
+import scipy.signal
+import scipy.fft
+import numpy as np
+import librosa
+
+# Feature types that can be extracted together in one pass, sharing the STFT and (log-)mel spectrogram intermediates.
+# Each comes out of the extraction as an array of shape (# frames, feature dimension) per signal.
+FEATURE_MFCC   = "mfcc"   # MFCCs,                               dimension n_mfcc
+FEATURE_LOGMEL = "logmel" # log-mel spectrogram in dB,           dimension n_mels
+FEATURE_POWER  = "power"  # power spectrogram,                   dimension 1 + n_fft/2
+FEATURE_DELTA  = "delta"  # 1st order (time) deltas of the MFCCs, dimension n_mfcc
+FEATURE_DELTA2 = "delta2" # 2nd order (time) deltas of the MFCCs, dimension n_mfcc
+FEATURE_TYPES  = [FEATURE_MFCC, FEATURE_LOGMEL, FEATURE_POWER, FEATURE_DELTA, FEATURE_DELTA2]
+
+# Parameters of one feature extraction configuration. Configurations with the same n_fft and hop_length share
+# the power spectrogram, and those with the same n_mels on top of that share the log-mel spectrogram as well.
+FeatureConfig = namedtuple("FeatureConfig", ["n_mfcc", "n_fft", "hop_length", "n_mels"])
+
+def needs_logmel(features):
+    return bool(set(features) - {FEATURE_POWER})
+
+def compute_delta(features, order=1, width=9):
+    """
+    Same as librosa.feature.delta() (a Savitzky-Golay derivative filter), along the frames axis of features of shape (..., # frames, dimension).
+    """
+    return scipy.signal.savgol_filter(features, width, order, deriv=order, axis=-2, mode="interp").astype(np.float32)
+
+class MfccEngine:
+    """
+    Vectorized, batched MFCC extraction. The window, mel filterbank and DCT matrix are computed once
+    per parameter set, and a whole (batch, samples) array of equally long signals is then turned into
+    MFCCs with a single batched FFT followed by two large matrix multiplications (mel and DCT).
+
+    Reproduces librosa 0.8 defaults (librosa.feature.mfcc with a periodic Hann window, centered frames
+    with reflect padding, power spectrogram, 128 Slaney mel bands, power_to_db with top_db=80 and an
+    orthonormal DCT-II). Computations are done in float32, and the outputs match librosa within an
+    absolute tolerance of 1e-3 (for MFCC values whose magnitudes go up to several hundreds).
+    """
+    def __init__(self, sample_rate=22050, n_mfcc=13, n_fft=2048, hop_length=512, n_mels=128, top_db=80.0):
+        self.sample_rate = sample_rate
+        self.n_mfcc      = n_mfcc
+        self.n_fft       = n_fft
+        self.hop_length  = hop_length
+        self.n_mels      = n_mels
+        self.top_db      = top_db
+
+        self.window    = scipy.signal.get_window("hann", n_fft, fftbins=True).astype(np.float32)                 # (n_fft,)
+        self.mel_basis = librosa.filters.mel(sr=sample_rate, n_fft=n_fft, n_mels=n_mels).T.astype(np.float32)    # (1 + n_fft/2, n_mels)
+        self.dct_basis = scipy.fft.dct(np.eye(n_mels), type=2, norm="ortho", axis=0)[:n_mfcc].T.astype(np.float32) # (n_mels, n_mfcc)
+
+    def num_frames(self, num_samples):
+        return 1 + num_samples // self.hop_length
+
+    def frames(self, signals):
+        """
+        Slices centered, reflect-padded frames out of a (batch, samples) array without copying it.
+            :return (ndarray): View of shape (batch, # frames, n_fft).
+        """
+        padded = np.pad(signals, ((0, 0), (self.n_fft // 2, self.n_fft // 2)), mode="reflect")
+        # every window of n_fft samples (as_strided rather than sliding_window_view, which needs numpy >= 1.20), one every hop_length
+        windows = np.lib.stride_tricks.as_strided(padded, shape   = (padded.shape[0], padded.shape[1] - self.n_fft + 1, self.n_fft),
+                                                          strides = (padded.strides[0], padded.strides[1], padded.strides[1]), writeable = False)
+        return windows[:, ::self.hop_length]
+
+    def power_spectrogram(self, signals):
+        """
+        :param signals (ndarray): Array of shape (batch, samples).
+        :return        (ndarray): Power spectrograms of shape (batch, # frames, 1 + n_fft/2).
+        """
+        spectrum = scipy.fft.rfft(self.frames(signals) * self.window, axis=-1)
+        return np.square(spectrum.real, dtype=np.float32) + np.square(spectrum.imag, dtype=np.float32)
+
+    def melspectrogram(self, signals):
+        """
+        :param signals (ndarray): Array of shape (batch, samples).
+        :return        (ndarray): Mel power spectrograms of shape (batch, # frames, n_mels).
+        """
+        return np.matmul(self.power_spectrogram(signals), self.mel_basis)
+
+    def power_to_db(self, mel, out=None):
+        """ Same as librosa.power_to_db(ref=1.0, amin=1e-10, top_db=80), with top_db applied per batch item. """
+        db = np.log10(np.maximum(mel, 1e-10, out=out), out=out)
+        db *= 10.0
+        return np.maximum(db, db.max(axis=(1, 2), keepdims=True) - self.top_db, out=db)
+
+    def mfcc(self, signals, out=None):
+        """
+        Extracts MFCCs from a batch of equally long signals in one vectorized call.
+            :param signals (ndarray): Array of shape (batch, samples), or a single signal of shape (samples,).
+            :param     out (ndarray): Optional preallocated float32 output of shape (batch, # frames, n_mfcc).
+            :return        (ndarray): MFCCs of shape (batch, # frames, n_mfcc), i.e. already in the (# time steps,
+                                      # coefficients) per sample layout expected in the traindata.
+        """
+        signals = np.atleast_2d(np.asarray(signals, dtype=np.float32))
+        if out is None:
+            out = np.empty((len(signals), self.num_frames(signals.shape[1]), self.n_mfcc), dtype=np.float32)
+        mel_db = self.power_to_db(self.melspectrogram(signals))
+        return np.matmul(mel_db, self.dct_basis, out=out)
+
+    def features(self, signals, features, power=None, logmel=None):
+        """
+        Extracts several feature types from a batch of equally long signals in one pass: the power spectrogram,
+        the mel spectrogram and its log are computed once and shared by all the requested feature types.
+            :param  signals (ndarray): Array of shape (batch, samples), or a single signal of shape (samples,).
+            :param features    (list): Feature types to extract (see FEATURE_TYPES).
+            :param   power  (ndarray): Power spectrograms of the signals if already computed (with the same n_fft and hop_length).
+            :param   logmel (ndarray): Log-mel spectrograms of the signals if already computed (with the same n_fft, hop_length and n_mels).
+            :return (dict): Feature type -> float32 array of shape (batch, # frames, feature dimension).
+        """
+        signals = np.atleast_2d(np.asarray(signals, dtype=np.float32))
+        power   = self.power_spectrogram(signals) if power is None else power
+        result  = {}
+        if FEATURE_POWER in features:
+            result[FEATURE_POWER] = power
+        if needs_logmel(features):
+            logmel = self.power_to_db(np.matmul(power, self.mel_basis)) if logmel is None else logmel
+            if FEATURE_LOGMEL in features:
+                result[FEATURE_LOGMEL] = logmel
+            if set(features) & {FEATURE_MFCC, FEATURE_DELTA, FEATURE_DELTA2}:
+                mfcc = np.matmul(logmel, self.dct_basis)
+                if FEATURE_MFCC in features:
+                    result[FEATURE_MFCC] = mfcc
+                if FEATURE_DELTA in features:
+                    result[FEATURE_DELTA] = compute_delta(mfcc, order=1)
+                if FEATURE_DELTA2 in features:
+                    result[FEATURE_DELTA2] = compute_delta(mfcc, order=2)
+        return result
+
+def stft_power(signal, n_fft, hop_length):
+    return np.abs(librosa.stft(signal, n_fft=n_fft, hop_length=hop_length)) ** 2
+
+def power_to_logmel(power, sample_rate, n_mels):
+    return librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sample_rate, n_mels=n_mels))
+
+def extract_features(signal, sample_rate, n_mfcc=13, n_fft=2048, hop_length=512, n_mels=128, features=(FEATURE_MFCC,), power=None, logmel=None):
+    """
+    librosa counterpart of MfccEngine.features() for a single signal, sharing the intermediates the same way.
+    MFCCs are exactly the same as those of librosa.feature.mfcc(y=signal, ...) with n_mels mel bands.
+        :param features (list): Feature types to extract (see FEATURE_TYPES).
+        :param power  (ndarray): Power spectrogram (see stft_power()) if already computed with the same n_fft and hop_length.
+        :param logmel (ndarray): Log-mel spectrogram (see power_to_logmel()) if already computed with the same n_fft, hop_length and n_mels.
+        :return (dict): Feature type -> array of shape (# frames, feature dimension).
+    """
+    power  = stft_power(signal, n_fft, hop_length) if power is None else power
+    result = {}
+    if FEATURE_POWER in features:
+        result[FEATURE_POWER] = power.T
+    if needs_logmel(features):
+        logmel = power_to_logmel(power, sample_rate, n_mels) if logmel is None else logmel
+        if FEATURE_LOGMEL in features:
+            result[FEATURE_LOGMEL] = logmel.T
+        if set(features) & {FEATURE_MFCC, FEATURE_DELTA, FEATURE_DELTA2}:
+            mfcc = librosa.feature.mfcc(S=logmel, n_mfcc=n_mfcc)
+            if FEATURE_MFCC in features:
+                result[FEATURE_MFCC] = mfcc.T
+            if FEATURE_DELTA in features:
+                result[FEATURE_DELTA] = librosa.feature.delta(mfcc, order=1).T
+            if FEATURE_DELTA2 in features:
+                result[FEATURE_DELTA2] = librosa.feature.delta(mfcc, order=2).T
+    return result
+
+def extract_features_grid(signal, sample_rate, configs, features=(FEATURE_MFCC,)):
+    """
+    extract_features() for several configurations at once, computing the power spectrogram once per (n_fft, hop_length)
+    and the log-mel spectrogram once per (n_fft, hop_length, n_mels), no matter how many configurations share them.
+        :param configs (list): Feature extraction configurations (see FeatureConfig).
+        :return (list): Feature type -> array of shape (# frames, feature dimension) dict for each configuration, in the given order.
+    """
+    powers, logmels, result = {}, {}, []
+    for config in configs:
+        stft_key = (config.n_fft, config.hop_length)
+        mel_key  = stft_key + (config.n_mels,)
+        if stft_key not in powers:
+            powers[stft_key] = stft_power(signal, config.n_fft, config.hop_length)
+        if mel_key not in logmels and needs_logmel(features):
+            logmels[mel_key] = power_to_logmel(powers[stft_key], sample_rate, config.n_mels)
+        result.append(extract_features(signal, sample_rate, *config, features, powers[stft_key], logmels.get(mel_key)))
+    return result
+
+def engine_features_grid(signals, sample_rate, configs, features):
+    """
+    Vectorized counterpart of extract_features_grid() for a batch of equally long signals, sharing the intermediates the same way.
+        :return (list): Feature type -> float32 array of shape (batch, # frames, feature dimension) dict for each configuration.
+    """
+    signals = np.atleast_2d(np.asarray(signals, dtype=np.float32))
+    powers, logmels, result = {}, {}, []
+    for config in configs:
+        engine   = get_mfcc_engine(sample_rate, *config)
+        stft_key = (config.n_fft, config.hop_length)
+        mel_key  = stft_key + (config.n_mels,)
+        if stft_key not in powers:
+            powers[stft_key] = engine.power_spectrogram(signals)
+        if mel_key not in logmels and needs_logmel(features):
+            logmels[mel_key] = engine.power_to_db(np.matmul(powers[stft_key], engine.mel_basis))
+        result.append(engine.features(signals, features, powers[stft_key], logmels.get(mel_key)))
+    return result
+
+def features_batched(signals, sample_rate, configs, features):
+    """
+    Extracts several feature types for several configurations from a list of signals of possibly different
+    lengths, with one vectorized engine_features_grid() call per group of equally long signals.
+        :return (list): For each signal, in the given order, a list of feature type -> array of shape
+                        (# frames, feature dimension) dicts, one for each configuration.
+    """
+    result = [None] * len(signals)
+    for length in set(len(signal) for signal in signals):
+        indices = [i for i, signal in enumerate(signals) if len(signal) == length]
+        batch   = engine_features_grid(np.stack([signals[i] for i in indices]), sample_rate, configs, features)
+        for j, i in enumerate(indices):
+            result[i] = [{feature: config_batch[feature][j] for feature in features} for config_batch in batch]
+    return result
+
+def mfcc_batched(engine, signals):
+    """
+    Extracts MFCCs from a list of signals of possibly different lengths,
+    with one vectorized engine call per group of equally long signals.
+        :return (list): MFCCs of shape (# time steps, # coefficients) for each signal, in the given order.
+    """
+    mfccs = [None] * len(signals)
+    for length in set(len(signal) for signal in signals):
+        indices = [i for i, signal in enumerate(signals) if len(signal) == length]
+        for i, mfcc in zip(indices, engine.mfcc(np.stack([signals[i] for i in indices]))):
+            mfccs[i] = mfcc
+    return mfccs
+
+@lru_cache(maxsize=None)
+def get_mfcc_engine(sample_rate, n_mfcc, n_fft, hop_length, n_mels=128):
+    """ Returns the (process-wide, reused) MFCC engine for the given parameter set. """
+    return MfccEngine(sample_rate=sample_rate, n_mfcc=n_mfcc, n_fft=n_fft, hop_length=hop_length, n_mels=n_mels)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+from functools  import lru_cache
+from contextlib import ExitStack
+from pathlib    import PurePath
+from pathlib    import Path
+import numpy as np
+import json
+import os
+
+from Audex.utils.utils_common        import *
+from Audex.utils.utils_wavio         import load_audio
+from Audex.utils.utils_dataset_index import ENTRY_NAME, ENTRY_SIZE, ENTRY_MTIME_NS
+
+# Decoded PCM store: the audio files of a dataset decoded and resampled once (for a given sample rate and load
+# duration), so that dataprep runs sweeping feature parameters (n_mfcc, n_fft, hop_length, etc.) never decode
+# the same audio again. Each label is a single raw int16 or float32 array of all its signals back to back, read
+# through a memory map, along with an .npy array of the offsets of the signals in it (one more than the number
+# of files, the last one being the total length). A JSON manifest lists the files of each label with their
+# size and mtime, so that files changed since they were decoded are not taken from the store.
+PCM_STORE_MANIFEST = "manifest.json"
+PCM_STORE_LABELS   = "labels"
+PCM_STORE_PCM      = "pcm"
+PCM_STORE_OFFSETS  = "offsets"
+PCM_STORE_FILES    = "files"
+PCM_STORE_DTYPE    = "dtype"
+
+PCM_STORE_DTYPES   = ["float32", "int16"]
+PCM_INT16_SCALE    = 32768
+
+class PcmStore:
+    """
+    Read access to a decoded PCM store. The label arrays are only memory-mapped once a signal of that label is read.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.manifest  = load_pcm_store_manifest(store_dir)
+        self.labels    = self.manifest[PCM_STORE_LABELS] if self.manifest else {}
+        self.dtype     = np.dtype(self.manifest[PCM_STORE_DTYPE]) if self.manifest else None
+        self.arrays    = {}
+        self.entries   = {(label, entry[ENTRY_NAME]): (label, i, entry) for label, label_meta in self.labels.items()
+                                                                        for i, entry in enumerate(label_meta[PCM_STORE_FILES])}
+
+    def lookup(self, af_path):
+        """ :return (tuple): (label, index within the label), or None if the file is not in the store or has changed since. """
+        found = self.entries.get((PurePath(af_path).parent.name, PurePath(af_path).name))
+        if found is None:
+            return None
+        label, i, entry = found
+        af_stat = os.stat(af_path)
+        if entry[ENTRY_SIZE] != af_stat.st_size or entry[ENTRY_MTIME_NS] != af_stat.st_mtime_ns:
+            return None
+        return label, i
+
+    def label_arrays(self, label):
+        if label not in self.arrays:
+            label_meta = self.labels[label]
+            pcm_path   = os.path.join(self.store_dir, label_meta[PCM_STORE_PCM])
+            offsets    = np.load(os.path.join(self.store_dir, label_meta[PCM_STORE_OFFSETS]))
+            pcm        = np.memmap(pcm_path, dtype=self.dtype, mode="r") if offsets[-1] else np.zeros(0, self.dtype) # empty files can't be mapped
+            self.arrays[label] = (pcm, offsets)
+        return self.arrays[label]
+
+    def stored(self, label, i):
+        """ :return (ndarray): The signal as it is stored (int16 or float32), a view into the memory-mapped label array. """
+        pcm, offsets = self.label_arrays(label)
+        return pcm[offsets[i] : offsets[i + 1]]
+
+    def signal(self, af_path):
+        """ :return (ndarray): The float32 decoded signal of an audio file, or None if not in the store. """
+        found = self.lookup(af_path)
+        if found is None:
+            return None
+        stored = self.stored(*found)
+        if self.dtype == np.int16:
+            return np.divide(stored, PCM_INT16_SCALE, dtype=np.float32)
+        return np.array(stored, dtype=np.float32)
+
+class PcmStoreWriter:
+    """
+    Writes (or rewrites) labels of a decoded PCM store, streaming the signals of each label straight to disk.
+    Labels not rewritten are kept as they are. The manifest is only updated on close().
+    """
+    def __init__(self, store_dir, dtype, **store_meta):
+        """
+        :param  store_dir  (str): Directory of the store.
+        :param      dtype  (str): Sample type of the stored signals (see PCM_STORE_DTYPES).
+        :param store_meta (dict): Whatever else describes the store (dataset path, sample rate, load duration, decoder).
+        """
+        Path(store_dir).mkdir(parents=True, exist_ok=True)
+        self.store_dir = store_dir
+        self.dtype     = np.dtype(dtype)
+        previous       = load_pcm_store_manifest(store_dir)
+        self.manifest  = previous if previous and previous[PCM_STORE_DTYPE] == dtype else { PCM_STORE_LABELS: {} }
+        self.manifest.update(store_meta)
+        self.manifest[PCM_STORE_DTYPE] = dtype
+
+    def begin_label(self, label):
+        self.label   = label
+        self.files   = []
+        self.offsets = [0]
+        self.pcm_writing = ExitStack() # the signals file only replaces the previous one of the label once complete (see end_label())
+        self.pcm_file    = self.pcm_writing.enter_context(atomic_file(os.path.join(self.store_dir, label + ".pcm"), "wb"))
+
+    def append(self, af_path, signal):
+        """ :param signal (ndarray): float32 decoded signal of the audio file, or an already stored signal of the same dtype. """
+        if self.dtype == np.int16 and signal.dtype != np.int16: # stored int16 signals are copied over as they are
+            signal = np.clip(np.round(signal * PCM_INT16_SCALE), -PCM_INT16_SCALE, PCM_INT16_SCALE - 1)
+        self.pcm_file.write(np.ascontiguousarray(signal, dtype=self.dtype).tobytes())
+        af_stat = os.stat(af_path)
+        self.files.append({ ENTRY_NAME: PurePath(af_path).name, ENTRY_SIZE: af_stat.st_size, ENTRY_MTIME_NS: af_stat.st_mtime_ns })
+        self.offsets.append(self.offsets[-1] + len(signal))
+
+    def end_label(self):
+        label_meta = { PCM_STORE_PCM: self.label + ".pcm", PCM_STORE_OFFSETS: self.label + "_offsets.npy", PCM_STORE_FILES: self.files }
+        np.save(os.path.join(self.store_dir, label_meta[PCM_STORE_OFFSETS]), np.array(self.offsets, dtype=np.int64))
+        self.pcm_writing.close()
+        self.manifest[PCM_STORE_LABELS][self.label] = label_meta
+
+    def close(self):
+        print_info("|||||| Writing PCM store", quote_path(self.store_dir), "... ", end="")
+        with atomic_file(os.path.join(self.store_dir, PCM_STORE_MANIFEST)) as file: # the manifest is always complete
+            json.dump(self.manifest, file, indent=4)
+        print_info("[DONE]")
+
+def load_pcm_store_manifest(store_dir):
+    manifest_path = os.path.join(store_dir, PCM_STORE_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as file:
+        return json.load(file)
+
+@lru_cache(maxsize=4)
+def open_cached_pcm_store(store_dir, manifest_mtime_ns):
+    return PcmStore(store_dir)
+
+def open_pcm_store(store_dir):
+    """ Returns the (process-wide, reused) store in store_dir, reopened whenever its manifest has been rewritten since. """
+    manifest_path = os.path.join(store_dir, PCM_STORE_MANIFEST)
+    return open_cached_pcm_store(store_dir, os.stat(manifest_path).st_mtime_ns if os.path.exists(manifest_path) else 0)
+
+def load_signal(af_path, sample_rate, load_duration, fast_wav=False, pcm_store=None):
+    """
+    Loads the decoded signal of an audio file from the PCM store if it is in there, or else decodes the audio file.
+        :param pcm_store (str): Directory of the PCM store made with the same sample rate and load duration, or None not to use one.
+        :return (ndarray): float32 mono signal.
+    """
+    if pcm_store is not None:
+        signal = open_pcm_store(pcm_store).signal(af_path)
+        if signal is not None:
+            return signal
+    return load_audio(af_path, sr = sample_rate, duration = load_duration, fast_wav = fast_wav)[0]
@@ -53,42 +53,31 @@ def plot_frequency_distribution(signal_pack, f_ratio=1):
     pt.xlabel("Frequency (Hz)")
     pt.ylabel("Magnitude")
 
-def plot_spectrogram(signal_pack, y_axis = "linear"):
+def plot_spectrogram(signal_pack, power, hop_length=512, y_axis="linear"):
+    """ :param power (ndarray): Power spectrogram of the signal, of shape (# frames, 1 + n_fft/2) (see extract_features). """
     print_info("vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv plot_spectrogram()")
-    FRAME_SIZE = 2048 # TODO: Hoist FRAME_SIZE into cmd arg (this is the same argument as in the function below)
-    HOP_LENGTH = 512  # TODO: Hoist HOP_LENGTH into cmd arg (this is the same argument as in the function below)
-    stft_scale = librosa.stft(signal_pack[1][0], n_fft = FRAME_SIZE, hop_length = HOP_LENGTH)
-    print_info("stft.shape =", stft_scale.shape, "of type", type(stft_scale[0][0]))        
-    y_scale = np.abs(stft_scale) ** 2
-    print_info("y_scale.shape =", y_scale.shape, "of type", type(y_scale[0][0]))
-    y_log_scale = librosa.power_to_db(y_scale)
+    print_info("power.shape =", power.shape, "of type", power.dtype)
+    y_log_scale = librosa.power_to_db(power.T)
     pt.figure(figsize = (15, 8)).canvas.set_window_title("Spectrogram")
     pt.title(signal_pack[0])
-    librosa.display.specshow(y_log_scale, sr = signal_pack[1][1], hop_length = HOP_LENGTH, x_axis = "time", y_axis = y_axis)
+    librosa.display.specshow(y_log_scale, sr = signal_pack[1][1], hop_length = hop_length, x_axis = "time", y_axis = y_axis)
     pt.colorbar()
 
-def plot_melspec(signal_pack):
+def plot_melspec(signal_pack, logmel, hop_length=512):
+    """ :param logmel (ndarray): Log-mel spectrogram of the signal, of shape (# frames, n_mels) (see extract_features). """
     print_info("vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv plot_melspec()")
-    FRAME_SIZE = 2048 # TODO: Hoist FRAME_SIZE into cmd arg (as  first value for -plot_specs)
-    HOP_LENGTH = 512  # TODO: Hoist HOP_LENGTH into cmd arg (as second value for -plot_specs)
-    # TODO: Hoist n_fft      into cmd arg (this is the same argument as in the above function)
-    # TODO: Hoist hop_length into cmd arg (this is the same argument as in the above function)
-    # TODO: Hoist n_mels     into cmd arg as value for -plot_melspecs (help message: number of Mel bands to generate)
-    mel_spectrogram = librosa.feature.melspectrogram(signal_pack[1][0], signal_pack[1][1], n_fft = FRAME_SIZE, hop_length = HOP_LENGTH, n_mels = 90)
-    print_info("mel_spectrogram.shape =", mel_spectrogram.shape)
-    log_mel_spectrogram = librosa.power_to_db(mel_spectrogram)
+    print_info("log_mel_spectrogram.shape =", logmel.shape)
     pt.figure(figsize = (15, 10)).canvas.set_window_title("MEL Spectrogram")
     pt.title("MEL Spec of " + str(signal_pack[0]))
-    librosa.display.specshow(log_mel_spectrogram, x_axis = "time", y_axis = "mel", sr = signal_pack[1][1])
+    librosa.display.specshow(logmel.T, x_axis = "time", y_axis = "mel", sr = signal_pack[1][1], hop_length = hop_length)
     pt.colorbar()
 
-def plot_mfcc(signal_pack):
+def plot_mfcc(signal_pack, mfccs, hop_length=512):
+    """ :param mfccs (ndarray): MFCCs of the signal, of shape (# frames, n_mfcc) (see extract_features). """
     print_info("vvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvvv plot_mfcc()")
-    # TODO: Hoist n_mfcc into cmd arg (as argument for -plot_mfccs)
-    mfccs = librosa.feature.mfcc(signal_pack[1][0], n_mfcc=20, sr = signal_pack[1][1])
     print_info("mfcc.shape =", mfccs.shape)
     pt.figure(figsize=(15,10)).canvas.set_window_title("MFCC")
     pt.title("MFCC of " + signal_pack[0])
-    librosa.display.specshow(mfccs, x_axis="time", sr = signal_pack[1][1])
+    librosa.display.specshow(mfccs.T, x_axis="time", sr = signal_pack[1][1], hop_length = hop_length)
     pt.colorbar()
-    pt.ylabel("Number of MFCCs")
\ No newline at end of file
+    pt.ylabel("Number of MFCCs")
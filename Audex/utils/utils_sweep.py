@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import sqlite3
+import json
+import os
+
+from Audex.utils.utils_common import *
+
+# Sweep results: an SQLite table of all the trials of all the hyperparameter sweeps run in a workdir (see sweep_asr.py),
+# one row per trial with its hyperparameters, how it ended, its last validation and test metrics and its wall time.
+TRIAL_FINISHED = "finished" # trained all its epochs (or stopped early by its own early stopping)
+TRIAL_STOPPED  = "stopped"  # stopped by successive halving
+TRIAL_FAILED   = "failed"   # exited without test metrics
+
+SWEEP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS trials (
+        id            INTEGER PRIMARY KEY,
+        sweep         TEXT    NOT NULL,
+        trial         INTEGER NOT NULL,
+        status        TEXT    NOT NULL,
+        ann_type      TEXT,
+        batch_size    INTEGER,
+        learning_rate REAL,
+        width         INTEGER,
+        depth         INTEGER,
+        epochs        INTEGER,
+        val_accuracy  REAL,
+        val_loss      REAL,
+        test_accuracy REAL,
+        test_loss     REAL,
+        wall_time_sec REAL,
+        cores         TEXT,
+        args          TEXT,
+        log           TEXT,
+        started       TEXT,
+        ended         TEXT,
+        UNIQUE (sweep, trial)
+    );
+    CREATE INDEX IF NOT EXISTS trials_sweep ON trials (sweep);
+"""
+SWEEP_TIMEOUT_SEC = 60 # how long to wait for another process to finish writing the results
+
+def open_sweep_results(results_path):
+    Path(os.path.dirname(results_path)).mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(results_path, timeout=SWEEP_TIMEOUT_SEC)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SWEEP_SCHEMA)
+    return connection
+
+def record_trial(results_path, trial):
+    """
+    Adds a trial to the results (replacing any previous entry of the same sweep and trial number).
+        :param trial (dict): Column name -> value (see SWEEP_SCHEMA), "cores" and "args" as lists.
+    """
+    row = {**trial, "cores": json.dumps(trial.get("cores")), "args": json.dumps(trial.get("args"))}
+    columns = [column for column in row if column != "id"]
+    with open_sweep_results(results_path) as connection:
+        connection.execute("INSERT OR REPLACE INTO trials (" + ", ".join(columns) + ") VALUES (" + ", ".join("?" * len(columns)) + ")",
+                           [row[column] for column in columns])
+    connection.close()
+
+def select_trials(results_path, sweep):
+    """ :return (list): The trials (as dicts) of a sweep, in trial order. """
+    if not os.path.exists(results_path):
+        return []
+    with open_sweep_results(results_path) as connection:
+        rows = connection.execute("SELECT * FROM trials WHERE sweep = ? ORDER BY trial", (sweep,)).fetchall()
+    connection.close()
+    return [dict(row) for row in rows]
+
+class SuccessiveHalving:
+    """
+    Asynchronous successive halving: a trial is judged every time it reaches a rung (min_epochs, then eta times as many
+    epochs, and so on), against all the trials that reached that rung so far, and goes on only if its metric is among
+    the best 1/eta of theirs. Trials are judged as soon as they get there, with no waiting for a whole rung to be filled,
+    so the workers never sit idle. Until eta trials reached a rung, all go on.
+    """
+    def __init__(self, min_epochs, max_epochs, eta=3, maximize=True):
+        """
+        :param min_epochs (int): Epochs of the first rung.
+        :param max_epochs (int): Epochs of a trial that is never stopped (no rung at or beyond it).
+        :param        eta (int): Reduction factor, at least 2 (see above).
+        :param  maximize (bool): Whether the metric is better higher (accuracy) or lower (loss).
+        """
+        self.eta      = eta
+        self.maximize = maximize
+        self.rungs    = {} # rung epoch -> {trial: metric}
+        epoch = min_epochs
+        while epoch < max_epochs:
+            self.rungs[epoch] = {}
+            epoch *= eta
+
+    def report(self, trial, epoch, metric):
+        """
+        :param trial    (int): Trial number.
+        :param epoch    (int): Number of epochs the trial trained so far.
+        :param metric (float): The metric of the trial after that many epochs.
+        :return (bool): Whether the trial is to go on.
+        """
+        if epoch not in self.rungs:
+            return True
+        rung = self.rungs[epoch]
+        rung[trial] = metric if self.maximize else -metric
+        if len(rung) < self.eta:
+            return True
+        cutoff = sorted(rung.values(), reverse=True)[len(rung) // self.eta - 1]
+        return rung[trial] >= cutoff
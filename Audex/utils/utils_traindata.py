@@ -0,0 +1,830 @@
+#!/usr/bin/env python
+
+from pathlib import Path
+import numpy as np
+import h5py
+import multiprocessing
+import hashlib
+import warnings
+import tempfile
+import shutil
+import json
+import re
+import os
+
+from Audex.utils.utils_common import *
+
+# Binary traindata format: a directory named after the traindata id, holding the numeric arrays
+# (mfcc, labels) split into shards of .npy files, and a small JSON manifest with everything else
+# (mapping, files, timestamp, duration) along with the list of shards and the description of the
+# arrays. The arrays can be memory-mapped, so loading even a very large traindata takes no time and
+# no more RAM than what is actually used. The shards are written one at a time while dataprep runs.
+TRAINDATA_MANIFEST = "manifest.json"
+TRAINDATA_ARRAYS   = "arrays"
+TRAINDATA_SHARDS   = "shards"
+SHARD_COUNT        = "count"
+
+# Journal of a traindata being written (see BinaryTraindataWriter), and the side directory of json traindata in the making
+TRAINDATA_JOURNAL  = "journal.json"
+TRAINDATA_PARTS    = ".parts"
+JOURNAL_KEY        = "key"
+JOURNAL_STATE      = "state"
+JOURNAL_RANGES     = "ranges"
+
+# Quantized storage of the feature sections: float16 halves the size of the float32 features, and int8 quarters it by
+# mapping each feature coefficient (along the last axis) linearly from its range over the whole traindata onto
+# [-127, 127]. float16 coefficients beyond the float16 range (e.g. those of power spectrograms, which go up to several
+# hundred thousands) are scaled down by a power of two, which keeps their float16 precision, rather than becoming inf.
+# The quantization parameters of each quantized section are kept in the traindata (manifest).
+TRAINDATA_QUANTIZATION = "quantization"
+FEATURE_DTYPES         = ["float32", "float16", "int8"]
+INT8_LEVELS            = 127
+FLOAT16_MAX            = float(np.finfo(np.float16).max) # 65504
+
+# HDF5 traindata format: a single .h5 file holding each array section as a dataset chunked along the samples (and
+# optionally compressed), so that any subset of samples is read by reading only the chunks it falls into. Along
+# with the arrays, the file keeps the sorted sample indices of every label, and for traindata that list the audio
+# file of each sample, the (unique) audio files with the index into them of each sample's file. Everything else
+# (mapping, timestamp, duration) is kept as JSON in an attribute of the file.
+TRAINDATA_H5_EXT   = ".h5"
+H5_META            = "meta"          # attribute: JSON of the non-array traindata sections
+H5_FILES_SECTION   = "files_section" # attribute: name of the traindata section listing the audio file of each sample
+H5_FILE_IDS        = "file_ids"      # dataset: index (into the audio files dataset) of the audio file of each sample
+H5_LABEL_INDEX     = "label_index"   # group: one dataset of sorted sample indices per label id
+H5_LABELS_SECTION  = "labels"
+H5_CHUNK_SAMPLES   = 256
+H5_COMPRESSIONS    = ["none", "gzip", "lzf"]
+
+# Checksums of the array sections of a traindata (see TraindataReader), kept in the traindata converted into another format:
+# SHA-1 of the samples of each section in its canonical dtype, which is the same whatever the format the traindata is stored in
+TRAINDATA_CHECKSUMS = "checksums"
+READ_BLOCK_SAMPLES  = 4096
+
+def is_binary_traindata(traindata_path):
+    return os.path.isfile(os.path.join(traindata_path, TRAINDATA_MANIFEST))
+
+def is_hdf5_traindata(traindata_path):
+    return os.path.isfile(traindata_path) and str(traindata_path).endswith(TRAINDATA_H5_EXT)
+
+def get_traindata_size(traindata_path):
+    """
+    Size in bytes of a traindata, be it a single (json) file or a (binary traindata) directory.
+    """
+    if os.path.isdir(traindata_path):
+        return sum(f.stat().st_size for f in os.scandir(traindata_path) if f.is_file())
+    return os.path.getsize(traindata_path)
+
+class BinaryTraindataWriter:
+    """
+    Streams traindata samples into the binary format, flushing the array sections to disk one shard at a time,
+    so that the memory needed stays bounded by the shard size regardless of the size of the whole traindata.
+    The manifest (which makes the traindata loadable) is only written on close().
+
+    Unless disabled, the writer also keeps a journal of the shards written so far, along with the caller's state
+    at the time of each shard (e.g. how many audio files dataprep had gone through). A writer opened on the same
+    traindata with the same journal key after an interrupted run picks up from the last shard of that run.
+    """
+    def __init__(self, traindata_dir, array_dtypes, shard_size=0, journal_key=None, resume=False, quantize=None):
+        """
+        :param traindata_dir  (str): Directory to save the traindata into.
+        :param  array_dtypes (dict): Section name -> dtype of the corresponding .npy arrays.
+        :param    shard_size  (int): Write a shard at the first checkpoint() with at least this many samples buffered (0 = only on flush()).
+        :param   journal_key (dict): Whatever determines the traindata contents (e.g. the dataprep arguments), or None to keep no journal.
+        :param        resume (bool): Resume from the journal of a previous run with the same journal key, if any.
+        :param      quantize (dict): Section name -> dtype (see FEATURE_DTYPES) to store float32 sections in, if any.
+        """
+        self.traindata_dir = traindata_dir
+        self.array_dtypes  = array_dtypes
+        self.shard_size    = shard_size
+        self.journal_key   = journal_key
+        self.quantize      = {key: dtype for key, dtype in (quantize or {}).items() if dtype != "float32"}
+        self.buffers       = {key: [] for key in array_dtypes}
+        self.shards        = []
+        self.arrays        = {}
+        self.ranges        = {} # quantized section name -> [min, max] of each coefficient so far
+        self.replaced      = [] # float32 shards replaced by quantized ones, removed once the manifest is written
+        self.resumed_state = None # state passed to the last flush() of the resumed run
+        Path(traindata_dir).mkdir(parents=True, exist_ok=True)
+
+        journal = self.load_journal() if resume else None
+        if journal is not None and journal[JOURNAL_KEY] == journal_key:
+            self.shards        = journal[TRAINDATA_SHARDS]
+            self.arrays        = journal[TRAINDATA_ARRAYS]
+            self.ranges        = journal.get(JOURNAL_RANGES, {})
+            self.resumed_state = journal[JOURNAL_STATE]
+            return
+
+        # drop the previous traindata of the same id, manifest first so that it is never loaded half-overwritten
+        for filename in [TRAINDATA_MANIFEST, TRAINDATA_JOURNAL] + [f for f in os.listdir(traindata_dir) if f.endswith(".npy")]:
+            if os.path.exists(os.path.join(traindata_dir, filename)):
+                os.remove(os.path.join(traindata_dir, filename))
+
+    def load_journal(self):
+        journal_path = os.path.join(self.traindata_dir, TRAINDATA_JOURNAL)
+        if not os.path.exists(journal_path):
+            return None
+        with open(journal_path, "r") as file:
+            return json.load(file)
+
+    def save_journal(self, state):
+        journal = { JOURNAL_KEY: self.journal_key, TRAINDATA_ARRAYS: self.arrays, TRAINDATA_SHARDS: self.shards, JOURNAL_RANGES: self.ranges,
+                    JOURNAL_STATE: state }
+        with atomic_file(os.path.join(self.traindata_dir, TRAINDATA_JOURNAL)) as file: # the journal is always complete
+            json.dump(journal, file)
+
+    def num_buffered(self):
+        return len(self.buffers[next(iter(self.array_dtypes))])
+
+    def append(self, sample):
+        """
+        :param sample (dict): Section name -> value of this sample (e.g. its MFCC array or label) for every array section.
+        """
+        for key, value in sample.items():
+            self.buffers[key].append(value)
+
+    def extend(self, samples):
+        """
+        :param samples (dict): Section name -> values of a block of samples (e.g. an array of MFCC arrays) for every array section.
+        """
+        for key, values in samples.items():
+            self.buffers[key].extend(values)
+
+    def checkpoint(self, state=None):
+        """
+        To be called between audio files: writes a shard once at least shard_size samples are buffered. Shards thus
+        never split the samples of one audio file, and a resumed run can always carry on from an audio file boundary.
+            :param state (dict): Caller's (JSON-serializable) state to journal along with the shard, if one is written.
+        """
+        if self.shard_size and self.num_buffered() >= self.shard_size:
+            self.flush(state)
+
+    def flush(self, state=None):
+        count = self.num_buffered()
+        if count == 0:
+            return
+        shard = {SHARD_COUNT: count}
+        for key, dtype in self.array_dtypes.items():
+            array = np.asarray(self.buffers[key], dtype=dtype)
+            shard[key] = "{}_{:05d}.npy".format(key, len(self.shards))
+            np.save(os.path.join(self.traindata_dir, shard[key]), array)
+            self.arrays[key] = {"dtype": array.dtype.str, "shape": [0] + list(array.shape[1:])}
+            self.buffers[key] = []
+            if key in self.quantize:
+                self.update_range(key, array)
+        self.shards.append(shard)
+        if self.journal_key is not None:
+            self.save_journal(state)
+
+    def update_range(self, key, array):
+        axes = tuple(range(array.ndim - 1)) # all but the coefficients axis
+        lo, hi = array.min(axis=axes), array.max(axis=axes)
+        if key in self.ranges:
+            lo, hi = np.minimum(lo, self.ranges[key][0]), np.maximum(hi, self.ranges[key][1])
+        self.ranges[key] = [lo.tolist(), hi.tolist()]
+
+    def quantize_shards(self):
+        """
+        Rewrites the shards of the quantized sections in their storage dtype, now that the range of every coefficient over
+        the whole traindata is known. The float32 shards are only removed on close() (until then, the journal refers to them).
+            :return (dict): Quantized section name -> its quantization parameters (see compose_quantization()).
+        """
+        quantization = {}
+        for key, dtype in self.quantize.items():
+            if key not in self.ranges: # no samples
+                continue
+            quantization[key] = compose_quantization(dtype, *self.ranges[key])
+            for i, shard in enumerate(self.shards):
+                quantized_name = "{}_{}_{:05d}.npy".format(key, dtype, i)
+                array = np.load(os.path.join(self.traindata_dir, shard[key]))
+                np.save(os.path.join(self.traindata_dir, quantized_name), quantize_array(array, quantization[key]))
+                self.replaced.append(shard[key])
+                shard[key] = quantized_name
+            self.arrays[key]["dtype"] = np.dtype(dtype).str
+        return quantization
+
+    def close(self, traindata):
+        """
+        Flushes the last shard, writes the manifest and drops the journal.
+            :param traindata (dict): All the other (JSON-serializable) traindata sections.
+        """
+        self.flush()
+        quantization = self.quantize_shards()
+        if quantization:
+            traindata = {**traindata, TRAINDATA_QUANTIZATION: quantization}
+        for array in self.arrays.values():
+            array["shape"][0] = sum(shard[SHARD_COUNT] for shard in self.shards)
+        manifest = {key: value for key, value in traindata.items() if key not in self.array_dtypes}
+        manifest[TRAINDATA_ARRAYS] = self.arrays
+        manifest[TRAINDATA_SHARDS] = self.shards
+        print_info("|||||| Writing binary traindata", quote_path(self.traindata_dir), "({} shards) ... ".format(len(self.shards)), end="")
+        with atomic_file(os.path.join(self.traindata_dir, TRAINDATA_MANIFEST)) as file: # never seen half-written by a loader
+            json.dump(manifest, file, indent=4)
+        print_info("[DONE]")
+        for filename in self.replaced:
+            os.remove(os.path.join(self.traindata_dir, filename))
+        if os.path.exists(os.path.join(self.traindata_dir, TRAINDATA_JOURNAL)):
+            os.remove(os.path.join(self.traindata_dir, TRAINDATA_JOURNAL))
+
+class JsonTraindataWriter:
+    """
+    Writes traindata into a single legacy json file. Samples are streamed into binary shards in a side
+    directory first (which keeps the run resumable), and only turned into json all at once on close().
+    """
+    def __init__(self, traindata_fullpath, array_dtypes, shard_size=0, journal_key=None, resume=False, quantize=None):
+        self.traindata_fullpath = traindata_fullpath
+        self.parts = BinaryTraindataWriter(traindata_fullpath + TRAINDATA_PARTS, array_dtypes, shard_size, journal_key, resume, quantize)
+        self.resumed_state = self.parts.resumed_state
+
+    def append(self, sample):
+        self.parts.append(sample)
+
+    def extend(self, samples):
+        self.parts.extend(samples)
+
+    def checkpoint(self, state=None):
+        self.parts.checkpoint(state)
+
+    def flush(self, state=None):
+        self.parts.flush(state)
+
+    def close(self, traindata):
+        self.parts.flush()
+        quantization = self.parts.quantize_shards()
+        if quantization:
+            traindata[TRAINDATA_QUANTIZATION] = quantization
+        shards = [{key: np.load(os.path.join(self.parts.traindata_dir, shard[key])) for key in self.parts.array_dtypes}
+                  for shard in self.parts.shards]
+        for key in self.parts.array_dtypes:
+            traindata[key] = [sample for shard in shards for sample in shard[key].tolist()] # MFCC arrays become nested lists
+        with open(self.traindata_fullpath, "w") as data_file:
+            print_info("|||||| Writing file", quote_path(self.traindata_fullpath), "... ", end="")
+            json.dump(traindata, data_file, indent=4)
+            print_info("[DONE]")
+        shutil.rmtree(self.parts.traindata_dir)
+
+class Hdf5TraindataWriter:
+    """
+    Writes traindata into a single HDF5 file. As with json traindata, samples are streamed into binary shards in a side
+    directory first (which keeps the run resumable), and only copied into the HDF5 file, one shard at a time, on close().
+    """
+    def __init__(self, traindata_fullpath, array_dtypes, shard_size=0, journal_key=None, resume=False, quantize=None, compression=None, files_section=None):
+        """
+        :param   compression  (str): HDF5 compression filter of the array datasets (see H5_COMPRESSIONS), None or "none" for none.
+        :param files_section  (str): Name of the traindata section listing the audio file of each sample, if any.
+        """
+        self.traindata_fullpath = traindata_fullpath
+        self.compression   = None if compression == "none" else compression
+        self.files_section = files_section
+        self.parts = BinaryTraindataWriter(traindata_fullpath + TRAINDATA_PARTS, array_dtypes, shard_size, journal_key, resume, quantize)
+        self.resumed_state = self.parts.resumed_state
+
+    def append(self, sample):
+        self.parts.append(sample)
+
+    def extend(self, samples):
+        self.parts.extend(samples)
+
+    def checkpoint(self, state=None):
+        self.parts.checkpoint(state)
+
+    def flush(self, state=None):
+        self.parts.flush(state)
+
+    def close(self, traindata):
+        self.parts.flush()
+        quantization = self.parts.quantize_shards()
+        if quantization:
+            traindata = {**traindata, TRAINDATA_QUANTIZATION: quantization}
+        count = sum(shard[SHARD_COUNT] for shard in self.parts.shards)
+        files = traindata.get(self.files_section) if self.files_section else None
+        print_info("|||||| Writing HDF5 traindata", quote_path(self.traindata_fullpath), "... ", end="")
+        with atomic_path(self.traindata_fullpath) as tmp_path, h5py.File(tmp_path, "w") as h5: # the traindata is never loaded half-written
+            for key, array in self.parts.arrays.items():
+                shape = [count] + array["shape"][1:]
+                h5.create_dataset(key, shape=shape, maxshape=[None] + shape[1:], dtype=array["dtype"], compression=self.compression,
+                                  chunks=tuple([max(min(H5_CHUNK_SAMPLES, count), 1)] + shape[1:]))
+            start = 0
+            for shard in self.parts.shards: # one shard in memory at a time
+                for key in self.parts.array_dtypes:
+                    h5[key][start : start + shard[SHARD_COUNT]] = np.load(os.path.join(self.parts.traindata_dir, shard[key]))
+                start += shard[SHARD_COUNT]
+            labels = h5[H5_LABELS_SECTION][...] if H5_LABELS_SECTION in h5 else np.zeros(0, dtype=np.int32)
+            label_index = h5.create_group(H5_LABEL_INDEX)
+            for label in np.unique(labels):
+                label_index.create_dataset(str(label), data=np.flatnonzero(labels == label))
+            if files is not None and len(files) == count:
+                unique_files, file_ids = np.unique(np.array(files, dtype=str), return_inverse=True)
+                h5.create_dataset(self.files_section, data=unique_files.astype(object), dtype=h5py.string_dtype())
+                h5.create_dataset(H5_FILE_IDS, data=file_ids.astype(np.int32), chunks=True, compression=self.compression)
+                h5.attrs[H5_FILES_SECTION] = self.files_section
+            h5.attrs[H5_META] = json.dumps({key: value for key, value in traindata.items()
+                                            if key not in self.parts.array_dtypes and key != self.files_section})
+        print_info("[DONE]")
+        shutil.rmtree(self.parts.traindata_dir)
+
+class Hdf5Traindata:
+    """
+    Random access to a traindata in the HDF5 format: only the chunks holding the requested samples are read (and decompressed),
+    so that one label, or the samples of a few audio files, can be read out of a traindata of any size in no time.
+    """
+    def __init__(self, traindata_path):
+        self.h5   = h5py.File(traindata_path, "r")
+        self.meta = json.loads(self.h5.attrs[H5_META])
+        self.files_section = self.h5.attrs.get(H5_FILES_SECTION)
+        self.files = [f.decode() if isinstance(f, bytes) else f for f in self.h5[self.files_section][...]] if self.files_section else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.h5[H5_LABELS_SECTION])
+
+    def close(self):
+        self.h5.close()
+
+    def sections(self):
+        """ :return (list): Names of the array sections (features and labels). """
+        return [key for key, value in self.h5.items() if isinstance(value, h5py.Dataset) and key not in (H5_FILE_IDS, self.files_section)]
+
+    def labels(self):
+        return sorted(int(label) for label in self.h5[H5_LABEL_INDEX])
+
+    def select(self, labels=None, files=None):
+        """
+        Indices of the samples of the given labels and/or audio files (all the samples if neither is given).
+            :param labels (list): Label ids.
+            :param  files (list): Audio file paths, as listed in the traindata (files section).
+            :return (ndarray): Sorted sample indices.
+        """
+        selected = np.arange(len(self))
+        if labels is not None:
+            label_index = self.h5[H5_LABEL_INDEX]
+            selected = np.concatenate([label_index[str(label)][...] for label in labels if str(label) in label_index] or [np.zeros(0, np.int64)])
+        if files is not None:
+            if self.files is None:
+                raise ValueError("Traindata " + quote(self.h5.filename) + " does not list the audio files of its samples")
+            file_ids = {f: i for i, f in enumerate(self.files)}
+            wanted   = [file_ids[str(f)] for f in files if str(f) in file_ids]
+            selected = np.intersect1d(selected, np.flatnonzero(np.isin(self.h5[H5_FILE_IDS][...], wanted)))
+        return np.unique(selected)
+
+    def read(self, section, indices=None):
+        """
+        :param section   (str): Array section (e.g. "mfcc" or "labels").
+        :param indices (array): Sorted sample indices (see select()), or None for all the samples.
+        :return (ndarray): The section for those samples.
+        """
+        dataset = self.h5[section]
+        if indices is None:
+            return dataset[...]
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return np.empty((0,) + dataset.shape[1:], dtype=dataset.dtype)
+        if indices[-1] - indices[0] + 1 == len(indices): # a contiguous range is read as a (much faster) slice
+            return dataset[indices[0] : indices[-1] + 1]
+        return dataset[indices]
+
+    def sample_files(self, indices=None):
+        """ :return (list): The audio file of each sample (of the given indices). """
+        file_ids = self.read(H5_FILE_IDS, indices)
+        return [self.files[i] for i in file_ids]
+
+def load_traindata_hdf5(traindata_path, labels=None, files=None):
+    """
+    Loads (a subset of) a traindata saved in the HDF5 format into memory.
+        :param labels (list): Only the samples of these label ids, or None for all.
+        :param  files (list): Only the samples of these audio files, or None for all.
+        :return (dict): Traindata sections, with the array sections as numpy arrays.
+    """
+    with Hdf5Traindata(traindata_path) as h5:
+        indices   = None if labels is None and files is None else h5.select(labels, files)
+        traindata = dict(h5.meta)
+        for section in h5.sections():
+            traindata[section] = h5.read(section, indices)
+        if h5.files_section:
+            traindata[h5.files_section] = h5.sample_files(indices)
+    return traindata
+
+def compose_quantization(dtype, lo, hi):
+    """
+    :param lo, hi (list): Minimum and maximum of each feature coefficient over the whole traindata.
+    :return (dict): Quantization parameters of a feature section stored in dtype (int8 maps each coefficient's range onto [-127, 127],
+                    float16 scales down the coefficients beyond its range, if any).
+    """
+    lo, hi = np.asarray(lo, dtype=np.float64), np.asarray(hi, dtype=np.float64)
+    if dtype == "float16":
+        peak  = np.maximum(np.abs(lo), np.abs(hi))
+        scale = 2.0 ** np.maximum(np.ceil(np.log2(np.maximum(peak, np.finfo(np.float32).tiny) / FLOAT16_MAX)), 0)
+        if not np.any(scale > 1):
+            return {"dtype": dtype}
+        return {"dtype": dtype, "scale": scale.tolist(), "offset": np.zeros_like(scale).tolist()}
+    if dtype != "int8":
+        return {"dtype": dtype}
+    scale  = np.maximum((hi - lo) / (2 * INT8_LEVELS), np.finfo(np.float32).tiny) # constant coefficients all quantize to 0
+    return {"dtype": dtype, "scale": scale.tolist(), "offset": ((hi + lo) / 2).tolist()}
+
+def quantize_array(array, quantization):
+    if "scale" in quantization:
+        array = (array - np.float32(quantization["offset"])) / np.float32(quantization["scale"])
+    if quantization["dtype"] == "int8":
+        array = np.clip(np.round(array), -INT8_LEVELS, INT8_LEVELS)
+    elif quantization["dtype"] == "float16":
+        array = np.clip(array, -FLOAT16_MAX, FLOAT16_MAX) # never inf, even for values beyond the range the scale was composed for
+    return array.astype(quantization["dtype"])
+
+def dequantize_array(array, quantization):
+    """ :return (ndarray): The float32 features of the quantized array. """
+    array = np.asarray(array, dtype=np.float32)
+    if "scale" in quantization:
+        array *= np.asarray(quantization["scale"], dtype=np.float32)
+        array += np.asarray(quantization["offset"], dtype=np.float32)
+    return array
+
+class QuantizedArray:
+    """
+    Quantized features, only dequantized (into float32) when actually read. Selecting samples (with an index array or a
+    slice, as train_test_split() does) gives a QuantizedArray of those samples, still quantized, and so does adding a
+    trailing channel axis with [..., np.newaxis]. dequantize() (or np.asarray()) gives the float32 features. Training can
+    thus keep the features quantized in memory, a quarter (int8) or half (float16) of the size, and dequantize batch by batch.
+    """
+    def __init__(self, data, quantization, channel=False):
+        self.data         = data
+        self.quantization = quantization
+        self.channel      = channel # dequantized features get a trailing channel axis
+        self.dtype        = np.dtype(np.float32)
+
+    @property
+    def shape(self):
+        return self.data.shape + ((1,) if self.channel else ())
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and len(key) == 2 and key[0] is Ellipsis and key[1] is None:
+            return QuantizedArray(self.data, self.quantization, channel=True)
+        return QuantizedArray(self.data[key], self.quantization, self.channel)
+
+    def dequantize(self):
+        array = dequantize_array(self.data, self.quantization)
+        return array[..., np.newaxis] if self.channel else array
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.dequantize()
+        return array if dtype is None else array.astype(dtype)
+
+def as_features(array, quantization=None, dequantize=True):
+    """
+    The features of a traindata section as they were stored: as they are if not quantized, else
+    either dequantized right away or wrapped into a QuantizedArray (dequantized when read).
+    """
+    if quantization is None:
+        return array
+    if dequantize:
+        return dequantize_array(array, quantization)
+    if isinstance(array, ShardedArray): # stays on disk, read (and dequantized) as indexed
+        return QuantizedArray(array, quantization)
+    return QuantizedArray(np.asarray(array, dtype=quantization["dtype"]), quantization)
+
+# Streaming loader of legacy json traindata: the numeric sections (features, labels) are parsed chunk by chunk straight
+# into preallocated numpy arrays, so that peak memory stays close to the size of the arrays themselves (json.load would
+# build a Python float object per coefficient first). Only the few top level keys are tokenized one by one: arrays of
+# numbers contain no strings, so their extent, number of elements and numbers are all found vectorized, a chunk at a time.
+JSON_CHUNK_SIZE   = 4 * 1024 * 1024
+JSON_SEPARATORS   = bytes.maketrans(b"[],\n\r\t", b"      ") # everything in an array of numbers but the numbers themselves
+JSON_SKIP_TOKENS  = re.compile(rb'"(?:[^"\\]|\\.)*(?:(")|\\?\Z)|[\[\]{}]') # strings (group 1 unless cut by the end of the chunk) and brackets
+JSON_KEY          = re.compile(rb'\s*([{,])\s*"((?:[^"\\]|\\.)*)"\s*:\s*')
+JSON_VALUE_START  = re.compile(rb'[\s\[]*(.)', re.DOTALL)
+
+def scan_json_numbers(file, start):
+    """
+    Scans an array of numbers (of any nesting) starting with the "[" at offset start.
+        :return (tuple): Offset right after its closing "]", the json text of its first element (empty if there is none),
+                         and the offsets of the commas between its elements.
+    """
+    file.seek(start)
+    depth, separators, offset, first, first_done = 0, [], start, bytearray(), False
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("Unexpected end of json traindata " + quote(file.name))
+        a        = np.frombuffer(chunk, dtype=np.uint8)
+        brackets = np.flatnonzero((a == ord("[")) | (a == ord("]")))
+        depths   = depth + np.cumsum(np.where(a[brackets] == ord("["), 1, -1)) # depth right after each bracket
+        ends     = np.flatnonzero(depths == 0)
+        size     = brackets[ends[0]] + 1 if len(ends) else len(a)
+        commas   = np.flatnonzero(a[:size] == ord(","))
+        before   = np.searchsorted(brackets, commas) - 1 # the last bracket before each comma, -1 if none in this chunk
+        top      = commas[np.append(depths, depth)[before] == 1] # the commas between elements (index -1 being the depth the chunk starts at)
+        separators.append(offset + top)
+        if not first_done: # the first element goes up to the first comma, or to the closing "]" if it is the only one
+            first += chunk[: top[0] if len(top) else (size - 1 if len(ends) else size)]
+            first_done = len(top) > 0 or len(ends) > 0
+        if len(ends):
+            first = bytes(first[1:]).strip() # without the opening "["
+            return offset + size, first, np.concatenate(separators)
+        depth   = int(depths[-1]) if len(depths) else depth
+        offset += len(chunk)
+
+def parse_json_numbers(file, start, end, out):
+    """
+    Parses all the numbers between offsets start and end of the file into the (flat, preallocated) array out.
+    """
+    file.seek(start)
+    pos, tail, remaining = 0, b"", end - start
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning) # numpy warns (rather than fails) on text that is not a number
+        while remaining > 0:
+            chunk      = file.read(min(JSON_CHUNK_SIZE, remaining))
+            remaining -= len(chunk)
+            chunk      = (tail + chunk).translate(JSON_SEPARATORS)
+            cut        = chunk.rfind(b" ") + 1 if remaining > 0 else len(chunk) # a number may go on in the next chunk
+            chunk, tail = chunk[:cut], chunk[cut:]
+            if not chunk.strip(): # numpy would read a bogus number out of nothing but whitespace
+                continue
+            values = np.fromstring(chunk, dtype=out.dtype, sep=" ")
+            if pos + len(values) > out.size:
+                raise ValueError("Arrays of unequal shapes in json traindata " + quote(file.name))
+            out[pos : pos + len(values)] = values
+            pos += len(values)
+    if pos != out.size:
+        raise ValueError("Arrays of unequal shapes in json traindata " + quote(file.name))
+
+def skip_json_value(file, start):
+    """ :return (int): Offset right after the json value (string, array or object) starting at offset start. """
+    file.seek(start)
+    depth, offset, buffer = 0, start, b""
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("Unexpected end of json traindata " + quote(file.name))
+        buffer, consumed = buffer + chunk, 0
+        for token in JSON_SKIP_TOKENS.finditer(buffer):
+            if token.group().startswith(b'"') and token.group(1) is None:
+                break # a string cut by the end of the chunk, carried over to the next one
+            depth += {b"[": 1, b"{": 1, b"]": -1, b"}": -1}.get(token.group(), 0)
+            consumed = token.end()
+            if depth == 0:
+                return offset + consumed
+        offset += consumed
+        buffer  = buffer[consumed:]
+
+def parse_json_elements(args):
+    """
+    Parses elements first to last (excluded) of an array of numbers into the same elements of a .npy file (in a worker process).
+        :param args (tuple): json file path, start and end offsets of the array, offsets of the commas between its elements,
+                             first and last element, and path of the .npy file to parse them into.
+    """
+    traindata_path, start, end, separators, first, last, npy_path = args
+    out = np.load(npy_path, mmap_mode="r+")
+    begin = separators[first - 1] + 1 if first > 0 else start + 1
+    stop  = separators[last - 1] if last < len(out) else end - 1
+    with open(traindata_path, "rb") as file:
+        parse_json_numbers(file, begin, stop, out[first:last].reshape(-1))
+    out.flush()
+
+def load_traindata_json(traindata_path, array_dtypes=None, sections=None, out_dir=None, workers=1):
+    """
+    Loads sections of a legacy json traindata with bounded peak memory (see scan_json_numbers()).
+        :param array_dtypes (dict): Name -> dtype of the array sections (of numbers) to parse into numpy arrays, None for all of them in float32.
+        :param     sections (list): Names of other (small) sections to parse as they are, if present, None for all of them.
+        :param      out_dir  (str): Parse the arrays into memory-mapped .npy files in this directory instead of into memory,
+                                    so that not even the arrays themselves need to fit into memory.
+        :param      workers  (int): Number of processes parsing (ranges of elements of) each array in parallel, if parsed into out_dir.
+        :return (dict): The requested sections found in the traindata.
+    """
+    traindata = {}
+    with open(traindata_path, "rb") as file:
+        offset = 0
+        while True:
+            file.seek(offset)
+            head = file.read(4096)
+            key  = JSON_KEY.match(head)
+            if key is None:
+                break # the closing brace, all keys done
+            name   = json.loads(b'"' + key.group(2) + b'"')
+            offset = offset + key.end()
+            kind   = JSON_VALUE_START.match(head, key.end()).group(1) if head[key.end() : key.end() + 1] == b"[" else None
+            wanted = array_dtypes is None or name in array_dtypes
+            if kind is not None and kind not in b'"{]': # an array of numbers
+                end, first, separators = scan_json_numbers(file, offset)
+                if wanted:
+                    dtype = array_dtypes[name] if array_dtypes is not None else "float32"
+                    shape = (len(separators) + 1,) + np.shape(json.loads(first)) if first else (0,)
+                    if out_dir is None:
+                        out = np.empty(shape, dtype=dtype)
+                        parse_json_numbers(file, offset, end, out.reshape(-1))
+                    else:
+                        npy_path = os.path.join(out_dir, name + ".npy")
+                        np.lib.format.open_memmap(npy_path, mode="w+", dtype=dtype, shape=shape).flush()
+                        ranges = np.linspace(0, shape[0], max(workers, 1) + 1).astype(int)
+                        jobs   = [(traindata_path, offset, end, separators, first, last, npy_path) for first, last in zip(ranges[:-1], ranges[1:]) if last > first]
+                        if workers > 1 and len(jobs) > 1:
+                            with multiprocessing.Pool(workers) as pool:
+                                pool.map(parse_json_elements, jobs)
+                        else:
+                            for job in jobs:
+                                parse_json_elements(job)
+                        out = np.load(npy_path, mmap_mode="r")
+                    traindata[name] = out
+            else:
+                end = skip_json_value(file, offset) if head[key.end() : key.end() + 1] in (b'"', b"[", b"{") else \
+                      offset + re.match(rb"[^,}\s]*", head[key.end():]).end() # numbers, true, false, null
+                if sections is None or name in sections or (array_dtypes is not None and name in array_dtypes):
+                    file.seek(offset)
+                    value = json.loads(file.read(end - offset))
+                    traindata[name] = np.asarray(value, dtype=array_dtypes[name]) if array_dtypes is not None and name in array_dtypes else value
+            offset = end
+    return traindata
+
+def load_traindata_manifest(traindata_dir):
+    with open(os.path.join(traindata_dir, TRAINDATA_MANIFEST), "r") as file:
+        return json.load(file)
+
+def get_manifest_shards(manifest):
+    """
+    :return (list): The shards listed in the manifest of a binary traindata. Binary traindata from before shards (one .npy
+                    file per array section, named in the description of the array) make a single shard.
+    """
+    if TRAINDATA_SHARDS in manifest:
+        return manifest[TRAINDATA_SHARDS]
+    arrays = manifest[TRAINDATA_ARRAYS]
+    if not arrays:
+        return []
+    return [{**{key: array["file"] for key, array in arrays.items()}, SHARD_COUNT: next(iter(arrays.values()))["shape"][0]}]
+
+def load_traindata_shards(traindata_dir, mmap_mode="r"):
+    """
+    Loads the shards of a traindata saved in the binary format.
+        :param traindata_dir (str): Directory the traindata was saved into.
+        :param     mmap_mode (str): Memory-map the arrays in this mode (see numpy.load), or None to read them into memory.
+        :return (list): For each shard, a dict of array section name -> (memory-mapped) numpy array.
+    """
+    manifest = load_traindata_manifest(traindata_dir)
+    return [{key: np.load(os.path.join(traindata_dir, shard[key]), mmap_mode=mmap_mode) for key in manifest[TRAINDATA_ARRAYS]}
+            for shard in get_manifest_shards(manifest)]
+
+def load_traindata_binary(traindata_dir, mmap_mode="r"):
+    """
+    Loads traindata saved in the binary format. Single-shard arrays are memory-mapped, arrays split into several
+    shards are ShardedArray views of their memory-mapped shards (never concatenated, only the samples read are loaded).
+        :param traindata_dir (str): Directory the traindata was saved into.
+        :param     mmap_mode (str): Memory-map the arrays in this mode (see numpy.load), or None to read them into memory.
+        :return (dict): Traindata sections, with the array sections as numpy arrays or ShardedArray.
+    """
+    traindata = load_traindata_manifest(traindata_dir)
+    shards    = load_traindata_shards(traindata_dir, mmap_mode)
+    traindata.pop(TRAINDATA_SHARDS, None)
+    for key, array in traindata.pop(TRAINDATA_ARRAYS).items():
+        if len(shards) == 1:
+            traindata[key] = shards[0][key]
+        else:
+            traindata[key] = ShardedArray([shard[key] for shard in shards], array["dtype"], array["shape"][1:])
+    return traindata
+
+class ShardedArray:
+    """
+    An array section of a traindata, split into shards (memory-mapped .npy files or HDF5 datasets), read a few samples at a
+    time without the shards ever being concatenated: take() only reads the requested samples, out of the shards holding them.
+    Indexing (with an int, a slice or an index array) reads the samples the same way, np.asarray() reads them all.
+    """
+    def __init__(self, shards, dtype, sample_shape):
+        """
+        :param        shards (list): The section of each shard (anything sliceable with sorted index arrays).
+        :param           dtype (str): dtype the samples are read into.
+        :param sample_shape (tuple): Shape of a single sample.
+        """
+        self.shards  = shards
+        self.offsets = np.cumsum([0] + [len(shard) for shard in shards])
+        self.dtype   = np.dtype(dtype)
+        self.shape   = (int(self.offsets[-1]),) + tuple(sample_shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.take([key % len(self)])[0]
+        indices = np.arange(len(self))[key] if isinstance(key, slice) else np.arange(len(self))[np.asarray(key)] # negative, boolean
+        order   = np.argsort(indices, kind="stable")
+        samples = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+        samples[order] = self.take(indices[order])
+        return samples
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.take(np.arange(len(self)))
+        return array if dtype is None else array.astype(dtype)
+
+    def take(self, indices):
+        """
+        :param indices (ndarray): Sorted (unique) sample indices.
+        :return (ndarray): Those samples, in that order.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        samples = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+        bounds  = np.searchsorted(indices, self.offsets)
+        for shard, offset, lo, hi in zip(self.shards, self.offsets, bounds[:-1], bounds[1:]):
+            if hi > lo:
+                local = indices[lo:hi] - offset
+                if local[-1] - local[0] + 1 == len(local): # a contiguous range is read as a (much faster) slice
+                    samples[lo:hi] = shard[local[0] : local[-1] + 1]
+                else:
+                    samples[lo:hi] = shard[local]
+        return samples
+
+class TraindataReader:
+    """
+    Reads a traindata of any format (binary, HDF5 or json) a block of samples at a time, so that even a traindata larger
+    than memory can be converted or checked. The array sections of a json traindata are parsed (in parallel) into
+    memory-mapped .npy files in a scratch directory next to it first, which is removed on close().
+    """
+    def __init__(self, traindata_path, workers=1):
+        """
+        :param traindata_path (str): Path to the traindata (binary traindata directory, HDF5 or json file).
+        :param        workers (int): Number of processes parsing the arrays of a json traindata.
+        """
+        self.traindata_path = traindata_path
+        self.h5      = None
+        self.scratch = None
+        if is_binary_traindata(traindata_path):
+            self.sections = load_traindata_manifest(traindata_path)
+            self.shards   = load_traindata_shards(traindata_path)
+            self.arrays   = self.sections.pop(TRAINDATA_ARRAYS)
+            self.sections.pop(TRAINDATA_SHARDS, None)
+        elif is_hdf5_traindata(traindata_path):
+            self.h5       = Hdf5Traindata(traindata_path)
+            self.sections = dict(self.h5.meta)
+            if self.h5.files_section:
+                self.sections[self.h5.files_section] = self.h5.sample_files()
+            self.shards   = [{key: self.h5.h5[key] for key in self.h5.sections()}]
+            self.arrays   = {key: {"dtype": dataset.dtype.str, "shape": list(dataset.shape)} for key, dataset in self.shards[0].items()}
+        else:
+            self.scratch  = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(traindata_path)), suffix=TRAINDATA_PARTS)
+            traindata     = load_traindata_json(traindata_path, None, None, self.scratch, workers)
+            self.sections = {key: value for key, value in traindata.items() if not isinstance(value, np.ndarray)}
+            self.shards   = [{key: value for key, value in traindata.items() if isinstance(value, np.ndarray)}]
+            self.arrays   = {key: {"dtype": array.dtype.str, "shape": list(array.shape)} for key, array in self.shards[0].items()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return sum(len(shard[H5_LABELS_SECTION]) for shard in self.shards)
+
+    def close(self):
+        self.shards = []
+        if self.h5 is not None:
+            self.h5.close()
+        if self.scratch is not None:
+            shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def canonical_dtype(self, section):
+        """
+        :return (str): dtype the section is stored in (the quantized dtype of quantized features, float32 for the other features,
+                       int32 for the labels), which json traindata (where all numbers are just numbers) are read back into.
+        """
+        if section == H5_LABELS_SECTION:
+            return "int32"
+        return self.sections.get(TRAINDATA_QUANTIZATION, {}).get(section, {}).get("dtype", "float32")
+
+    def sample_shape(self, section):
+        return tuple(self.arrays[section]["shape"][1:])
+
+    def array(self, section):
+        """ :return (ShardedArray): Random access to the samples of an array section, in its canonical dtype, across all the shards. """
+        return ShardedArray([shard[section] for shard in self.shards], self.canonical_dtype(section), self.sample_shape(section))
+
+    def blocks(self, block_size=READ_BLOCK_SAMPLES):
+        """
+        :return (generator): For each block of (up to block_size) consecutive samples, a dict of
+                             array section name -> its samples in the canonical dtype of the section.
+        """
+        for shard in self.shards:
+            for start in range(0, len(shard[H5_LABELS_SECTION]), block_size):
+                yield {key: np.asarray(array[start : start + block_size], dtype=self.canonical_dtype(key)) for key, array in shard.items()}
+
+def compute_checksums(blocks):
+    """
+    :param blocks (iterable): Blocks of samples (see TraindataReader.blocks()).
+    :return (dict): Array section name -> SHA-1 hex digest of all its samples.
+    """
+    hashes = {}
+    for block in blocks:
+        for key, array in block.items():
+            hashes.setdefault(key, hashlib.sha1()).update(np.ascontiguousarray(array).data)
+    return {key: sha1.hexdigest() for key, sha1 in hashes.items()}
+
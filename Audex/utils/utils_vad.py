@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+# Energy based voice activity detection: the signal is cut into short non-overlapping frames, and a frame counts
+# as speech if it is loud enough, or a bit quieter but noise-like (a high zero crossing rate, as in unvoiced
+# sounds such as the "s" of "six" or the "f" of "four", which carry little energy). Everything is vectorized
+# over all the frames of the signal at once, so gating even hours of audio takes a fraction of a second.
+VAD_FRAME_MS      = 20   # length of the frames the speech decision is made for
+VAD_THRESHOLD_DB  = -40  # frames at least this loud (RMS in dB relative to full scale) are speech
+VAD_UNVOICED_DB   = 10   # noise-like frames count as speech down to this many dB below the threshold
+VAD_UNVOICED_ZCR  = 0.25 # zero crossing rate (per sample) above which a frame is noise-like
+VAD_MIN_SPEECH_MS = 100  # shorter bursts of speech frames are clicks and pops rather than speech
+
+def frame_levels(signal, sample_rate, frame_ms=VAD_FRAME_MS):
+    """
+    :return (tuple): RMS energy in dBFS and zero crossing rate of each (non-overlapping) frame of the signal.
+    """
+    frame_length = int(sample_rate * frame_ms / 1000)
+    num_frames   = len(signal) // frame_length
+    frames       = signal[:num_frames * frame_length].reshape(num_frames, frame_length) # a view, no copy
+    energy       = np.einsum("ij,ij->i", frames, frames) / frame_length # no (frames, samples) sized temporary
+    energy_db    = 10 * np.log10(energy + 1e-10)
+    signs        = np.signbit(frames)
+    zcr          = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frame_length - 1)
+    return energy_db, zcr
+
+def detect_speech(signal, sample_rate, threshold_db=VAD_THRESHOLD_DB, frame_ms=VAD_FRAME_MS):
+    """
+    :return (ndarray): Boolean speech decision for each frame of the signal.
+    """
+    energy_db, zcr = frame_levels(signal, sample_rate, frame_ms)
+    return (energy_db > threshold_db) | ((energy_db > threshold_db - VAD_UNVOICED_DB) & (zcr > VAD_UNVOICED_ZCR))
+
+def speech_runs(speech, frame_length, min_length):
+    """
+    :return (tuple): Onsets and offsets (in samples) of the runs of speech frames at least min_length samples long.
+    """
+    edges   = np.diff(np.concatenate([[0], speech.astype(np.int8), [0]]))
+    onsets  = np.flatnonzero(edges ==  1) * frame_length
+    offsets = np.flatnonzero(edges == -1) * frame_length
+    kept    = offsets - onsets >= min_length
+    return onsets[kept], offsets[kept]
+
+def speech_windows(signal, sample_rate, window_sec=1, threshold_db=VAD_THRESHOLD_DB, recenter=False, frame_ms=VAD_FRAME_MS, min_speech_ms=VAD_MIN_SPEECH_MS):
+    """
+    Finds the windows of a signal worth running inference on.
+        :param        signal (ndarray): Mono signal.
+        :param    window_sec     (int): Length of the windows in seconds.
+        :param  threshold_db   (float): Frames at least this loud (RMS in dBFS) are speech.
+        :param      recenter    (bool): Place the windows on the detected speech instead of on whole seconds: a window
+                                        is centered on each utterance (utterances longer than a window are tiled from
+                                        their onset), so that words straddling two seconds are not cut in half.
+        :param min_speech_ms   (float): Ignore speech shorter than this (clicks), and utterance tails shorter than this past a window.
+        :return (list): Start sample of each window, in increasing order. Without recenter, these are the
+                        whole-second windows (of the window_sec * sample_rate long ones) holding any speech.
+    """
+    frame_length    = int(sample_rate * frame_ms / 1000)
+    window_length   = window_sec * sample_rate
+    min_length      = int(sample_rate * min_speech_ms / 1000)
+    num_windows     = len(signal) // window_length
+    onsets, offsets = speech_runs(detect_speech(signal, sample_rate, threshold_db, frame_ms), frame_length, min_length)
+
+    if not recenter:
+        # mark the windows each utterance overlaps, those of the incomplete trailing window are dropped
+        marks = np.zeros(len(signal) // window_length + 2, dtype=np.int64)
+        np.add.at(marks, onsets // window_length, 1)
+        np.add.at(marks, (offsets - 1) // window_length + 1, -1)
+        return (np.flatnonzero(np.cumsum(marks)[:num_windows] > 0) * window_length).tolist()
+
+    if num_windows == 0:
+        return []
+
+    starts  = []
+    covered = 0 # end of the last window
+    for onset, offset in zip(onsets, offsets):
+        onset = max(onset, covered) # the part of the utterance not in the last window already
+        while offset - onset >= min_length:
+            start = (onset + offset) // 2 - window_length // 2 if offset - onset < window_length else onset
+            start = min(max(start, covered), len(signal) - window_length) # no overlap with the last window, nor past the end
+            if starts and start <= starts[-1]:
+                break # the end of the signal, the rest is already in the last window
+            starts.append(int(start))
+            covered = start + window_length
+            onset   = covered
+    return starts
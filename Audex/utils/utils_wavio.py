@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+from collections import namedtuple
+import scipy.signal
+import numpy as np
+import librosa
+import struct
+import math
+import os
+
+WAVE_FORMAT_PCM        = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+WavInfo = namedtuple("WavInfo", ["sample_rate", "num_channels", "bits_per_sample", "format_tag", "data_offset", "num_frames"])
+
+def read_wav_header(af_path):
+    """
+    Reads the RIFF/WAVE header of an audio file, without reading any of the audio data itself.
+        :param af_path (str): Path to the audio file.
+        :return (WavInfo): Format of the audio data, offset of the data chunk in the file and # of frames in it.
+        :raise ValueError: If the file is not a WAV file with PCM or IEEE float audio data.
+    """
+    with open(af_path, "rb") as af:
+        riff, _, wave = struct.unpack("<4sI4s", af.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError("Not a RIFF/WAVE file: " + str(af_path))
+
+        fmt = None
+        while True:
+            chunk_header = af.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError("No data chunk found in WAV file: " + str(af_path))
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+
+            if chunk_id == b"fmt ":
+                fmt_chunk = af.read(chunk_size + (chunk_size & 1)) # chunks are word aligned
+                format_tag, num_channels, sample_rate, _, block_align, bits_per_sample = struct.unpack("<HHIIHH", fmt_chunk[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                    format_tag = struct.unpack("<H", fmt_chunk[24:26])[0] # first two bytes of the subformat GUID
+                fmt = (format_tag, num_channels, sample_rate, block_align, bits_per_sample)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("Data chunk precedes the fmt chunk in WAV file: " + str(af_path))
+                format_tag, num_channels, sample_rate, block_align, bits_per_sample = fmt
+                if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT) or block_align == 0:
+                    raise ValueError("Unsupported WAV format {} in file: {}".format(format_tag, af_path))
+                data_offset = af.tell()
+                # tolerate truncated files and streamed files with an unset (0 or 0xFFFFFFFF) data size
+                data_size = os.fstat(af.fileno()).st_size - data_offset
+                if 0 < chunk_size < data_size:
+                    data_size = chunk_size
+                return WavInfo(sample_rate, num_channels, bits_per_sample, format_tag, data_offset, data_size // block_align)
+            else:
+                af.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+def read_wav_frames(af_path, wav_info, num_frames):
+    """
+    Memory-maps the data chunk of a WAV file and reads only its first num_frames frames.
+        :return (ndarray): float32 samples in [-1, 1] of shape (num_frames, # channels).
+    """
+    num_channels  = wav_info.num_channels
+    bytes_per_sample = wav_info.bits_per_sample // 8
+
+    if wav_info.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        dtype, scale = {4: "<f4", 8: "<f8"}[bytes_per_sample], 1.0
+    elif bytes_per_sample == 3:
+        dtype, scale = "u1", 1.0 / (1 << 23) # 24-bit samples are assembled from bytes below
+    else:
+        dtype, scale = {1: "u1", 2: "<i2", 4: "<i4"}[bytes_per_sample], 1.0 / (1 << (8 * bytes_per_sample - 1))
+
+    if num_frames == 0:
+        return np.zeros((0, num_channels), dtype=np.float32)
+
+    count = num_frames * num_channels * (3 if bytes_per_sample == 3 else 1)
+    data  = np.memmap(af_path, dtype=dtype, mode="r", offset=wav_info.data_offset, shape=(count,))
+
+    if bytes_per_sample == 3:
+        triplets = data.reshape(-1, 3).astype(np.int32)
+        samples  = (triplets[:, 0] | (triplets[:, 1] << 8) | (triplets[:, 2] << 16)) << 8 >> 8 # sign-extend 24 bits
+    elif bytes_per_sample == 1:
+        samples = data.astype(np.int16) - 128 # 8-bit WAV samples are unsigned
+    else:
+        samples = data
+
+    signal = np.multiply(samples, scale, dtype=np.float32)
+    del data # release the memory map (otherwise the file stays locked on Windows)
+    return signal.reshape(num_frames, num_channels)
+
+def resample(signal, orig_sr, target_sr):
+    """
+    Resamples a signal with a polyphase filter. The resulting length is the same as with librosa.resample().
+    """
+    if orig_sr == target_sr:
+        return signal
+    gcd = math.gcd(orig_sr, target_sr)
+    return scipy.signal.resample_poly(signal, target_sr // gcd, orig_sr // gcd).astype(np.float32)
+
+def load_wav(af_path, sr=22050, duration=None):
+    """
+    Fast replacement for librosa.load() on PCM WAV files, with the same semantics and return values:
+    only the frames needed for the requested duration are read (from a memory-mapped data chunk), multichannel
+    audio is downmixed to mono, and resampling is skipped altogether when the file already has the target rate
+    (a fast polyphase resampler is used otherwise). Non-WAV or compressed files are handed over to librosa.load().
+        :param  af_path   (str): Path to the audio file.
+        :param       sr   (int): Target sample rate, or None to keep the native sample rate.
+        :param duration (float): Only load up to this much audio (in seconds).
+        :return signal (ndarray): float32 mono signal.
+        :return     sr     (int): Sample rate of the signal.
+    """
+    try:
+        wav_info = read_wav_header(af_path)
+    except (ValueError, struct.error):
+        return librosa.load(af_path, sr=sr, duration=duration)
+
+    num_frames = wav_info.num_frames
+    if duration is not None:
+        num_frames = min(num_frames, int(duration * wav_info.sample_rate))
+
+    signal = read_wav_frames(af_path, wav_info, num_frames)
+    signal = signal[:, 0] if wav_info.num_channels == 1 else signal.mean(axis=1)
+
+    if sr is None:
+        return signal, wav_info.sample_rate
+    return resample(signal, wav_info.sample_rate, sr), sr
+
+def load_audio(af_path, sr=22050, duration=None, fast_wav=False):
+    """
+    Loads an audio file either with the fast WAV decoder of this module or with librosa.load().
+    """
+    if fast_wav:
+        return load_wav(af_path, sr=sr, duration=duration)
+    return librosa.load(af_path, sr=sr, duration=duration)